@@ -1,12 +1,24 @@
 import os
 import asyncio
 import json
+import logging
 import random
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
 from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
 import numpy as np
 from models import *
+from write_buffer import WriteBehindBuffer
+from pagination import Page, paginate
+from events import EventBus, event_bus
+from emotion import emotion_lexicon
+from memory_features import GROWTH_TOPICS, extract_features, pattern_rollup_pipeline
+from memory_lifecycle import MemoryCompactor
+from memory_retrieval import MemoryRetriever, memory_embedding
+from conversation_sessions import ConversationSessions
+
+logger = logging.getLogger(__name__)
 
 # AI Integration - will use environment variables for real API keys
 try:
@@ -23,11 +35,27 @@ try:
 except ImportError:
     ANTHROPIC_AVAILABLE = False
 
+EVOLUTION_CHECKPOINT = "personality_evolution"
+
 class AdvancedAIService:
-    def __init__(self, db: AsyncIOMotorDatabase):
+    indexes = [
+        ("ai_personalities", [("user_id", 1), ("mode", 1)], {"unique": True}),
+        ("ai_memories", [("id", 1)], {"unique": True}),
+        ("ai_memories", [("user_id", 1), ("memory_type", 1), ("created_at", -1)], {}),
+        ("ai_memories", [("user_id", 1), ("created_at", -1), ("id", -1)], {}),
+        ("ai_memories", [("created_at", -1), ("memory_type", 1)], {})
+    ]
+    
+    def __init__(self, db: AsyncIOMotorDatabase, write_buffer: Optional[WriteBehindBuffer] = None):
         self.db = db
-        self.conversation_memory = {}
+        self.write_buffer = write_buffer or WriteBehindBuffer(db)
+        self.compactor = MemoryCompactor(db)
+        self.retriever = MemoryRetriever(db, self.write_buffer)
+        self.sessions = ConversationSessions(db, self.initialize_ai_personality)
         self.personality_evolution_rate = 0.1
+    
+    def register_event_handlers(self, bus: EventBus):
+        self.retriever.register_event_handlers(bus)
         
     async def initialize_ai_personality(self, user_id: str, mode: PlatformMode) -> AIPersonality:
         """Initialize AI personality for a user in a specific mode"""
@@ -69,19 +97,21 @@ class AdvancedAIService:
     async def generate_advanced_response(self, user_id: str, message: str, mode: PlatformMode, context: Dict[str, Any] = None) -> Dict[str, Any]:
         """Generate advanced AI response with memory and personality"""
         
-        # Get or initialize personality
-        personality = await self.db.ai_personalities.find_one({"user_id": user_id, "mode": mode})
-        if not personality:
-            personality_obj = await self.initialize_ai_personality(user_id, mode)
-            personality = personality_obj.dict()
+        # Get or initialize personality, from the live session when there is one
+        session = await self.sessions.get(user_id, mode)
+        personality = session.personality
         
         # Build personality description
         traits = personality.get("traits", {})
         relationship_score = personality.get("relationship_score", 0.0)
         trust_level = personality.get("trust_level", 0.5)
         
+        # Recall what the user said before that relates to this message
+        recalled = await self.retriever.recall(user_id, message, 3)
+        
         # Generate response using fallback for now (can be upgraded with real APIs)
-        response_data = self.generate_intelligent_response(message, mode, traits, relationship_score)
+        response_data = self.generate_intelligent_response(message, mode, traits, relationship_score, session.recent_responses)
+        session.add_turn(message, response_data["response"])
         
         # Store interaction as memory
         await self.store_memory(
@@ -92,25 +122,188 @@ class AdvancedAIService:
         
         return {
             **response_data,
+            "recalled_memories": recalled,
             "personality_state": traits,
             "relationship_score": relationship_score,
             "trust_level": trust_level
         }
     
-    async def store_memory(self, user_id: str, memory_type: str, content: str, metadata: Dict[str, Any] = None) -> AIMemory:
-        """Store a memory for AI to recall later"""
+    async def get_personality(self, user_id: str, mode: PlatformMode) -> AIPersonality:
+        """Get or initialize the personality the user talks to in a mode"""
+        return AIPersonality(**(await self.sessions.get(user_id, mode)).personality)
+    
+    async def get_memories(self, user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Page:
+        """Get a user's memories, newest first"""
+        return await paginate(
+            self.db.ai_memories,
+            {"user_id": user_id},
+            [("created_at", -1), ("id", -1)],
+            (datetime, str),
+            limit,
+            cursor,
+            projection={"_id": 0, "embedding": 0}
+        )
+    
+    async def recall_memories(self, user_id: str, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Get the user's memories most relevant to a query"""
+        return await self.retriever.recall(user_id, query, limit)
+    
+    async def store_memory(self, user_id: str, memory_type: str, content: str, metadata: Dict[str, Any] = None, buffered: bool = False) -> AIMemory:
+        """Store a memory for AI to recall later, optionally through the write-behind buffer"""
         memory = AIMemory(
             user_id=user_id,
             memory_type=memory_type,
             content=content,
             metadata=metadata or {},
-            importance_score=self.calculate_importance_score(content, metadata)
+            importance_score=self.calculate_importance_score(content, metadata),
+            features=extract_features(content),
+            embedding=memory_embedding(content)
         )
+        document = memory.dict()
+        
+        if buffered:
+            await self.write_buffer.insert("ai_memories", document)
+        else:
+            await self.db.ai_memories.insert_one(document)
+        self.retriever.add(document)
         
-        await self.db.ai_memories.insert_one(memory.dict())
+        await event_bus.publish("memory_stored", user_id=user_id, memory_type=memory_type)
         return memory
     
-    def generate_intelligent_response(self, message: str, mode: PlatformMode, traits: Dict[str, float], relationship_score: float) -> Dict[str, Any]:
+    async def evolve_personality(self, user_id: str, mode: PlatformMode, feedback: Dict[str, Any] = None) -> Optional[AIPersonality]:
+        """Evolve a single personality from the user's last 24h of memories"""
+        since = datetime.utcnow() - timedelta(hours=24)
+        stats = await self.db.ai_memories.aggregate([
+            {"$match": {"user_id": user_id, "created_at": {"$gte": since}}},
+            {"$group": {"_id": "$user_id", "memory_count": {"$sum": 1}, "avg_importance": {"$avg": "$importance_score"}}}
+        ]).to_list(1)
+        if not stats:
+            return None
+        
+        # Recomputed from the newer personality when another worker changed it first
+        for _ in range(3):
+            session = self.sessions.peek(user_id, mode)
+            if session is not None:
+                personality = session.personality
+            else:
+                personality = await self.db.ai_personalities.find_one({"user_id": user_id, "mode": mode}, {"_id": 0})
+            if not personality:
+                return None
+            
+            updates = self.compute_personality_evolution([personality], {user_id: stats[0]}, feedback)
+            version = personality.get("version", 0)
+            if await self.sessions.update(user_id, mode, version, updates[0][1]):
+                return AIPersonality(**{**personality, **updates[0][1], "version": version + 1})
+        return None
+    
+    async def run_personality_evolution(self, page_size: int = 500, feedback: Dict[str, Any] = None) -> int:
+        """Evolve every personality with recent memories, one page of users at a time.
+        
+        Progress is checkpointed in job_checkpoints so an interrupted run resumes
+        after the last user it finished.
+        """
+        checkpoint = await self.db.job_checkpoints.find_one({"_id": EVOLUTION_CHECKPOINT}) or {}
+        since = checkpoint.get("since") or datetime.utcnow() - timedelta(hours=24)
+        last_user_id = checkpoint.get("last_user_id", "")
+        processed = 0
+        
+        # One pass over the recent window, streamed page by page from a single cursor
+        cursor = self.db.ai_memories.aggregate([
+            {"$match": {"created_at": {"$gte": since}, "user_id": {"$gt": last_user_id}}},
+            {"$group": {"_id": "$user_id", "memory_count": {"$sum": 1}, "avg_importance": {"$avg": "$importance_score"}}},
+            {"$sort": {"_id": 1}}
+        ], allowDiskUse=True, batchSize=page_size)
+        
+        page = []
+        async for row in cursor:
+            page.append(row)
+            if len(page) == page_size:
+                await self.evolve_page(page, since, feedback)
+                processed += len(page)
+                page = []
+        if page:
+            await self.evolve_page(page, since, feedback)
+            processed += len(page)
+        
+        # Run completed, the next one starts from a fresh window
+        await self.db.job_checkpoints.delete_one({"_id": EVOLUTION_CHECKPOINT})
+        return processed
+    
+    async def evolve_page(self, page: List[Dict[str, Any]], since: datetime, feedback: Dict[str, Any] = None):
+        """Evolve one page of users' personalities from their window stats, then checkpoint past them"""
+        # Live sessions are at least as new as Mongo; stale ones lose the version check below
+        stats = {row["_id"]: row for row in page}
+        personalities = await self.db.ai_personalities.find({"user_id": {"$in": list(stats)}}, {"_id": 0}).to_list(None)
+        for i, personality in enumerate(personalities):
+            session = self.sessions.peek(personality["user_id"], personality["mode"])
+            if session is not None:
+                personalities[i] = session.personality
+        updates = self.compute_personality_evolution(personalities, stats, feedback)
+        if updates:
+            owners = {p["id"]: (p["user_id"], p["mode"], p.get("version", 0)) for p in personalities}
+            conflicts = await self.sessions.update_many([(*owners[pid], fields) for pid, fields in updates])
+            if conflicts:
+                # Changed elsewhere during the page; the next run evolves them from the newer version
+                logger.info(f"Skipped evolving {len(conflicts)} personalities changed concurrently")
+        
+        await self.db.job_checkpoints.update_one(
+            {"_id": EVOLUTION_CHECKPOINT},
+            {"$set": {"since": since, "last_user_id": page[-1]["_id"], "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+    
+    def compute_personality_evolution(self, personalities: List[Dict[str, Any]], stats: Dict[str, Dict[str, Any]], feedback: Dict[str, Any] = None) -> List[tuple]:
+        """Vectorized trait, relationship and trust update for many personalities.
+        
+        Returns (personality_id, fields_to_set) pairs.
+        """
+        feedback = feedback or {}
+        quality_score = feedback.get("quality_score", 0.7)
+        trust_factor = feedback.get("trust_factor", 0.6)
+        preferred_traits = feedback.get("preferred_traits", {})
+        now = datetime.utcnow()
+        updates = []
+        
+        # Trait names differ per mode, so each mode is evolved as its own matrix
+        by_mode: Dict[str, List[Dict[str, Any]]] = {}
+        for personality in personalities:
+            if personality["user_id"] in stats:
+                by_mode.setdefault(personality["mode"], []).append(personality)
+        
+        for group in by_mode.values():
+            trait_names = sorted({name for p in group for name in p.get("traits", {})})
+            traits = np.array([[p.get("traits", {}).get(name, 0.5) for name in trait_names] for p in group], dtype=float).reshape(len(group), len(trait_names))
+            relationship = np.array([p.get("relationship_score", 0.0) for p in group])
+            trust = np.array([p.get("trust_level", 0.5) for p in group])
+            rate = np.array([p.get("adaptation_rate", self.personality_evolution_rate) for p in group])
+            memory_count = np.array([stats[p["user_id"]]["memory_count"] for p in group], dtype=float)
+            importance = np.array([stats[p["user_id"]].get("avg_importance") or 0.5 for p in group])
+            
+            # Saturating engagement: a handful of interactions already counts
+            step = rate * (1.0 - np.exp(-memory_count / 10.0))
+            
+            # Meaningful conversations reinforce traits, shallow ones let them relax;
+            # explicitly preferred traits pull towards the requested value instead
+            target = np.clip(traits + (importance[:, None] - 0.5), 0.0, 1.0)
+            for column, name in enumerate(trait_names):
+                if name in preferred_traits:
+                    target[:, column] = preferred_traits[name]
+            
+            traits = np.clip(traits + step[:, None] * (target - traits), 0.0, 1.0)
+            relationship = np.clip(relationship + step * quality_score * (1.0 - relationship), 0.0, 1.0)
+            trust = np.clip(trust + step * (trust_factor - trust), 0.0, 1.0)
+            
+            for row, personality in enumerate(group):
+                updates.append((personality["id"], {
+                    "traits": {name: round(float(traits[row, column]), 4) for column, name in enumerate(trait_names)},
+                    "relationship_score": round(float(relationship[row]), 4),
+                    "trust_level": round(float(trust[row]), 4),
+                    "last_evolution": now
+                }))
+        
+        return updates
+    
+    def generate_intelligent_response(self, message: str, mode: PlatformMode, traits: Dict[str, float], relationship_score: float, recent_responses: Sequence[str] = ()) -> Dict[str, Any]:
         """Generate intelligent response based on personality traits"""
         
         # Emotion analysis
@@ -171,6 +364,8 @@ class AdvancedAIService:
             if relationship_score > 0.5:
                 responses = [r + " I've seen you handle harder challenges." for r in responses]
         
+        # Don't repeat what was said in the last few turns while there is an alternative
+        responses = [r for r in responses if r not in recent_responses] or responses
         selected_response = random.choice(responses)
         suggestions = self.generate_contextual_suggestions(message, mode)
         
@@ -183,29 +378,11 @@ class AdvancedAIService:
     
     def analyze_emotion_tone(self, text: str) -> Dict[str, float]:
         """Advanced emotion analysis"""
-        # Enhanced emotion keywords
-        emotion_keywords = {
-            "joy": ["happy", "excited", "amazing", "wonderful", "great", "love", "awesome", "fantastic"],
-            "sadness": ["sad", "down", "depressed", "lonely", "hurt", "pain", "crying", "grief"],
-            "anger": ["angry", "mad", "furious", "irritated", "frustrated", "annoyed", "rage"],
-            "fear": ["scared", "afraid", "worried", "anxious", "nervous", "terrified", "panic"],
-            "surprise": ["surprised", "shocked", "unexpected", "sudden", "wow", "amazing"],
-            "trust": ["trust", "confident", "secure", "safe", "reliable", "certain"],
-            "anticipation": ["excited", "looking forward", "can't wait", "hoping", "expecting"]
-        }
-        
-        text_lower = text.lower()
-        emotions = {}
-        
-        for emotion, keywords in emotion_keywords.items():
-            score = sum(1 for keyword in keywords if keyword in text_lower)
-            emotions[emotion] = score / max(len(keywords), 1)
-        
-        # Add randomness for more natural responses
-        for emotion in emotions:
-            emotions[emotion] += random.uniform(0, 0.3)
-        
-        return emotions
+        return emotion_lexicon.score(text)
+    
+    def analyze_emotion_tones(self, texts: List[str]) -> np.ndarray:
+        """Emotion scores of many texts at once, one row per text in EMOTION_KEYWORDS order"""
+        return emotion_lexicon.score_many(texts)
     
     def generate_contextual_suggestions(self, message: str, mode: PlatformMode) -> List[str]:
         """Generate contextual suggestions based on message content"""
@@ -266,21 +443,21 @@ class AdvancedAIService:
     async def analyze_user_patterns(self, user_id: str) -> Dict[str, Any]:
         """Analyze user behavioral patterns for insights"""
         
-        # Get user's conversation history
-        memories = await self.db.ai_memories.find({
-            "user_id": user_id,
-            "memory_type": "conversation"
-        }).to_list(100)
+        # Roll up the stored features of the user's recent conversations
+        rollups = await self.db.ai_memories.aggregate(
+            pattern_rollup_pipeline({"user_id": user_id, "memory_type": "conversation"}, 100)
+        ).to_list(1)
         
-        if not memories:
+        if not rollups or not rollups[0]["memories"]:
             return {"patterns": [], "insights": [], "recommendations": []}
+        rollup = rollups[0]
         
         # Analyze patterns
         patterns = {
-            "communication_style": self.analyze_communication_style(memories),
-            "emotional_patterns": self.analyze_emotional_patterns(memories),
-            "growth_areas": self.identify_growth_areas(memories),
-            "interaction_frequency": len(memories)
+            "communication_style": self.analyze_communication_style(rollup),
+            "emotional_patterns": self.analyze_emotional_patterns(rollup),
+            "growth_areas": self.identify_growth_areas(rollup),
+            "interaction_frequency": rollup["memories"]
         }
         
         # Generate insights
@@ -294,29 +471,12 @@ class AdvancedAIService:
             "analysis_date": datetime.utcnow().isoformat()
         }
     
-    def analyze_communication_style(self, memories: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def analyze_communication_style(self, rollup: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze how user communicates"""
-        total_words = 0
-        question_count = 0
-        emotional_expressions = 0
-        
-        for memory in memories:
-            content = memory.get("content", "")
-            if "User:" in content:
-                user_part = content.split("User:")[1].split("AI:")[0] if "AI:" in content else content.split("User:")[1]
-                words = len(user_part.split())
-                total_words += words
-                
-                if "?" in user_part:
-                    question_count += 1
-                
-                emotions = self.analyze_emotion_tone(user_part)
-                if max(emotions.values()) > 0.3:
-                    emotional_expressions += 1
-        
-        avg_words = total_words / max(len(memories), 1)
-        question_ratio = question_count / max(len(memories), 1)
-        emotional_ratio = emotional_expressions / max(len(memories), 1)
+        memories = max(rollup.get("memories", 0), 1)
+        avg_words = rollup.get("total_words", 0) / memories
+        question_ratio = rollup.get("questions", 0) / memories
+        emotional_ratio = rollup.get("emotional", 0) / memories
         
         return {
             "average_message_length": avg_words,
@@ -325,47 +485,47 @@ class AdvancedAIService:
             "communication_depth": "high" if avg_words > 20 else "medium" if avg_words > 10 else "low"
         }
     
-    def analyze_emotional_patterns(self, memories: List[Dict[str, Any]]) -> Dict[str, float]:
+    def analyze_emotional_patterns(self, rollup: Dict[str, Any]) -> Dict[str, float]:
         """Analyze emotional patterns over time"""
-        emotion_history = []
-        
-        for memory in memories:
-            content = memory.get("content", "")
-            if "User:" in content:
-                user_part = content.split("User:")[1].split("AI:")[0] if "AI:" in content else content.split("User:")[1]
-                emotions = self.analyze_emotion_tone(user_part)
-                emotion_history.append(emotions)
-        
-        # Calculate average emotions
-        if not emotion_history:
-            return {}
-        
-        avg_emotions = {}
-        for emotion in emotion_history[0].keys():
-            avg_emotions[emotion] = sum(e.get(emotion, 0) for e in emotion_history) / len(emotion_history)
-        
-        return avg_emotions
+        return {
+            emotion: rollup[f"emotion_{emotion}"]
+            for emotion in emotion_lexicon.emotions
+            if rollup.get(f"emotion_{emotion}") is not None
+        }
     
-    def identify_growth_areas(self, memories: List[Dict[str, Any]]) -> List[str]:
+    def identify_growth_areas(self, rollup: Dict[str, Any]) -> List[str]:
         """Identify areas for potential growth"""
-        growth_areas = []
-        
-        # Analyze for recurring themes
-        recurring_topics = ["fear", "confidence", "relationships", "purpose", "creativity", "change"]
-        topic_counts = {}
-        
-        for memory in memories:
-            content = memory.get("content", "").lower()
-            for topic in recurring_topics:
-                if topic in content:
-                    topic_counts[topic] = topic_counts.get(topic, 0) + 1
+        topic_counts = {topic: rollup.get(f"topic_{topic}", 0) for topic in GROWTH_TOPICS}
         
         # Identify top recurring themes as growth areas
-        for topic, count in sorted(topic_counts.items(), key=lambda x: x[1], reverse=True)[:3]:
-            if count >= 2:  # Minimum threshold
-                growth_areas.append(topic)
-        
-        return growth_areas
+        return [
+            topic
+            for topic, count in sorted(topic_counts.items(), key=lambda x: x[1], reverse=True)[:3]
+            if count >= 2  # Minimum threshold
+        ]
+    
+    async def backfill_memory_features(self, batch_size: int = 500) -> int:
+        """Extract features and embeddings for memories stored before they were computed at write time"""
+        backfilled = 0
+        while True:
+            memories = await self.db.ai_memories.find(
+                {"$or": [{"features": None}, {"embedding": None}]},
+                {"_id": 0, "id": 1, "content": 1}
+            ).limit(batch_size).to_list(batch_size)
+            if not memories:
+                return backfilled
+            
+            await self.db.ai_memories.bulk_write([
+                UpdateOne(
+                    {"id": memory["id"]},
+                    {"$set": {
+                        "features": extract_features(memory.get("content", "")).dict(),
+                        "embedding": memory_embedding(memory.get("content", ""))
+                    }}
+                )
+                for memory in memories
+            ], ordered=False)
+            backfilled += len(memories)
     
     def generate_behavioral_insights(self, patterns: Dict[str, Any]) -> List[str]:
         """Generate insights based on behavioral patterns"""
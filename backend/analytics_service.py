@@ -1,13 +1,91 @@
+import os
 import asyncio
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
 import json
 from models import *
+from unit_of_work import load_user
+from cache import SWRCache
+from events import EventBus
+from write_buffer import WriteBehindBuffer
+from memory_lifecycle import memory_count_pipeline
+from ai_service import AdvancedAIService
+from social_service import SocialService
 
 class AnalyticsService:
-    def __init__(self, db: AsyncIOMotorDatabase):
+    indexes = [
+        ("users", [("last_active", -1)], {}),
+        ("users", [("created_at", -1)], {}),
+        ("users", [("current_mode", 1)], {}),
+        ("user_sessions", [("id", 1)], {"unique": True}),
+        ("user_sessions", [("user_id", 1), ("start_time", -1)], {}),
+        ("user_sessions", [("start_time", -1)], {}),
+        ("user_analytics", [("user_id", 1)], {"unique": True}),
+        ("user_analytics", [("dirty", 1)], {"partialFilterExpression": {"dirty": True}}),
+        ("behaviors", [("user_id", 1), ("timestamp", -1)], {}),
+        ("funnel_snapshots", [("date", 1)], {"unique": True})
+    ]
+    
+    def __init__(self, db: AsyncIOMotorDatabase, write_buffer: Optional[WriteBehindBuffer] = None, ai_service: Optional[AdvancedAIService] = None, social_service: Optional[SocialService] = None):
         self.db = db
+        self.write_buffer = write_buffer or WriteBehindBuffer(db)
+        self.ai_service = ai_service or AdvancedAIService(db, self.write_buffer)
+        self.social_service = social_service or SocialService(db, self.write_buffer)
+        
+        # Dashboards poll platform analytics; serve them from cache and refresh in the background
+        self.platform_cache = SWRCache(
+            ttl=float(os.environ.get("PLATFORM_ANALYTICS_TTL", 60)),
+            stale_ttl=float(os.environ.get("PLATFORM_ANALYTICS_STALE_TTL", 300))
+        )
+    
+    # Running per-user aggregates kept in user_analytics, bumped with $inc as activity happens
+    counter_fields = [
+        "total_sessions",
+        "total_time_minutes",
+        "total_ai_interactions",
+        "posts_count",
+        "comments_count",
+        "connections_count",
+        "challenges_count"
+    ]
+    
+    def register_event_handlers(self, bus: EventBus):
+        """Keep running aggregates current from social activity events"""
+        async def on_post_created(user_id: str, **_):
+            await self.record_activity(user_id, {"posts_count": 1})
+        
+        async def on_comment_created(user_id: str, **_):
+            await self.record_activity(user_id, {"comments_count": 1})
+        
+        async def on_connection_accepted(requester_id: str, target_id: str, **_):
+            await self.record_activity(requester_id, {"connections_count": 1})
+            await self.record_activity(target_id, {"connections_count": 1})
+        
+        async def on_challenge_joined(user_id: str, **_):
+            await self.record_activity(user_id, {"challenges_count": 1})
+        
+        async def on_journey_step_saved(user_id: str, **_):
+            await self.record_activity(user_id)
+        
+        bus.subscribe("post_created", on_post_created)
+        bus.subscribe("comment_created", on_comment_created)
+        bus.subscribe("connection_accepted", on_connection_accepted)
+        bus.subscribe("challenge_joined", on_challenge_joined)
+        bus.subscribe("journey_step_saved", on_journey_step_saved)
+    
+    async def record_activity(self, user_id: str, counters: Dict[str, int] = None, session_start: datetime = None):
+        """Apply activity to the user's running aggregates and mark them for reconciliation"""
+        # version lets a concurrent recompute detect activity it did not count
+        update = {"$set": {"dirty": True}, "$inc": {**(counters or {}), "version": 1}}
+        if session_start:
+            update["$min"] = {"first_activity_at": session_start}
+            update["$max"] = {"last_activity_at": session_start}
+            update["$addToSet"] = {"active_days": session_start.strftime("%Y-%m-%d")}
+        
+        await self.write_buffer.update_one("user_analytics", {"user_id": user_id}, update, upsert=True)
     
     async def track_user_session(self, user_id: str, session_data: Dict[str, Any]) -> UserSession:
         """Track a user session"""
@@ -20,7 +98,13 @@ class AnalyticsService:
             ai_interactions=session_data.get("ai_interactions", 0)
         )
         
+        # Inserted directly so the session can be ended right away
         await self.db.user_sessions.insert_one(session.dict())
+        await self.record_activity(
+            user_id,
+            {"total_sessions": 1, "total_ai_interactions": session.ai_interactions},
+            session_start=session.start_time
+        )
         return session
     
     async def end_user_session(self, session_id: str) -> bool:
@@ -34,8 +118,8 @@ class AnalyticsService:
         start_time = session["start_time"]
         duration = int((end_time - start_time).total_seconds() / 60)
         
-        await self.db.user_sessions.update_one(
-            {"id": session_id},
+        result = await self.db.user_sessions.update_one(
+            {"id": session_id, "end_time": None},
             {
                 "$set": {
                     "end_time": end_time,
@@ -44,153 +128,224 @@ class AnalyticsService:
             }
         )
         
+        # Only the first end of a session counts towards total time
+        if result.modified_count > 0:
+            await self.record_activity(session["user_id"], {"total_time_minutes": duration})
+        
         return True
     
-    async def calculate_user_analytics(self, user_id: str) -> UserAnalytics:
-        """Calculate comprehensive user analytics"""
-        
-        # Get all sessions
-        sessions = await self.db.user_sessions.find({"user_id": user_id}).to_list(1000)
+    async def get_user_analytics(self, user_id: str) -> UserAnalytics:
+        """Serve analytics from the running aggregates with a single point read"""
+        aggregates = await self.db.user_analytics.find_one({"user_id": user_id})
+        if not aggregates or not aggregates.get("seeded"):
+            # Never materialized, or only holds increments since events started: seed it once
+            return await self.calculate_user_analytics(user_id)
+        
+        return self.derive_user_analytics(aggregates)
+    
+    async def calculate_user_analytics(self, user_id: str, flush: bool = True) -> UserAnalytics:
+        """Recompute analytics from source collections and reseed the running aggregates"""
+        # Buffered $incs must land before counting, or they would be applied on top of counts that include them
+        if flush:
+            await self.write_buffer.flush()
         
-        if not sessions:
-            return UserAnalytics(user_id=user_id)
+        current = await self.db.user_analytics.find_one({"user_id": user_id}, {"_id": 0, "version": 1})
+        version = current.get("version") if current else None
         
-        # Calculate metrics
-        total_sessions = len(sessions)
-        total_time = sum(s.get("duration_minutes", 0) for s in sessions)
-        avg_duration = total_time / total_sessions if total_sessions > 0 else 0
+        sessions = await self.db.user_sessions.find(
+            {"user_id": user_id},
+            {"start_time": 1, "duration_minutes": 1, "ai_interactions": 1}
+        ).to_list(None)
+        user = await load_user(self.db, user_id) or {}
+        start_times = [s["start_time"] for s in sessions]
         
-        # Journey completion rate
-        user = await self.db.users.find_one({"id": user_id})
-        journey_progress = user.get("journey_progress", {}) if user else {}
-        journey_completion = len(journey_progress) / 4.0  # 4 total steps
+        aggregates = {
+            "user_id": user_id,
+            "total_sessions": len(sessions),
+            "total_time_minutes": sum(s.get("duration_minutes", 0) for s in sessions),
+            "total_ai_interactions": sum(s.get("ai_interactions", 0) for s in sessions),
+            "posts_count": await self.db.posts.count_documents({"user_id": user_id}),
+            "comments_count": await self.db.comments.count_documents({"user_id": user_id}),
+            "connections_count": len(user.get("connections", [])),
+            "challenges_count": await self.db.challenges.count_documents({"participants": user_id}),
+            "journey_steps": len(user.get("journey_progress", {})),
+            "active_days": sorted({t.strftime("%Y-%m-%d") for t in start_times}),
+            "first_activity_at": min(start_times) if start_times else None,
+            "last_activity_at": max(start_times) if start_times else None,
+            "seeded": True,
+            "dirty": False
+        }
         
-        # AI interaction frequency
-        total_interactions = sum(s.get("ai_interactions", 0) for s in sessions)
-        ai_frequency = total_interactions / max(total_sessions, 1)
+        analytics = self.derive_user_analytics(aggregates)
         
-        # Social engagement score
-        social_score = await self.calculate_social_engagement_score(user_id)
+        # Only store if no activity landed since the counts were taken; otherwise the
+        # document stays dirty and the next reconcile pass recomputes it
+        try:
+            await self.db.user_analytics.update_one(
+                {"user_id": user_id, "version": version} if version is not None else {"user_id": user_id, "version": {"$exists": False}},
+                {"$set": {**aggregates, **analytics.dict()}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass
         
-        # Retention score
-        retention_score = await self.calculate_retention_score(user_id, sessions)
+        return analytics
+    
+    def derive_user_analytics(self, aggregates: Dict[str, Any]) -> UserAnalytics:
+        """Turn running aggregates into the UserAnalytics view"""
+        total_sessions = aggregates.get("total_sessions", 0)
+        total_time = aggregates.get("total_time_minutes", 0)
         
-        analytics = UserAnalytics(
-            user_id=user_id,
+        return UserAnalytics(
+            user_id=aggregates["user_id"],
             total_sessions=total_sessions,
             total_time_minutes=total_time,
-            avg_session_duration=avg_duration,
-            journey_completion_rate=journey_completion,
-            ai_interaction_frequency=ai_frequency,
-            social_engagement_score=social_score,
-            retention_score=retention_score
-        )
-        
-        # Store analytics
-        await self.db.user_analytics.replace_one(
-            {"user_id": user_id},
-            analytics.dict(),
-            upsert=True
+            avg_session_duration=total_time / total_sessions if total_sessions > 0 else 0,
+            journey_completion_rate=aggregates.get("journey_steps", 0) / 4.0,  # 4 total steps
+            ai_interaction_frequency=aggregates.get("total_ai_interactions", 0) / max(total_sessions, 1),
+            social_engagement_score=self.calculate_social_engagement_score(aggregates),
+            retention_score=self.calculate_retention_score(aggregates),
+            last_calculated=aggregates.get("last_calculated", datetime.utcnow())
         )
-        
-        return analytics
     
-    async def calculate_social_engagement_score(self, user_id: str) -> float:
+    @staticmethod
+    def calculate_social_engagement_score(aggregates: Dict[str, Any]) -> float:
         """Calculate social engagement score"""
-        
-        # Posts created
-        posts_count = await self.db.posts.count_documents({"user_id": user_id})
-        
-        # Comments made
-        comments_count = await self.db.comments.count_documents({"user_id": user_id})
-        
-        # Connections
-        user = await self.db.users.find_one({"id": user_id})
-        connections_count = len(user.get("connections", [])) if user else 0
-        
-        # Challenges participated
-        challenges_count = await self.db.challenges.count_documents({"participants": user_id})
-        
-        # Calculate weighted score
         score = (
-            posts_count * 10 +
-            comments_count * 5 +
-            connections_count * 2 +
-            challenges_count * 15
+            aggregates.get("posts_count", 0) * 10 +
+            aggregates.get("comments_count", 0) * 5 +
+            aggregates.get("connections_count", 0) * 2 +
+            aggregates.get("challenges_count", 0) * 15
         )
         
         # Normalize to 0-100 scale
         return min(100, score / 2)
     
-    async def calculate_retention_score(self, user_id: str, sessions: List[Dict[str, Any]]) -> float:
+    @staticmethod
+    def calculate_retention_score(aggregates: Dict[str, Any]) -> float:
         """Calculate user retention score"""
-        
-        if not sessions:
+        first_activity = aggregates.get("first_activity_at")
+        if not first_activity:
             return 0.0
         
         # Days since first session
-        first_session = min(sessions, key=lambda x: x["start_time"])
-        days_since_start = (datetime.utcnow() - first_session["start_time"]).days
+        days_since_start = (datetime.utcnow() - first_activity).days
         
         if days_since_start == 0:
             return 100.0
         
-        # Unique days with sessions
-        session_dates = set()
-        for session in sessions:
-            session_dates.add(session["start_time"].date())
-        
-        unique_days = len(session_dates)
-        
         # Calculate retention as percentage of days with activity
+        unique_days = len(aggregates.get("active_days", []))
         retention = (unique_days / max(days_since_start, 1)) * 100
         
         return min(100, retention)
     
-    async def get_platform_analytics(self) -> Dict[str, Any]:
-        """Get overall platform analytics"""
+    async def reconcile_dirty_analytics(self, batch_size: int = 500) -> int:
+        """Refresh derived fields for users whose aggregates changed since the last pass"""
+        reconciled = 0
+        
+        while True:
+            page = await self.db.user_analytics.find({"dirty": True}).limit(batch_size).to_list(batch_size)
+            if not page:
+                break
+            
+            # Documents created by an $inc upsert only hold partial counts; seed them from the source collections
+            unseeded = [doc for doc in page if not doc.get("seeded")]
+            if unseeded:
+                await self.write_buffer.flush()
+                for doc in unseeded:
+                    await self.calculate_user_analytics(doc["user_id"], flush=False)
+            
+            dirty = [doc for doc in page if doc.get("seeded")]
+            
+            # Journey progress and connections live on the user, fetch them for the whole page
+            user_ids = [doc["user_id"] for doc in dirty]
+            users = await self.db.users.find(
+                {"id": {"$in": user_ids}},
+                {"id": 1, "journey_progress": 1, "connections": 1}
+            ).to_list(None)
+            users_by_id = {user["id"]: user for user in users}
+            
+            now = datetime.utcnow()
+            operations = []
+            for doc in dirty:
+                user = users_by_id.get(doc["user_id"], {})
+                corrections = {
+                    "journey_steps": len(user.get("journey_progress", {})),
+                    "connections_count": len(user.get("connections", [])),
+                    "last_calculated": now
+                }
+                analytics = self.derive_user_analytics({**doc, **corrections})
+                operations.append(UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {**corrections, **analytics.dict(exclude={"user_id"}), "dirty": False}}
+                ))
+            
+            if operations:
+                await self.db.user_analytics.bulk_write(operations, ordered=False)
+            reconciled += len(page)
+            
+            if len(page) < batch_size:
+                break
         
-        # User metrics
-        total_users = await self.db.users.count_documents({})
-        active_users_30d = await self.db.users.count_documents({
-            "last_active": {"$gte": datetime.utcnow() - timedelta(days=30)}
-        })
-        active_users_7d = await self.db.users.count_documents({
-            "last_active": {"$gte": datetime.utcnow() - timedelta(days=7)}
-        })
+        return reconciled
+    
+    async def get_platform_analytics(self) -> Dict[str, Any]:
+        """Get overall platform analytics, cached with stale-while-revalidate"""
+        return await self.platform_cache.get("platform", self.compute_platform_analytics)
+    
+    async def compute_platform_analytics(self) -> Dict[str, Any]:
+        """Compute platform analytics with one aggregation per collection, run concurrently"""
+        now = datetime.utcnow()
         
-        # Content metrics
-        total_posts = await self.db.posts.count_documents({})
-        total_comments = await self.db.comments.count_documents({})
-        total_challenges = await self.db.challenges.count_documents({})
+        user_facets, total_posts, total_comments, total_challenges, ai_conversations = await asyncio.gather(
+            self.db.users.aggregate([
+                {"$facet": {
+                    "total": [{"$count": "count"}],
+                    "active_30d": [
+                        {"$match": {"last_active": {"$gte": now - timedelta(days=30)}}},
+                        {"$count": "count"}
+                    ],
+                    "active_7d": [
+                        {"$match": {"last_active": {"$gte": now - timedelta(days=7)}}},
+                        {"$count": "count"}
+                    ],
+                    "modes": [
+                        {"$group": {"_id": "$current_mode", "count": {"$sum": 1}}}
+                    ],
+                    # Completed journey steps per user, bucketed 1..4
+                    "journey": [
+                        {"$project": {"steps": {"$size": {"$objectToArray": {"$ifNull": ["$journey_progress", {}]}}}}},
+                        {"$match": {"steps": {"$gt": 0}}},
+                        {"$bucket": {
+                            "groupBy": {"$min": ["$steps", 4]},
+                            "boundaries": [1, 2, 3, 4, 5],
+                            "output": {"count": {"$sum": 1}}
+                        }}
+                    ]
+                }}
+            ]).to_list(1),
+            self.db.posts.estimated_document_count(),
+            self.db.comments.estimated_document_count(),
+            self.db.challenges.estimated_document_count(),
+            self.db.ai_memories.aggregate(memory_count_pipeline("conversation")).to_list(1)
+        )
         
-        # Engagement metrics
-        ai_conversations = await self.db.ai_memories.count_documents({"memory_type": "conversation"})
+        facets = user_facets[0] if user_facets else {}
+        ai_conversations = ai_conversations[0]["count"] if ai_conversations else 0
         
-        # Mode distribution
-        echoverse_users = await self.db.users.count_documents({"current_mode": "echoverse"})
-        egocore_users = await self.db.users.count_documents({"current_mode": "egocore"})
+        def facet_count(name: str) -> int:
+            rows = facets.get(name, [])
+            return rows[0]["count"] if rows else 0
         
-        # Journey completion stats
-        users_with_progress = await self.db.users.find({
-            "journey_progress": {"$exists": True, "$ne": {}}
-        }).to_list(1000)
+        total_users = facet_count("total")
+        active_users_30d = facet_count("active_30d")
+        active_users_7d = facet_count("active_7d")
+        modes = {row["_id"]: row["count"] for row in facets.get("modes", [])}
         
         completion_stats = {"0": 0, "25": 0, "50": 0, "75": 0, "100": 0}
-        for user in users_with_progress:
-            progress = len(user.get("journey_progress", {}))
-            completion_percent = int((progress / 4) * 100)
-            
-            if completion_percent == 0:
-                completion_stats["0"] += 1
-            elif completion_percent <= 25:
-                completion_stats["25"] += 1
-            elif completion_percent <= 50:
-                completion_stats["50"] += 1
-            elif completion_percent <= 75:
-                completion_stats["75"] += 1
-            else:
-                completion_stats["100"] += 1
+        for row in facets.get("journey", []):
+            completion_stats[str(row["_id"] * 25)] = row["count"]
         
         return {
             "users": {
@@ -207,14 +362,14 @@ class AnalyticsService:
             },
             "engagement": {
                 "mode_distribution": {
-                    "echoverse": echoverse_users,
-                    "egocore": egocore_users
+                    "echoverse": modes.get("echoverse", 0),
+                    "egocore": modes.get("egocore", 0)
                 },
                 "journey_completion": completion_stats,
                 "avg_posts_per_user": total_posts / max(total_users, 1),
                 "avg_ai_conversations_per_user": ai_conversations / max(total_users, 1)
             },
-            "generated_at": datetime.utcnow().isoformat()
+            "generated_at": now.isoformat()
         }
     
     async def get_real_time_metrics(self) -> Dict[str, Any]:
@@ -233,7 +388,7 @@ class AnalyticsService:
             "created_at": {"$gte": one_hour_ago}
         })
         
-        # AI interactions in last hour
+        # AI interactions in last hour; memories this young are never compacted into summaries
         ai_interactions = await self.db.ai_memories.count_documents({
             "created_at": {"$gte": one_hour_ago},
             "memory_type": "conversation"
@@ -256,17 +411,13 @@ class AnalyticsService:
         """Generate comprehensive insights report for user"""
         
         # Get user analytics
-        analytics = await self.calculate_user_analytics(user_id)
+        analytics = await self.get_user_analytics(user_id)
         
         # Get AI analysis
-        from ai_service import AdvancedAIService
-        ai_service = AdvancedAIService(self.db)
-        patterns = await ai_service.analyze_user_patterns(user_id)
+        patterns = await self.ai_service.analyze_user_patterns(user_id)
         
         # Get social stats
-        from social_service import SocialService
-        social_service = SocialService(self.db)
-        social_stats = await social_service.get_user_stats(user_id)
+        social_stats = await self.social_service.get_user_stats(user_id)
         
         # Generate recommendations
         recommendations = await self.generate_personalized_recommendations(user_id, analytics, patterns, social_stats)
@@ -300,7 +451,7 @@ class AnalyticsService:
             recommendations.append("Connect with others on similar journeys - community support accelerates growth")
         
         # Mode switching recommendations
-        user = await self.db.users.find_one({"id": user_id})
+        user = await load_user(self.db, user_id)
         if user:
             current_mode = user.get("current_mode", "echoverse")
             if current_mode == "echoverse":
@@ -321,44 +472,118 @@ class AnalyticsService:
         
         return recommendations[:5]  # Limit to top 5 recommendations
     
+    # Funnel stages in order; each is counted server-side
+    funnel_stages = ["visitors", "signups", "journey_started", "ai_interaction", "social_engagement", "subscription"]
+    
+    async def count_distinct_users(self, collection: str) -> int:
+        """Cardinality of user_id in a collection without shipping the ids"""
+        result = await self.db[collection].aggregate([
+            {"$group": {"_id": "$user_id"}},
+            {"$count": "count"}
+        ]).to_list(1)
+        return result[0]["count"] if result else 0
+    
     async def track_conversion_funnel(self) -> Dict[str, Any]:
         """Track user conversion through the platform funnel"""
+        counts = await asyncio.gather(
+            self.count_distinct_users("user_sessions"),
+            self.db.users.count_documents({}),
+            self.db.users.count_documents({"journey_progress": {"$exists": True, "$ne": {}}}),
+            self.count_distinct_users("ai_memories"),
+            self.count_distinct_users("posts"),
+            self.db.users.count_documents({"subscription_tier": {"$ne": "free"}})
+        )
+        funnel_data = dict(zip(self.funnel_stages, counts))
         
-        # Funnel stages
-        stages = {
-            "visitors": await self.db.user_sessions.distinct("user_id"),
-            "signups": await self.db.users.find({}).to_list(10000),
-            "journey_started": await self.db.users.find({
-                "journey_progress": {"$exists": True, "$ne": {}}
-            }).to_list(10000),
-            "ai_interaction": await self.db.ai_memories.distinct("user_id"),
-            "social_engagement": await self.db.posts.distinct("user_id"),
-            "subscription": await self.db.users.find({
-                "subscription_tier": {"$ne": "free"}
-            }).to_list(10000)
-        }
-        
-        # Calculate conversion rates
-        visitors_count = len(stages["visitors"])
-        funnel_data = {
-            "visitors": visitors_count,
-            "signups": len(stages["signups"]),
-            "journey_started": len(stages["journey_started"]),
-            "ai_interaction": len(stages["ai_interaction"]),
-            "social_engagement": len(stages["social_engagement"]),
-            "subscription": len(stages["subscription"])
+        return {
+            "funnel": funnel_data,
+            "conversion_rates": self.calculate_conversion_rates(funnel_data),
+            "calculated_at": datetime.utcnow().isoformat()
         }
-        
-        # Calculate conversion rates
+    
+    def calculate_conversion_rates(self, funnel_data: Dict[str, int]) -> Dict[str, float]:
+        """Stage-to-stage conversion percentages"""
         conversion_rates = {}
-        prev_count = visitors_count
-        for stage, count in funnel_data.items():
+        prev_count = funnel_data.get(self.funnel_stages[0], 0)
+        for stage in self.funnel_stages:
+            count = funnel_data.get(stage, 0)
             if prev_count > 0:
                 conversion_rates[f"{stage}_rate"] = (count / prev_count) * 100
             prev_count = count
+        return conversion_rates
+    
+    async def get_cohort_funnels(self, weeks: int = 8, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Funnels for users grouped by ISO signup week and current mode"""
+        match: Dict[str, Any] = {"created_at": {"$gte": datetime.utcnow() - timedelta(weeks=weeks)}}
+        if mode:
+            match["current_mode"] = mode
+        
+        # Existence probes: at most one indexed document per user and collection
+        def probe(collection: str, alias: str) -> Dict[str, Any]:
+            return {"$lookup": {
+                "from": collection,
+                "localField": "id",
+                "foreignField": "user_id",
+                "pipeline": [{"$limit": 1}, {"$project": {"_id": 1}}],
+                "as": alias
+            }}
+        
+        def reached(alias: str) -> Dict[str, Any]:
+            return {"$sum": {"$cond": [{"$gt": [{"$size": f"${alias}"}, 0]}, 1, 0]}}
+        
+        rows = await self.db.users.aggregate([
+            {"$match": match},
+            {"$project": {
+                "id": 1,
+                "week": {"$dateToString": {"format": "%G-W%V", "date": "$created_at"}},
+                "mode": "$current_mode",
+                "journey_started": {"$gt": [{"$size": {"$objectToArray": {"$ifNull": ["$journey_progress", {}]}}}, 0]},
+                "subscribed": {"$ne": ["$subscription_tier", "free"]}
+            }},
+            probe("user_sessions", "sessions"),
+            probe("ai_memories", "memories"),
+            probe("posts", "posts"),
+            {"$group": {
+                "_id": {"week": "$week", "mode": "$mode"},
+                "visitors": reached("sessions"),
+                "signups": {"$sum": 1},
+                "journey_started": {"$sum": {"$cond": ["$journey_started", 1, 0]}},
+                "ai_interaction": reached("memories"),
+                "social_engagement": reached("posts"),
+                "subscription": {"$sum": {"$cond": ["$subscribed", 1, 0]}}
+            }},
+            {"$sort": {"_id.week": -1, "_id.mode": 1}}
+        ]).to_list(None)
+        
+        cohorts = []
+        for row in rows:
+            funnel_data = {stage: row[stage] for stage in self.funnel_stages}
+            cohorts.append({
+                "signup_week": row["_id"]["week"],
+                "mode": row["_id"]["mode"],
+                "funnel": funnel_data,
+                "conversion_rates": self.calculate_conversion_rates(funnel_data)
+            })
+        
+        return cohorts
+    
+    async def snapshot_conversion_funnel(self) -> Dict[str, Any]:
+        """Store today's overall and cohort funnels in funnel_snapshots"""
+        funnel = await self.track_conversion_funnel()
+        snapshot = {
+            **funnel,
+            "date": datetime.utcnow().strftime("%Y-%m-%d"),
+            "cohorts": await self.get_cohort_funnels()
+        }
         
-        return {
-            "funnel": funnel_data,
-            "conversion_rates": conversion_rates,
-            "calculated_at": datetime.utcnow().isoformat()
-        }
\ No newline at end of file
+        await self.db.funnel_snapshots.replace_one({"date": snapshot["date"]}, snapshot, upsert=True)
+        return snapshot
+    
+    async def get_funnel_history(self, days: int = 30) -> List[Dict[str, Any]]:
+        """Historical funnels served from the precomputed daily snapshots"""
+        since = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
+        return await self.db.funnel_snapshots.find(
+            {"date": {"$gte": since}},
+            {"_id": 0}
+        ).sort("date", -1).to_list(days + 1)
+
@@ -0,0 +1,44 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from jose import JWTError, jwt
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "HS256"
+
+def _secret() -> Optional[str]:
+    return os.environ.get("AUTH_TOKEN_SECRET") or None
+
+def token_ttl() -> timedelta:
+    return timedelta(seconds=int(os.environ.get("AUTH_TOKEN_TTL_SECONDS", str(7 * 24 * 3600))))
+
+def issue_access_token(user_id: str) -> Optional[Tuple[str, datetime]]:
+    """Signed, expiring JWT for a user and its expiry, or None when AUTH_TOKEN_SECRET is not set"""
+    secret = _secret()
+    if secret is None:
+        logger.warning("AUTH_TOKEN_SECRET is not set; no access tokens are issued and every request gets the default tier")
+        return None
+
+    expires_at = datetime.utcnow() + token_ttl()
+    token = jwt.encode({"sub": user_id, "exp": expires_at}, secret, algorithm=ALGORITHM)
+    return token, expires_at
+
+def verify_access_token(token: Optional[str]) -> Optional[str]:
+    """The user id a token was issued to, or None if it is missing, forged or expired"""
+    secret = _secret()
+    if not token or secret is None:
+        return None
+    try:
+        claims = jwt.decode(token, secret, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return claims.get("sub") or None
+
+def authenticated_user_id(authorization: Optional[str]) -> Optional[str]:
+    """Verified user id from an "Authorization: Bearer <token>" header"""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    return verify_access_token(token.strip()) if scheme.lower() == "bearer" else None
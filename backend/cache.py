@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+class LRUCache:
+    """Bounded least-recently-used mapping with optional per-entry TTL"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a live entry and mark it as recently used"""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Insert or replace an entry, evicting the least recently used ones when full"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class SWRCache:
+    """Cache for async loaders with TTL and stale-while-revalidate refresh.
+
+    Fresh entries are served as-is. Entries past `ttl` but within `stale_ttl`
+    are served immediately while one background task reloads them. Concurrent
+    misses for the same key share a single load.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float = 0.0, maxsize: int = 128):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # key -> (value, loaded_at)
+        self.entries = LRUCache(maxsize=maxsize)
+        self.loading: Dict[Hashable, asyncio.Future] = {}
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age < self.ttl:
+                return value
+            if age < self.ttl + self.stale_ttl:
+                if key not in self.loading:
+                    self._start_load(key, loader)
+                return value
+
+        if key not in self.loading:
+            self._start_load(key, loader)
+        return await asyncio.shield(self.loading[key])
+
+    def invalidate(self, key: Hashable):
+        self.entries.pop(key)
+
+    def _start_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        async def load():
+            try:
+                value = await loader()
+                self.entries.set(key, (value, time.monotonic()))
+                return value
+            finally:
+                self.loading.pop(key, None)
+
+        task = asyncio.ensure_future(load())
+        # Background refreshes nobody awaits must not log "exception never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self.loading[key] = task
@@ -0,0 +1,104 @@
+import os
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from cache import LRUCache
+from models import AIPersonality, PlatformMode
+
+class ConversationSession:
+    """A user's live conversation in one mode: their AI personality and the latest turns"""
+
+    __slots__ = ("personality", "turns")
+
+    def __init__(self, personality: Dict[str, Any], max_turns: int):
+        self.personality = personality
+        self.turns = deque(maxlen=max_turns)
+
+    def add_turn(self, message: str, response: str):
+        self.turns.append({"user": message, "ai": response})
+
+    @property
+    def recent_responses(self) -> List[str]:
+        return [turn["ai"] for turn in self.turns]
+
+class ConversationSessions:
+    """In-process conversation sessions keyed by (user_id, mode).
+
+    Sessions are bounded by `maxsize` (least recently used go first) and expire
+    after `idle_ttl` seconds without a chat, so a warm chat reads its personality
+    from memory only.
+
+    Other workers cache their own sessions, so personality writes are guarded by
+    the document's `version`: a change computed from version v only lands while
+    Mongo still holds v. On a conflict the write is dropped along with the
+    cached session, and the next read loads the newer personality.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, initialize: Callable[[str, PlatformMode], Awaitable[AIPersonality]], maxsize: Optional[int] = None, idle_ttl: Optional[float] = None, max_turns: Optional[int] = None):
+        self.db = db
+        self.initialize = initialize
+        self.idle_ttl = idle_ttl or float(os.environ.get("CONVERSATION_SESSION_TTL", "900"))
+        self.max_turns = max_turns or int(os.environ.get("CONVERSATION_TURNS", "10"))
+        self.sessions = LRUCache(maxsize=maxsize or int(os.environ.get("CONVERSATION_SESSIONS", "10000")), ttl=self.idle_ttl)
+
+    async def get(self, user_id: str, mode: PlatformMode) -> ConversationSession:
+        key = (user_id, PlatformMode(mode))
+        session = self.sessions.get(key)
+        if session is None:
+            personality = await self.db.ai_personalities.find_one({"user_id": user_id, "mode": mode}, {"_id": 0})
+            if not personality:
+                personality = (await self.initialize(user_id, mode)).dict()
+            session = ConversationSession(personality, self.max_turns)
+
+        # Re-inserting restarts the idle timer
+        self.sessions.set(key, session)
+        return session
+
+    def peek(self, user_id: str, mode: PlatformMode) -> Optional[ConversationSession]:
+        """The cached session, if any, without loading one or restarting its idle timer"""
+        return self.sessions.get((user_id, PlatformMode(mode)))
+
+    def apply(self, user_id: str, mode: PlatformMode, fields: Dict[str, Any]):
+        """Reflect a personality change in the cached session"""
+        session = self.peek(user_id, mode)
+        if session is not None:
+            session.personality.update(fields)
+
+    async def update(self, user_id: str, mode: PlatformMode, version: int, fields: Dict[str, Any]) -> bool:
+        """Change a personality computed from `version`; False if another change landed first"""
+        return not await self.update_many([(user_id, mode, version, fields)])
+
+    async def update_many(self, updates: List[Tuple[str, PlatformMode, int, Dict[str, Any]]]) -> List[Tuple[str, PlatformMode]]:
+        """Change many personalities, each computed from the given version, in one bulk write.
+
+        Sessions are all updated before the first await, so a concurrent change
+        never builds on a personality this batch is about to overwrite. Returns
+        the (user_id, mode) pairs whose write lost to a newer version.
+        """
+        if not updates:
+            return []
+
+        # Tags this batch's writes, to tell which guarded updates matched
+        revision = uuid.uuid4().hex
+        operations = []
+        for user_id, mode, version, fields in updates:
+            self.apply(user_id, mode, {**fields, "version": version + 1})
+            operations.append(UpdateOne(
+                {"user_id": user_id, "mode": mode, "version": version or {"$in": [0, None]}},
+                {"$set": {**fields, "version": version + 1, "revision": revision}}
+            ))
+
+        result = await self.db.ai_personalities.bulk_write(operations, ordered=False)
+        if result.matched_count == len(operations):
+            return []
+
+        lost = await self.db.ai_personalities.find(
+            {"$or": [{"user_id": user_id, "mode": mode} for user_id, mode, _, _ in updates], "revision": {"$ne": revision}},
+            {"_id": 0, "user_id": 1, "mode": 1}
+        ).to_list(None)
+        conflicts = [(personality["user_id"], PlatformMode(personality["mode"])) for personality in lost]
+        for user_id, mode in conflicts:
+            self.sessions.pop((user_id, mode))
+        return conflicts
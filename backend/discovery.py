@@ -0,0 +1,184 @@
+import os
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from cache import LRUCache
+from identity_index import IdentityIndex
+
+logger = logging.getLogger(__name__)
+
+JOURNEY_STEPS = ["essence", "mindscape", "aesthetic", "narrative"]
+
+# Only whether each step was answered is read from users; the answers themselves
+# are compared through the identity index
+JOURNEY_FLAGS_PROJECTION = {f"journey_progress.{step}.step": 1 for step in JOURNEY_STEPS}
+
+# Score = mutual connections + weighted journey similarity and same-mode bonus.
+# Journey similarity is the cosine of identity index vectors, falling back to
+# the share of matching completed steps for users not indexed yet.
+JOURNEY_WEIGHT = 0.5
+MODE_WEIGHT = 0.25
+
+class ConnectionGraph:
+    """Connections as CSR arrays over integer-mapped user ids, with per-user features"""
+
+    def __init__(self, users: List[Dict[str, Any]]):
+        self.user_ids = [user["id"] for user in users]
+        self.index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+
+        neighbors = [
+            sorted({self.index[other] for other in user.get("connections", []) if other in self.index})
+            for user in users
+        ]
+        self.indptr = np.zeros(len(users) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(row) for row in neighbors])
+        self.indices = np.fromiter((i for row in neighbors for i in row), dtype=np.int32, count=int(self.indptr[-1]))
+
+        progress = [user.get("journey_progress") or {} for user in users]
+        self.journey = np.array([[bool(p.get(step)) for step in JOURNEY_STEPS] for p in progress], dtype=bool).reshape(len(users), len(JOURNEY_STEPS))
+        self.modes = np.array([user.get("current_mode", "echoverse") for user in users])
+        self.public = np.array([user.get("profile_visibility", "public") == "public" for user in users], dtype=bool)
+        self.built_at = datetime.utcnow()
+
+    def neighbors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def mutual_counts(self, node: int) -> np.ndarray:
+        """Number of mutual connections between `node` and every user"""
+        friends = self.neighbors(node)
+        if not len(friends):
+            return np.zeros(len(self.user_ids), dtype=np.int64)
+        second_degree = np.concatenate([self.neighbors(friend) for friend in friends])
+        return np.bincount(second_degree, minlength=len(self.user_ids))
+
+    def suggest(self, user_id: str, limit: int, exclude: Set[str], journey_similarity: Optional[np.ndarray] = None) -> List[str]:
+        """Rank public users by mutual connections, journey similarity and mode.
+
+        `journey_similarity` is aligned with `user_ids`; without it, completed
+        journey steps are compared.
+        """
+        node = self.index[user_id]
+        mutual = self.mutual_counts(node)
+        if journey_similarity is None:
+            journey_similarity = 1.0 - np.mean(self.journey != self.journey[node], axis=1)
+        same_mode = self.modes == self.modes[node]
+        scores = mutual + JOURNEY_WEIGHT * journey_similarity + MODE_WEIGHT * same_mode
+
+        eligible = self.public.copy()
+        eligible[node] = False
+        eligible[self.neighbors(node)] = False
+        for other in exclude:
+            if other in self.index:
+                eligible[self.index[other]] = False
+
+        candidates = np.flatnonzero(eligible)
+        if len(candidates) > limit:
+            top = np.argpartition(-scores[candidates], limit)[:limit]
+            candidates = candidates[top]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [self.user_ids[i] for i in ranked]
+
+class DiscoveryEngine:
+    """Friend-of-friend suggestions from a connection graph rebuilt in the background.
+
+    Suggestions are cached per user until the next rebuild. Users who joined
+    after the last rebuild, or any user before the first one, are served by a
+    `$graphLookup` over their connections instead.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, identity_index: Optional[IdentityIndex] = None, refresh_interval: Optional[float] = None, cache_size: int = 10000):
+        self.db = db
+        self.identity_index = identity_index
+        self.refresh_interval = refresh_interval or float(os.environ.get("DISCOVERY_REFRESH_SECONDS", "600"))
+        self.graph: Optional[ConnectionGraph] = None
+        self.suggestions = LRUCache(maxsize=cache_size)
+
+    async def rebuild(self):
+        users = await self.db.users.find(
+            {},
+            {"_id": 0, "id": 1, "connections": 1, "current_mode": 1, "profile_visibility": 1, **JOURNEY_FLAGS_PROJECTION}
+        ).to_list(None)
+        self.graph = ConnectionGraph(users)
+        self.suggestions.clear()
+        logger.info(f"Rebuilt discovery graph: {len(users)} users, {len(self.graph.indices)} edges")
+
+    async def suggest(self, user: Dict[str, Any], limit: int = 20) -> List[str]:
+        """Ranked ids of users to suggest, excluding existing connections and follows"""
+        exclude = set(user.get("connections", [])) | set(user.get("following", []))
+
+        if self.graph is None or user["id"] not in self.graph.index:
+            return await self.suggest_with_graph_lookup(user, limit, exclude)
+
+        # Cache a few extra so connections made since the rebuild can be filtered out
+        cached = self.suggestions.get((user["id"], limit))
+        if cached is None:
+            similarity = self.journey_similarity(user["id"], self.graph.user_ids)
+            cached = self.graph.suggest(user["id"], limit + len(exclude) // 4 + 5, exclude, similarity)
+            self.suggestions.set((user["id"], limit), cached)
+
+        return [other for other in cached if other not in exclude][:limit]
+
+    def journey_similarity(self, user_id: str, user_ids: List[str]) -> Optional[np.ndarray]:
+        """Identity-vector similarity to each of `user_ids`, or None if the user is not indexed"""
+        if self.identity_index is None:
+            return None
+        return self.identity_index.similarities(user_id, user_ids)
+
+    async def suggest_with_graph_lookup(self, user: Dict[str, Any], limit: int, exclude: Set[str]) -> List[str]:
+        """Friend-of-friend candidates with mutual counts in one aggregation"""
+        excluded = list(exclude | {user["id"]})
+        candidates = await self.db.users.aggregate([
+            {"$match": {"id": user["id"]}},
+            {"$graphLookup": {
+                "from": "users",
+                "startWith": "$connections",
+                "connectFromField": "connections",
+                "connectToField": "id",
+                "as": "friends",
+                "maxDepth": 0
+            }},
+            {"$unwind": "$friends"},
+            {"$unwind": "$friends.connections"},
+            {"$group": {"_id": "$friends.connections", "mutual": {"$sum": 1}}},
+            {"$match": {"_id": {"$nin": excluded}}},
+            {"$sort": {"mutual": -1}},
+            {"$limit": limit * 5},
+            {"$lookup": {"from": "users", "localField": "_id", "foreignField": "id", "as": "candidate"}},
+            {"$unwind": "$candidate"},
+            {"$match": {"candidate.profile_visibility": "public"}},
+            {"$project": {
+                "_id": 0,
+                "id": "$_id",
+                "mutual": 1,
+                **{f"journey_progress.{step}.step": f"$candidate.journey_progress.{step}.step" for step in JOURNEY_STEPS},
+                "current_mode": "$candidate.current_mode"
+            }}
+        ]).to_list(limit * 5)
+
+        if len(candidates) < limit:
+            # Cold start: top up with other public users
+            seen = excluded + [candidate["id"] for candidate in candidates]
+            others = await self.db.users.find(
+                {"id": {"$nin": seen}, "profile_visibility": "public"},
+                {"_id": 0, "id": 1, "current_mode": 1, **JOURNEY_FLAGS_PROJECTION}
+            ).limit(limit * 2).to_list(limit * 2)
+            candidates += [{**other, "mutual": 0} for other in others]
+
+        own_steps = journey_vector(user)
+        own_mode = user.get("current_mode", "echoverse")
+        similarities = self.journey_similarity(user["id"], [candidate["id"] for candidate in candidates])
+        if similarities is None:
+            similarities = [1.0 - float(np.mean(journey_vector(candidate) != own_steps)) for candidate in candidates]
+
+        scores = {
+            candidate["id"]: candidate["mutual"] + JOURNEY_WEIGHT * float(similarity) + MODE_WEIGHT * (candidate.get("current_mode", "echoverse") == own_mode)
+            for candidate, similarity in zip(candidates, similarities)
+        }
+        candidates.sort(key=lambda candidate: scores[candidate["id"]], reverse=True)
+        return [candidate["id"] for candidate in candidates[:limit]]
+
+def journey_vector(user: Dict[str, Any]) -> np.ndarray:
+    progress = user.get("journey_progress") or {}
+    return np.array([bool(progress.get(step)) for step in JOURNEY_STEPS], dtype=bool)
@@ -0,0 +1,73 @@
+import re
+import zlib
+from typing import Dict, List, Sequence
+import numpy as np
+from cache import LRUCache
+
+EMOTION_KEYWORDS = {
+    "joy": ["happy", "excited", "amazing", "wonderful", "great", "love", "awesome", "fantastic"],
+    "sadness": ["sad", "down", "depressed", "lonely", "hurt", "pain", "crying", "grief"],
+    "anger": ["angry", "mad", "furious", "irritated", "frustrated", "annoyed", "rage"],
+    "fear": ["scared", "afraid", "worried", "anxious", "nervous", "terrified", "panic"],
+    "surprise": ["surprised", "shocked", "unexpected", "sudden", "wow", "amazing"],
+    "trust": ["trust", "confident", "secure", "safe", "reliable", "certain"],
+    "anticipation": ["excited", "looking forward", "can't wait", "hoping", "expecting"]
+}
+
+class EmotionLexicon:
+    """Keyword emotion scoring compiled into one regex and a keyword-by-emotion matrix.
+
+    A text's score for an emotion is the fraction of that emotion's keywords it
+    contains (as substrings), plus up to `jitter` of noise. The noise is seeded
+    from the text itself, so the same text always gets the same scores and
+    results can be cached.
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]] = EMOTION_KEYWORDS, jitter: float = 0.3, cache_size: int = 4096):
+        self.emotions = list(keywords)
+        self.keywords = sorted({keyword for words in keywords.values() for keyword in words}, key=len, reverse=True)
+        self.keyword_index = {keyword: i for i, keyword in enumerate(self.keywords)}
+
+        # Lookahead alternation finds keywords starting at every position, including overlapping ones
+        self.pattern = re.compile("(?=(" + "|".join(re.escape(keyword) for keyword in self.keywords) + "))")
+
+        # weights[k, e] = 1 / len(keywords[e]) when keyword k belongs to emotion e
+        self.weights = np.zeros((len(self.keywords), len(self.emotions)), dtype=np.float64)
+        for e, emotion in enumerate(self.emotions):
+            for keyword in keywords[emotion]:
+                self.weights[self.keyword_index[keyword], e] = 1.0 / max(len(keywords[emotion]), 1)
+
+        self.jitter = jitter
+        self.cache = LRUCache(maxsize=cache_size)
+
+    def presence(self, texts: Sequence[str]) -> np.ndarray:
+        """(texts, keywords) matrix of which keywords each text contains"""
+        hits = np.zeros((len(texts), len(self.keywords)), dtype=np.float64)
+        for row, text in enumerate(texts):
+            for keyword in set(self.pattern.findall(text.lower())):
+                hits[row, self.keyword_index[keyword]] = 1.0
+        return hits
+
+    def noise(self, text: str) -> np.ndarray:
+        rng = np.random.default_rng(zlib.crc32(text.encode()))
+        return rng.uniform(0, self.jitter, len(self.emotions))
+
+    def score_many(self, texts: Sequence[str]) -> np.ndarray:
+        """(texts, emotions) score matrix for a whole batch in one pass"""
+        if not len(texts):
+            return np.zeros((0, len(self.emotions)))
+        scores = self.presence(texts) @ self.weights
+        if self.jitter:
+            scores += np.vstack([self.noise(text) for text in texts])
+        return scores
+
+    def score(self, text: str) -> Dict[str, float]:
+        """Scores of a single text keyed by emotion, cached"""
+        scores = self.cache.get(text)
+        if scores is None:
+            scores = dict(zip(self.emotions, self.score_many([text])[0].tolist()))
+            self.cache.set(text, scores)
+        return dict(scores)
+
+# Shared, compiled once per process
+emotion_lexicon = EmotionLexicon()
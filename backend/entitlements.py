@@ -0,0 +1,88 @@
+import os
+import logging
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from cache import LRUCache
+from events import EventBus
+from models import SubscriptionTier
+
+logger = logging.getLogger(__name__)
+
+def parse_datetime(value: Any) -> Optional[datetime]:
+    """Stored timestamps are datetimes; older documents may hold ISO strings"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+def parse_tier(user_id: str, value: Any) -> SubscriptionTier:
+    """Stored tier of a user; unknown or legacy values fall back to FREE"""
+    try:
+        return SubscriptionTier(value)
+    except ValueError:
+        logger.warning(f"Unknown subscription tier {value!r} for user {user_id}, treating as {SubscriptionTier.FREE.value}")
+        return SubscriptionTier.FREE
+
+class Entitlements:
+    """What a user is entitled to: tier, expiry, unlocked features and feature limits"""
+
+    __slots__ = ("user_id", "tier", "expires", "unlocked_features", "tier_limits")
+
+    def __init__(self, user_id: str, tier: SubscriptionTier, expires: Optional[datetime], unlocked_features: FrozenSet[str], tier_limits: Dict[SubscriptionTier, Dict[str, Any]]):
+        self.user_id = user_id
+        self.tier = tier
+        self.expires = expires
+        self.unlocked_features = unlocked_features
+        self.tier_limits = tier_limits
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and self.expires < datetime.utcnow()
+
+    @property
+    def effective_tier(self) -> SubscriptionTier:
+        return SubscriptionTier.FREE if self.expired else self.tier
+
+    @property
+    def limits(self) -> Dict[str, Any]:
+        return self.tier_limits.get(self.effective_tier, {})
+
+class EntitlementCache:
+    """Bounded, TTL'd per-user entitlement snapshots.
+
+    Snapshots are dropped on `entitlements_changed` events, so checks on hot
+    paths are served from memory; the TTL only bounds staleness for changes
+    made by other processes.
+    """
+
+    projection = {"_id": 0, "id": 1, "subscription_tier": 1, "subscription_expires": 1, "unlocked_features": 1}
+
+    def __init__(self, db: AsyncIOMotorDatabase, tier_limits: Optional[Dict[SubscriptionTier, Dict[str, Any]]] = None, ttl: Optional[float] = None, maxsize: int = 50000):
+        self.db = db
+        self.tier_limits = tier_limits or {}
+        self.snapshots = LRUCache(maxsize=maxsize, ttl=ttl or float(os.environ.get("ENTITLEMENT_CACHE_TTL", "300")))
+
+    async def get(self, user_id: str) -> Optional[Entitlements]:
+        entitlements = self.snapshots.get(user_id)
+        if entitlements is None:
+            user = await self.db.users.find_one({"id": user_id}, self.projection)
+            if not user:
+                return None
+            entitlements = Entitlements(
+                user_id,
+                parse_tier(user_id, user.get("subscription_tier", "free")),
+                parse_datetime(user.get("subscription_expires")),
+                frozenset(user.get("unlocked_features", [])),
+                self.tier_limits
+            )
+            self.snapshots.set(user_id, entitlements)
+        return entitlements
+
+    def invalidate(self, user_id: str):
+        self.snapshots.pop(user_id)
+
+    def register_event_handlers(self, bus: EventBus):
+        async def on_entitlements_changed(user_id: str, **_):
+            self.invalidate(user_id)
+
+        bus.subscribe("entitlements_changed", on_entitlements_changed)
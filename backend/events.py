@@ -0,0 +1,26 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[..., Awaitable[Any]]
+
+class EventBus:
+    """Minimal in-process publish/subscribe for domain events between services"""
+
+    def __init__(self):
+        self.handlers: Dict[str, List[EventHandler]] = {}
+
+    def subscribe(self, event: str, handler: EventHandler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    async def publish(self, event: str, **payload):
+        """Run every handler for the event; a failing handler never breaks the publisher"""
+        for handler in self.handlers.get(event, []):
+            try:
+                await handler(**payload)
+            except Exception as e:
+                logger.error(f"Error handling {event} event: {e}")
+
+# Shared bus the services publish to; server.py wires up the subscribers
+event_bus = EventBus()
@@ -0,0 +1,310 @@
+import os
+import json
+import uuid
+import fcntl
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from text_vectors import HashingVectorizer, text_leaves
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_PROJECTION = {"_id": 0, "id": 1, "journey_progress": 1, "identity_profile": 1}
+
+def identity_text(user: Dict[str, Any]) -> str:
+    """The user's free-text journey answers and identity profile values.
+
+    Only each step's `responses` are used: the step name and timestamp stored
+    next to them are shared by every user and would make unrelated users look alike.
+    """
+    answers = [step.get("responses") for step in (user.get("journey_progress") or {}).values() if isinstance(step, dict)]
+    return " ".join(text_leaves([answers, user.get("identity_profile") or {}]))
+
+class IdentityIndex:
+    """Memory-mapped matrix of hashed identity vectors, one row per user.
+
+    Rows live in `vectors.f32` and their user ids, one per line in row order,
+    in `ids.txt`. A row is written and flushed before its id is appended, so a
+    crash never leaves an id pointing at an unwritten row. Top-k queries are
+    batched dot products over the matrix in chunks.
+
+    With several workers only one writes: whichever holds the flock on
+    `writer.lock`. Every worker queues changed users in identity_index_queue;
+    the writer drains the queue in batches with one flush per batch, and the
+    other workers map the files read-only and pick up new rows as ids.txt grows.
+    A rebuild gets a new generation in meta.json, which readers notice and reopen.
+    """
+
+    indexes = [
+        ("identity_index_queue", [("queued_at", 1)], {})
+    ]
+
+    def __init__(self, db: AsyncIOMotorDatabase, directory: Optional[str] = None, dimensions: int = 512, chunk_rows: int = 65536, sync_interval: Optional[float] = None):
+        self.db = db
+        self.directory = Path(directory or os.environ.get("IDENTITY_INDEX_DIR", Path(__file__).parent / "data" / "identity_index"))
+        self.vectorizer = HashingVectorizer(dimensions)
+        self.chunk_rows = chunk_rows
+        self.sync_interval = sync_interval or float(os.environ.get("IDENTITY_INDEX_SYNC_SECONDS", "2"))
+
+        self.rows: Dict[str, int] = {}
+        self.user_ids: List[str] = []
+        self.matrix: Optional[np.memmap] = None
+        self.generation: Optional[str] = None
+        self.ids_offset = 0
+        self.lock_file = None
+
+    @property
+    def dimensions(self) -> int:
+        return self.vectorizer.dimensions
+
+    @property
+    def count(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def is_writer(self) -> bool:
+        return self.lock_file is not None
+
+    def try_become_writer(self) -> bool:
+        """Take the writer lock if no other process holds it"""
+        if self.lock_file is None:
+            lock_file = open(self.directory / "writer.lock", "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self.lock_file = lock_file
+        return True
+
+    async def run(self):
+        """Load the index, then keep it current: drain the queue as writer, follow the files otherwise"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        await self.load()
+        while True:
+            try:
+                if self.is_writer or self.try_become_writer():
+                    if self.generation is None or self.matrix is None or self.matrix.mode != "r+":
+                        await self.load()
+                    await self.drain()
+                else:
+                    self.sync()
+            except Exception as e:
+                logger.error(f"Error syncing identity index: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    async def load(self):
+        """Open the persisted index; the writer builds it from Mongo when missing or incompatible"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        writer = self.try_become_writer()
+        meta = self._read_meta()
+
+        if meta and meta.get("dimensions") == self.dimensions and meta.get("generation") and (self.directory / "vectors.f32").exists():
+            self._open(meta["generation"], "r+" if writer else "r")
+            if self.matrix is not None and self.count <= self.matrix.shape[0]:
+                logger.info(f"Loaded identity index with {self.count} users")
+                return
+
+        if writer:
+            await self.rebuild()
+
+    async def rebuild(self):
+        """Vectorize every user from scratch (writer only)"""
+        for path in ("meta.json", "ids.txt", "vectors.f32"):
+            (self.directory / path).unlink(missing_ok=True)
+
+        self.rows, self.user_ids, self.ids_offset = {}, [], 0
+        self.matrix = None
+        self._ensure_capacity(1024)
+        (self.directory / "ids.txt").touch()
+        self.generation = uuid.uuid4().hex
+        (self.directory / "meta.json").write_text(json.dumps({"dimensions": self.dimensions, "generation": self.generation}))
+
+        # Everything queued so far is covered by the rebuild
+        started = datetime.utcnow()
+        batch = []
+        async for user in self.db.users.find({}, IDENTITY_PROJECTION):
+            batch.append(user)
+            if len(batch) >= 1000:
+                await self._write_users(batch)
+                batch = []
+        await self._write_users(batch)
+        await self.db.identity_index_queue.delete_many({"queued_at": {"$lt": started}})
+
+        logger.info(f"Built identity index with {self.count} users")
+
+    async def upsert(self, user_id: str):
+        """Queue a user for re-vectorizing, e.g. after a journey step was saved"""
+        await self.db.identity_index_queue.update_one(
+            {"_id": user_id},
+            {"$set": {"queued_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def drain(self, batch_size: int = 1000) -> int:
+        """Re-vectorize queued users (writer only), one flush per batch"""
+        drained = 0
+        while True:
+            queued = await self.db.identity_index_queue.find().sort("queued_at", 1).limit(batch_size).to_list(batch_size)
+            if not queued:
+                return drained
+
+            users = await self.db.users.find({"id": {"$in": [entry["_id"] for entry in queued]}}, IDENTITY_PROJECTION).to_list(None)
+            await self._write_users(users)
+
+            # Entries re-queued while this batch was written stay for the next pass
+            await self.db.identity_index_queue.delete_many(
+                {"$or": [{"_id": entry["_id"], "queued_at": entry["queued_at"]} for entry in queued]}
+            )
+            drained += len(queued)
+
+    async def _write_users(self, users: List[Dict[str, Any]]):
+        if not users:
+            return
+        vectors = self.vectorizer.transform_many([identity_text(user) for user in users])
+
+        new_users, new_vectors = [], []
+        for user, vector in zip(users, vectors):
+            row = self.rows.get(user["id"])
+            if row is not None:
+                self.matrix[row] = vector
+            else:
+                new_users.append(user)
+                new_vectors.append(vector)
+
+        start = self.count
+        if new_users:
+            self._ensure_capacity(start + len(new_users))
+            self.matrix[start:start + len(new_users)] = new_vectors
+
+        # msync off the event loop, and before the ids that point at the rows
+        await asyncio.to_thread(self.matrix.flush)
+
+        if new_users:
+            lines = "".join(f"{user['id']}\n" for user in new_users)
+            with open(self.directory / "ids.txt", "a") as ids_file:
+                ids_file.write(lines)
+            self.ids_offset += len(lines.encode())
+            for offset, user in enumerate(new_users):
+                self.rows[user["id"]] = start + offset
+                self.user_ids.append(user["id"])
+
+    def _ensure_capacity(self, rows: int):
+        capacity = self.matrix.shape[0] if self.matrix is not None else 0
+        if rows <= capacity:
+            return
+
+        new_capacity = max(rows, capacity * 2, 1024)
+        path = self.directory / "vectors.f32"
+        if self.matrix is not None:
+            self.matrix.flush()
+            del self.matrix
+        # Growing the file zero-fills the new rows
+        with open(path, "ab") as vectors_file:
+            vectors_file.truncate(new_capacity * self.dimensions * 4)
+        self.matrix = np.memmap(path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dimensions))
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads((self.directory / "meta.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _open(self, generation: str, mode: str):
+        self.generation = generation
+        self.rows, self.user_ids, self.ids_offset = {}, [], 0
+        self.matrix = None
+        self._map(mode)
+        self._read_new_ids()
+
+    def _map(self, mode: str):
+        path = self.directory / "vectors.f32"
+        capacity = path.stat().st_size // (4 * self.dimensions)
+        if capacity:
+            self.matrix = np.memmap(path, dtype=np.float32, mode=mode, shape=(capacity, self.dimensions))
+
+    def _read_new_ids(self):
+        """Append ids written since the last read; a trailing partial line waits for the next read"""
+        try:
+            with open(self.directory / "ids.txt", "rb") as ids_file:
+                ids_file.seek(self.ids_offset)
+                data = ids_file.read()
+        except OSError:
+            return
+
+        complete = data[:data.rfind(b"\n") + 1]
+        self.ids_offset += len(complete)
+        for user_id in complete.decode().split():
+            self.rows[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+
+    def sync(self):
+        """Follow the writer's files (readers only)"""
+        meta = self._read_meta()
+        if not meta or meta.get("dimensions") != self.dimensions or not meta.get("generation") or not (self.directory / "vectors.f32").exists():
+            return
+        if meta["generation"] != self.generation:
+            self._open(meta["generation"], "r")
+            return
+
+        size = (self.directory / "vectors.f32").stat().st_size
+        if self.matrix is None or size > self.matrix.shape[0] * self.dimensions * 4:
+            self._map("r")
+        self._read_new_ids()
+
+    def similarities(self, user_id: str, user_ids: List[str]) -> Optional[np.ndarray]:
+        """Cosine similarity of the user's vector to each of `user_ids` (0 for users without a row).
+
+        None when the user has no vector yet.
+        """
+        row = self.rows.get(user_id)
+        if row is None or self.matrix is None:
+            return None
+
+        count = min(self.count, self.matrix.shape[0])
+        if row >= count:
+            return None
+
+        query = np.array(self.matrix[row])
+        if not query.any():
+            return None
+
+        rows = np.fromiter((self.rows.get(other, -1) for other in user_ids), dtype=np.int64, count=len(user_ids))
+        known = np.flatnonzero((rows >= 0) & (rows < count))
+        scores = np.zeros(len(user_ids), dtype=np.float32)
+        for start in range(0, len(known), self.chunk_rows):
+            chunk = known[start:start + self.chunk_rows]
+            scores[chunk] = self.matrix[rows[chunk]] @ query
+        return scores
+
+    def similar(self, user_id: str, k: int = 10) -> List[Tuple[str, float]]:
+        """The k users with the most similar journeys, by cosine similarity"""
+        row = self.rows.get(user_id)
+        if row is None or self.matrix is None:
+            return []
+
+        # Readers may know ids whose rows are beyond their mapping until the next sync
+        count = min(self.count, self.matrix.shape[0])
+        if row >= count:
+            return []
+
+        query = np.array(self.matrix[row])
+        if not query.any():
+            return []
+
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, self.chunk_rows):
+            end = min(start + self.chunk_rows, count)
+            scores[start:end] = self.matrix[start:end] @ query
+        scores[row] = -np.inf
+
+        k = min(k, count - 1)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.user_ids[i], float(scores[i])) for i in top if scores[i] > 0]
@@ -0,0 +1,104 @@
+import logging
+from typing import Dict, Any, List, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Index options that make two indexes on the same keys behave differently
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+class IndexSpec:
+    """A declared index on one collection"""
+
+    def __init__(self, collection: str, keys: List[Tuple[str, int]], **options):
+        self.collection = collection
+        self.keys = [(field, direction) for field, direction in keys]
+        self.options = options
+        self.name = options.get("name") or "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+    def to_model(self) -> IndexModel:
+        return IndexModel(self.keys, **{**self.options, "name": self.name})
+
+    def describe(self) -> Dict[str, Any]:
+        return {"name": self.name, "keys": self.keys, **self.options}
+
+class IndexRegistry:
+    """Declarative index catalogue that services contribute to and startup applies"""
+
+    def __init__(self):
+        self.specs: Dict[str, Dict[str, IndexSpec]] = {}
+
+    def register(self, collection: str, keys: List[Tuple[str, int]], **options) -> IndexSpec:
+        spec = IndexSpec(collection, keys, **options)
+        self.specs.setdefault(collection, {})[spec.name] = spec
+        return spec
+
+    def register_service(self, service: Any):
+        """Register every (collection, keys, options) entry a service declares in `indexes`"""
+        for collection, keys, options in getattr(service, "indexes", []):
+            self.register(collection, keys, **options)
+
+    async def apply(self, db: AsyncIOMotorDatabase) -> Dict[str, List[str]]:
+        """Create all declared indexes; already existing identical indexes are a no-op"""
+        failures: Dict[str, List[str]] = {}
+
+        for collection, specs in self.specs.items():
+            try:
+                await db[collection].create_indexes([spec.to_model() for spec in specs.values()])
+                continue
+            except OperationFailure:
+                pass
+
+            # Retry one by one so a single conflicting index does not block the rest
+            for spec in specs.values():
+                try:
+                    await db[collection].create_indexes([spec.to_model()])
+                except OperationFailure as e:
+                    logger.error(f"Could not create index {collection}.{spec.name}: {e}")
+                    failures.setdefault(collection, []).append(spec.name)
+
+        return failures
+
+    async def drift(self, db: AsyncIOMotorDatabase) -> Dict[str, Dict[str, List[Any]]]:
+        """Compare declared indexes against the live ones, per collection"""
+        report = {}
+
+        for collection, specs in self.specs.items():
+            live = await db[collection].index_information()
+            live_by_keys = {
+                tuple(tuple(key) for key in info["key"]): (name, info)
+                for name, info in live.items()
+                if name != "_id_"
+            }
+
+            missing, mismatched = [], []
+            declared_keys = set()
+            for spec in specs.values():
+                keys = tuple((field, direction) for field, direction in spec.keys)
+                declared_keys.add(keys)
+
+                if keys not in live_by_keys:
+                    missing.append(spec.describe())
+                    continue
+
+                _, info = live_by_keys[keys]
+                differences = {
+                    option: {"declared": spec.options.get(option), "live": info.get(option)}
+                    for option in COMPARED_OPTIONS
+                    if spec.options.get(option) != info.get(option)
+                }
+                if differences:
+                    mismatched.append({"name": spec.name, "differences": differences})
+
+            undeclared = [name for keys, (name, _) in live_by_keys.items() if keys not in declared_keys]
+
+            if missing or mismatched or undeclared:
+                report[collection] = {
+                    "missing": missing,
+                    "mismatched": mismatched,
+                    "undeclared": undeclared
+                }
+
+        return report
@@ -0,0 +1,188 @@
+import asyncio
+import bisect
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from models import Leaderboard
+from pagination import encode_cursor, decode_cursor
+from user_summaries import load_user_summaries
+
+CATEGORY_FIELDS = {"xp": "experience_points", "level": "level", "streak": "streak_days"}
+PERIODS = ["daily", "weekly", "monthly"]
+
+def period_start(period: str, now: datetime) -> datetime:
+    """Start of the current calendar day, ISO week or month (UTC)"""
+    today = datetime(now.year, now.month, now.day)
+    if period == "daily":
+        return today
+    if period == "weekly":
+        return today - timedelta(days=today.weekday())
+    return today.replace(day=1)
+
+class LeaderboardSnapshot:
+    """Users ranked by score descending, ties broken by user id.
+
+    A truncated snapshot holds only the top of the board; users below it have
+    no rank here and are ranked by the service with a count query.
+    """
+
+    __slots__ = ("keys", "negated_scores", "scores", "computed_at", "truncated")
+
+    def __init__(self, scores: Dict[str, int], computed_at: datetime, truncated: bool = False):
+        # Ascending (-score, user_id) keys are descending score order
+        self.keys: List[Tuple[int, str]] = sorted((-score, user_id) for user_id, score in scores.items())
+        self.negated_scores = [key[0] for key in self.keys]
+        self.scores = scores
+        self.computed_at = computed_at
+        self.truncated = truncated
+
+    def rank_of_score(self, score: int) -> int:
+        """Competition rank (1, 2, 2, 4): one more than the number of higher scores"""
+        return bisect.bisect_left(self.negated_scores, -score) + 1
+
+    def rank(self, user_id: str) -> Optional[int]:
+        score = self.scores.get(user_id)
+        return None if score is None else self.rank_of_score(score)
+
+    def page(self, limit: int, after: Optional[Tuple[int, str]] = None) -> List[Tuple[int, str]]:
+        """Up to limit + 1 keys following the (score, user_id) key `after`"""
+        start = bisect.bisect_right(self.keys, (-after[0], after[1])) if after else 0
+        return self.keys[start:start + limit + 1]
+
+class LeaderboardService:
+    """In-memory ranked leaderboards per category and period, rebuilt on a schedule.
+
+    All-time boards rank the current user fields and hold the top `size` public
+    users, read through an index on (profile_visibility, field, id). Daily,
+    weekly and monthly XP boards sum the xp_events log since the start of the
+    period. Level and streak are point-in-time values, so they only have an
+    all-time board and requests for other periods are answered (and labelled)
+    as all_time.
+    """
+
+    indexes = [
+        *[("users", [("profile_visibility", 1), (field, -1), ("id", 1)], {}) for field in CATEGORY_FIELDS.values()],
+        ("xp_events", [("created_at", 1), ("user_id", 1), ("amount", 1)], {}),
+        ("xp_events", [("created_at", 1)], {"expireAfterSeconds": 40 * 86400})
+    ]
+
+    def __init__(self, db: AsyncIOMotorDatabase, refresh_interval: Optional[float] = None, size: Optional[int] = None):
+        self.db = db
+        self.refresh_interval = refresh_interval or float(os.environ.get("LEADERBOARD_REFRESH_SECONDS", "60"))
+        self.size = size or int(os.environ.get("LEADERBOARD_SIZE", "1000"))
+        self.snapshots: Dict[Tuple[str, str], LeaderboardSnapshot] = {}
+        self.refresh_lock = asyncio.Lock()
+
+    async def refresh(self):
+        """Rebuild every snapshot, serialized with on-demand rebuilds"""
+        async with self.refresh_lock:
+            await self.rebuild()
+
+    async def rebuild(self):
+        """Rebuild every snapshot: an index-backed top-N read per category and one pass over the XP log"""
+        now = datetime.utcnow()
+        snapshots = {}
+        for category, field in CATEGORY_FIELDS.items():
+            top = await self.db.users.find(
+                {"profile_visibility": "public"},
+                {"_id": 0, "id": 1, field: 1}
+            ).sort([(field, -1), ("id", 1)]).limit(self.size).to_list(self.size)
+            snapshots[(category, "all_time")] = LeaderboardSnapshot({user["id"]: user.get(field) or 0 for user in top}, now, truncated=len(top) >= self.size)
+
+        starts = {period: period_start(period, now) for period in PERIODS}
+        totals = await self.db.xp_events.aggregate([
+            {"$match": {"created_at": {"$gte": min(starts.values())}}},
+            {"$group": {
+                "_id": "$user_id",
+                **{
+                    period: {"$sum": {"$cond": [{"$gte": ["$created_at", start]}, "$amount", 0]}}
+                    for period, start in starts.items()
+                }
+            }}
+        ]).to_list(None)
+
+        # Only users who earned XP this month can be on a period board
+        public = set()
+        active = [total["_id"] for total in totals]
+        for start in range(0, len(active), 10000):
+            chunk = await self.db.users.find(
+                {"id": {"$in": active[start:start + 10000]}, "profile_visibility": "public"},
+                {"_id": 0, "id": 1}
+            ).to_list(None)
+            public.update(user["id"] for user in chunk)
+
+        for period in PERIODS:
+            scores = {total["_id"]: total[period] for total in totals if total["_id"] in public and total[period] > 0}
+            snapshots[("xp", period)] = LeaderboardSnapshot(scores, now)
+
+        self.snapshots = snapshots
+
+    async def rank(self, snapshot: LeaderboardSnapshot, category: str, user_id: str) -> Optional[int]:
+        """The user's rank, counting higher public scores when they are below a truncated snapshot"""
+        rank = snapshot.rank(user_id)
+        if rank is not None or not snapshot.truncated:
+            return rank
+
+        field = CATEGORY_FIELDS.get(category, CATEGORY_FIELDS["xp"])
+        user = await self.db.users.find_one({"id": user_id, "profile_visibility": "public"}, {"_id": 0, field: 1})
+        if not user:
+            return None
+        higher = await self.db.users.count_documents({"profile_visibility": "public", field: {"$gt": user.get(field) or 0}})
+        return higher + 1
+
+    def resolve(self, category: str, period: str) -> Tuple[str, str]:
+        """The (category, period) board that actually serves a request"""
+        if category not in CATEGORY_FIELDS:
+            category = "xp"
+        if category != "xp" or period not in PERIODS:
+            period = "all_time"
+        return category, period
+
+    async def get_snapshot(self, category: str, period: str) -> LeaderboardSnapshot:
+        category, period = self.resolve(category, period)
+        snapshot = self.snapshots.get((category, period))
+        if snapshot is None or (datetime.utcnow() - snapshot.computed_at).total_seconds() > 2 * self.refresh_interval:
+            # Normally kept fresh by the background task; rebuild once if it fell behind
+            async with self.refresh_lock:
+                snapshot = self.snapshots.get((category, period))
+                if snapshot is None or (datetime.utcnow() - snapshot.computed_at).total_seconds() > 2 * self.refresh_interval:
+                    await self.rebuild()
+                    snapshot = self.snapshots[(category, period)]
+        return snapshot
+
+    async def get_leaderboard(self, category: str = "xp", period: str = "all_time", limit: int = 50, cursor: Optional[str] = None, user_id: Optional[str] = None) -> Leaderboard:
+        """A page of the leaderboard, plus the requesting user's rank when given"""
+        after = decode_cursor(cursor, (int, float), str) if cursor else None
+
+        category, period = self.resolve(category, period)
+        snapshot = await self.get_snapshot(category, period)
+        keys = snapshot.page(limit, after)
+        has_more = len(keys) > limit
+        keys = keys[:limit]
+
+        users = await load_user_summaries(self.db, [user_id for _, user_id in keys])
+        entries = []
+        for negated_score, entry_user_id in keys:
+            user = users.get(entry_user_id)
+            if user is None:
+                continue
+            entries.append({
+                "rank": snapshot.rank_of_score(-negated_score),
+                "user_id": entry_user_id,
+                "username": user.username,
+                "display_name": user.display_name,
+                "avatar_url": user.avatar_url,
+                "score": -negated_score,
+                "level": user.level
+            })
+
+        next_cursor = encode_cursor(-keys[-1][0], keys[-1][1]) if keys and has_more else None
+
+        return Leaderboard(
+            category=category,
+            period=period,
+            entries=entries,
+            user_rank=await self.rank(snapshot, category, user_id) if user_id else None,
+            next_cursor=next_cursor
+        )
@@ -0,0 +1,48 @@
+from typing import Any, Dict, List, Optional
+from emotion import emotion_lexicon
+from models import MemoryFeatures
+
+GROWTH_TOPICS = ["fear", "confidence", "relationships", "purpose", "creativity", "change"]
+
+def user_text(content: str) -> Optional[str]:
+    """The user's side of a "User: ... AI: ..." conversation memory"""
+    if "User:" not in content:
+        return None
+    return content.split("User:")[1].split("AI:")[0]
+
+def extract_features(content: str) -> MemoryFeatures:
+    message = user_text(content)
+    features = MemoryFeatures(topics=[topic for topic in GROWTH_TOPICS if topic in content.lower()])
+    if message is not None:
+        emotions = emotion_lexicon.score(message)
+        features.has_user_text = True
+        features.word_count = len(message.split())
+        features.is_question = "?" in message
+        features.emotions = emotions
+        features.emotion_peak = max(emotions.values())
+    return features
+
+def pattern_rollup_pipeline(match: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
+    """Aggregate the stored features of a user's latest `limit` memories into one document.
+
+    Emotion averages only cover memories with user text, since the others have
+    no emotion fields and $avg skips missing values.
+    """
+    group = {
+        "_id": None,
+        "memories": {"$sum": 1},
+        "total_words": {"$sum": {"$ifNull": ["$features.word_count", 0]}},
+        "questions": {"$sum": {"$cond": [{"$eq": ["$features.is_question", True]}, 1, 0]}},
+        "emotional": {"$sum": {"$cond": [{"$gt": [{"$ifNull": ["$features.emotion_peak", 0]}, 0.3]}, 1, 0]}}
+    }
+    for emotion in emotion_lexicon.emotions:
+        group[f"emotion_{emotion}"] = {"$avg": f"$features.emotions.{emotion}"}
+    for topic in GROWTH_TOPICS:
+        group[f"topic_{topic}"] = {"$sum": {"$cond": [{"$in": [topic, {"$ifNull": ["$features.topics", []]}]}, 1, 0]}}
+
+    return [
+        {"$match": match},
+        {"$sort": {"created_at": -1}},
+        {"$limit": limit},
+        {"$group": group}
+    ]
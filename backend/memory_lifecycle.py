@@ -0,0 +1,280 @@
+import os
+import math
+import heapq
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from emotion import emotion_lexicon
+from events import event_bus
+from memory_features import GROWTH_TOPICS
+from models import MemoryFeatures
+from write_buffer import DUPLICATE_KEY
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MEMORY_TYPE = "summary"
+SUMMARY_NAMESPACE = uuid.UUID("5d1e6c1a-6f0b-4a7e-9d53-0f3c1a2b4e77")
+# Batch ids kept per summary. A summary belongs to one user, whose unfinished
+# batches are replayed before any new one, so only the latest few can recur
+SUMMARY_BATCH_HISTORY = 50
+RETENTION_PROJECTION = {"_id": 0, "id": 1, "created_at": 1, "last_accessed": 1, "importance_score": 1, "access_count": 1}
+
+def memory_count_pipeline(memory_type: str) -> List[Dict[str, Any]]:
+    """Count memories of a type, including the raw ones already folded into summaries"""
+    return [
+        {"$match": {"$or": [
+            {"memory_type": memory_type},
+            {"memory_type": SUMMARY_MEMORY_TYPE, "metadata.source_type": memory_type}
+        ]}},
+        {"$group": {"_id": None, "count": {"$sum": {
+            "$cond": [{"$eq": ["$memory_type", SUMMARY_MEMORY_TYPE]}, {"$ifNull": ["$metadata.memory_count", 0]}, 1]
+        }}}}
+    ]
+
+def retention_score(memory: Dict[str, Any], now: datetime) -> float:
+    """How much a memory is worth keeping raw: importance, plus use, decaying with idle time"""
+    idle_days = max((now - (memory.get("last_accessed") or memory["created_at"])).days, 0)
+    usage = math.log1p(memory.get("access_count", 0)) * 0.1
+    return memory.get("importance_score", 0.5) + usage * math.exp(-idle_days / 30)
+
+class MemoryCompactor:
+    """Keeps each user's ai_memories within a budget by rolling old ones into summaries.
+
+    A memory is compacted when it is older than `compact_after_days`, below
+    `keep_importance` and not accessed in that window, or, while the user is
+    over budget, when it has the lowest retention score. Memories younger than
+    `min_age_days` and summaries themselves are never compacted.
+
+    Compacted memories are folded, by type and calendar month, into one summary
+    memory that accumulates their counts, feature sums and topic hits with $inc,
+    so repeated runs extend the same summary. The raw memories move to
+    ai_memories_archive, where a TTL index expires them after `archive_days`;
+    with `archive_days` 0 they are deleted outright.
+
+    Memories are compacted in pages of `page_size`. Each page is first claimed
+    with a `compaction_batch` id, and a summary records the batches it has
+    absorbed, so a run that crashes part way is finished by the next one
+    without counting any memory twice.
+
+    Every worker runs the task, but a run first takes the `memory_compaction`
+    lease in job_leases for most of an interval, so only one worker scans
+    ai_memories per interval.
+    """
+
+    indexes = [
+        ("ai_memories_archive", [("id", 1)], {"unique": True}),
+        ("ai_memories_archive", [("user_id", 1), ("created_at", -1)], {}),
+        ("ai_memories_archive", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+        ("ai_memories", [("compaction_batch", 1)], {"sparse": True})
+    ]
+
+    def __init__(self, db: AsyncIOMotorDatabase, budget: Optional[int] = None, compact_after_days: Optional[int] = None, min_age_days: Optional[int] = None, keep_importance: Optional[float] = None, archive_days: Optional[int] = None, interval: Optional[float] = None, page_size: int = 500):
+        self.db = db
+        self.budget = budget or int(os.environ.get("MEMORY_BUDGET", "1000"))
+        self.compact_after_days = compact_after_days or int(os.environ.get("MEMORY_COMPACT_AFTER_DAYS", "30"))
+        # At least a day, so counts over recent windows never miss compacted memories
+        self.min_age_days = max(min_age_days or int(os.environ.get("MEMORY_MIN_AGE_DAYS", "7")), 1)
+        self.keep_importance = keep_importance or float(os.environ.get("MEMORY_KEEP_IMPORTANCE", "0.7"))
+        self.archive_days = archive_days if archive_days is not None else int(os.environ.get("MEMORY_ARCHIVE_DAYS", "180"))
+        self.interval = interval or float(os.environ.get("MEMORY_COMPACTION_SECONDS", "21600"))
+        self.page_size = page_size
+        self.owner = uuid.uuid4().hex
+
+    async def acquire_lease(self, now: datetime) -> bool:
+        """Take the cross-worker compaction lease unless another worker holds an unexpired one"""
+        try:
+            lease = await self.db.job_leases.find_one_and_update(
+                {"_id": "memory_compaction", "$or": [{"expires_at": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.interval * 0.9)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held: the upsert collided with it
+            return False
+        return lease is not None
+
+    async def run(self) -> int:
+        """Compact every user that is over budget or has stale memories, if this worker holds the lease"""
+        now = datetime.utcnow()
+        if not await self.acquire_lease(now):
+            return 0
+        stale_before = now - timedelta(days=self.compact_after_days)
+
+        # Users with a lower budget override must be found too
+        lowest = await self.db.users.find_one({"memory_budget": {"$ne": None}}, {"_id": 0, "memory_budget": 1}, sort=[("memory_budget", 1)])
+        min_budget = min(self.budget, lowest["memory_budget"]) if lowest else self.budget
+
+        users = await self.db.ai_memories.aggregate([
+            {"$match": {"memory_type": {"$ne": SUMMARY_MEMORY_TYPE}}},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}, "oldest": {"$min": "$created_at"}}},
+            {"$match": {"$or": [{"count": {"$gt": min_budget}}, {"oldest": {"$lt": stale_before}}]}}
+        ]).to_list(None)
+
+        # Users whose last compaction was interrupted
+        interrupted = await self.db.ai_memories.distinct("user_id", {"compaction_batch": {"$ne": None}})
+        known = {user["_id"] for user in users}
+        users += [{"_id": user_id} for user_id in interrupted if user_id not in known]
+
+        budgets = await self.budgets([user["_id"] for user in users])
+        compacted = 0
+        for user in users:
+            compacted += await self.compact_user(user["_id"], budgets.get(user["_id"], self.budget), now)
+
+        if compacted:
+            logger.info(f"Compacted {compacted} memories of {len(users)} users")
+        return compacted
+
+    async def budgets(self, user_ids: List[str]) -> Dict[str, int]:
+        """Per-user budget overrides from users.memory_budget"""
+        users = await self.db.users.find(
+            {"id": {"$in": user_ids}, "memory_budget": {"$ne": None}},
+            {"_id": 0, "id": 1, "memory_budget": 1}
+        ).to_list(None)
+        return {user["id"]: user["memory_budget"] for user in users}
+
+    async def compact_user(self, user_id: str, budget: int, now: Optional[datetime] = None) -> int:
+        now = now or datetime.utcnow()
+        stale_before = now - timedelta(days=self.compact_after_days)
+
+        # Batches a previous run claimed but did not finish come first
+        compacted = 0
+        for batch_id in await self.db.ai_memories.distinct("compaction_batch", {"user_id": user_id, "compaction_batch": {"$ne": None}}):
+            compacted += await self.finish_batch(user_id, batch_id, now)
+
+        raw = {"user_id": user_id, "memory_type": {"$ne": SUMMARY_MEMORY_TYPE}, "compaction_batch": None}
+        eligible = {**raw, "created_at": {"$lt": now - timedelta(days=self.min_age_days)}}
+        stale = {
+            **raw,
+            "created_at": {"$lt": min(stale_before, now - timedelta(days=self.min_age_days))},
+            "importance_score": {"$lt": self.keep_importance},
+            "$or": [{"last_accessed": {"$lt": stale_before}}, {"last_accessed": None}]
+        }
+
+        # Mirrors `stale`, so the scan below skips exactly what the stale pages take
+        def is_stale(memory: Dict[str, Any]) -> bool:
+            return (
+                memory["created_at"] < stale_before
+                and memory.get("importance_score", self.keep_importance) < self.keep_importance
+                and (memory.get("last_accessed") or memory["created_at"]) < stale_before
+            )
+
+        total = await self.db.ai_memories.count_documents(raw)
+        excess = total - await self.db.ai_memories.count_documents(stale) - budget
+
+        # Over budget: keep only the `excess` lowest retention scores among the rest
+        lowest: List[tuple] = []
+        if excess > 0:
+            async for memory in self.db.ai_memories.find(eligible, RETENTION_PROJECTION):
+                if is_stale(memory):
+                    continue
+                item = (-retention_score(memory, now), memory["id"])
+                if len(lowest) < excess:
+                    heapq.heappush(lowest, item)
+                elif item > lowest[0]:
+                    heapq.heapreplace(lowest, item)
+
+        # Compacted memories leave ai_memories, so the first page is always the next one
+        while True:
+            page = await self.db.ai_memories.find(stale, {"_id": 0, "id": 1}).limit(self.page_size).to_list(self.page_size)
+            if not page:
+                break
+            compacted += await self.compact_batch(user_id, [memory["id"] for memory in page], now)
+
+        excess_ids = [memory_id for _, memory_id in lowest]
+        for start in range(0, len(excess_ids), self.page_size):
+            compacted += await self.compact_batch(user_id, excess_ids[start:start + self.page_size], now)
+
+        if compacted:
+            await event_bus.publish("memories_compacted", user_id=user_id, count=compacted)
+        return compacted
+
+    async def compact_batch(self, user_id: str, memory_ids: List[str], now: datetime) -> int:
+        """Claim memories for a new batch, then fold them into summaries and tier them out"""
+        batch_id = uuid.uuid4().hex
+        await self.db.ai_memories.update_many(
+            {"id": {"$in": memory_ids}, "compaction_batch": None},
+            {"$set": {"compaction_batch": batch_id}}
+        )
+        return await self.finish_batch(user_id, batch_id, now)
+
+    async def finish_batch(self, user_id: str, batch_id: str, now: datetime) -> int:
+        """Summarize and tier out a claimed batch; safe to repeat after a crash at any step"""
+        memories = await self.db.ai_memories.find({"compaction_batch": batch_id}, {"_id": 0}).to_list(None)
+        if not memories:
+            return 0
+        await self.summarize(user_id, batch_id, memories)
+        await self.tier_out(memories, now)
+        return len(memories)
+
+    async def summarize(self, user_id: str, batch_id: str, memories: List[Dict[str, Any]]):
+        """Fold a batch into per-type, per-month summary memories, at most once per summary"""
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for memory in memories:
+            groups.setdefault((memory["memory_type"], f"{memory['created_at']:%Y-%m}"), []).append(memory)
+
+        updates = []
+        for (memory_type, period), group in groups.items():
+            features = [memory.get("features") or {} for memory in group]
+            increments = {
+                "metadata.memory_count": len(group),
+                "metadata.total_words": sum(f.get("word_count", 0) for f in features),
+                "metadata.questions": sum(1 for f in features if f.get("is_question")),
+                "metadata.emotional": sum(1 for f in features if f.get("emotion_peak", 0) > 0.3),
+                "metadata.emotion_samples": sum(1 for f in features if f.get("emotions")),
+                "metadata.access_count": sum(memory.get("access_count", 0) for memory in group)
+            }
+            for emotion in emotion_lexicon.emotions:
+                increments[f"metadata.emotion_totals.{emotion}"] = sum(f.get("emotions", {}).get(emotion, 0.0) for f in features)
+            for topic in GROWTH_TOPICS:
+                increments[f"metadata.topic_counts.{topic}"] = sum(1 for f in features if topic in f.get("topics", []))
+
+            summary_id = str(uuid.uuid5(SUMMARY_NAMESPACE, f"{user_id}:{memory_type}:{period}"))
+            updates.append(UpdateOne(
+                {"id": summary_id, "compaction_batches": {"$ne": batch_id}},
+                {
+                    "$inc": increments,
+                    "$push": {"compaction_batches": {"$each": [batch_id], "$slice": -SUMMARY_BATCH_HISTORY}},
+                    "$max": {
+                        "importance_score": max(memory.get("importance_score", 0.5) for memory in group),
+                        "created_at": max(memory["created_at"] for memory in group),
+                        "last_accessed": max(memory.get("last_accessed") or memory["created_at"] for memory in group)
+                    },
+                    "$setOnInsert": {
+                        "user_id": user_id,
+                        "memory_type": SUMMARY_MEMORY_TYPE,
+                        "content": f"Summary of {memory_type} memories from {period}",
+                        "metadata.source_type": memory_type,
+                        "metadata.period": period,
+                        "access_count": 0,
+                        "features": MemoryFeatures().dict()
+                    }
+                },
+                upsert=True
+            ))
+
+        # A summary that already has the batch fails the filter and its upsert hits the unique id
+        try:
+            await self.db.ai_memories.bulk_write(updates, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def tier_out(self, memories: List[Dict[str, Any]], now: datetime):
+        """Move raw memories to the archive tier, or drop them when archiving is off"""
+        ids = [memory["id"] for memory in memories]
+        if self.archive_days > 0:
+            expires_at = now + timedelta(days=self.archive_days)
+            await self.db.ai_memories_archive.bulk_write([
+                UpdateOne(
+                    {"id": memory["id"]},
+                    {"$set": {**memory, "archived_at": now, "expires_at": expires_at}},
+                    upsert=True
+                )
+                for memory in memories
+            ], ordered=False)
+        await self.db.ai_memories.delete_many({"id": {"$in": ids}})
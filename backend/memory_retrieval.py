@@ -0,0 +1,124 @@
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import numpy as np
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from cache import LRUCache
+from events import EventBus
+from text_vectors import HashingVectorizer
+from write_buffer import WriteBehindBuffer
+
+MEMORY_VECTOR_DIMENSIONS = 256
+
+memory_vectorizer = HashingVectorizer(MEMORY_VECTOR_DIMENSIONS)
+
+def memory_embedding(content: str) -> bytes:
+    """Hashed float32 vector of a memory's text, as stored on the memory document"""
+    return memory_vectorizer.transform(content).tobytes()
+
+def utc_timestamp(moment: datetime) -> float:
+    """Epoch seconds of a naive utcnow() value, which .timestamp() would read as local time"""
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+class UserMemoryIndex:
+    """One user's memories as parallel arrays: vectors, importance, creation time, content"""
+
+    __slots__ = ("ids", "contents", "vectors", "importance", "created")
+
+    def __init__(self, memories: List[Dict[str, Any]]):
+        self.ids = [memory["id"] for memory in memories]
+        self.contents = [memory.get("content", "") for memory in memories]
+        self.vectors = np.zeros((len(memories), MEMORY_VECTOR_DIMENSIONS), dtype=np.float32)
+        for row, memory in enumerate(memories):
+            embedding = memory.get("embedding")
+            if embedding is not None:
+                self.vectors[row] = np.frombuffer(embedding, dtype=np.float32)
+            else:
+                self.vectors[row] = memory_vectorizer.transform(memory.get("content", ""))
+        self.importance = np.array([memory.get("importance_score", 0.5) for memory in memories], dtype=np.float32)
+        self.created = np.array([utc_timestamp(memory["created_at"]) for memory in memories], dtype=np.float64)
+
+    def add(self, memory: Dict[str, Any], vector: np.ndarray):
+        self.ids.append(memory["id"])
+        self.contents.append(memory.get("content", ""))
+        self.vectors = np.vstack([self.vectors, vector[np.newaxis, :]])
+        self.importance = np.append(self.importance, np.float32(memory.get("importance_score", 0.5)))
+        self.created = np.append(self.created, utc_timestamp(memory["created_at"]))
+
+class MemoryRetriever:
+    """Relevance-ranked recall over a user's memories from an in-process index.
+
+    A memory scores `similarity_weight` * cosine similarity to the query, plus
+    `recency_weight` * exp(-age / `recency_days`), plus `importance_weight` *
+    importance_score. Per-user indexes are loaded on first use from the
+    embeddings stored with each memory, kept current as memories are stored,
+    and evicted least-recently-used once `max_users` are held. Recalls bump
+    access_count/last_accessed through the write-behind buffer.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, write_buffer: WriteBehindBuffer, max_users: Optional[int] = None, recency_days: float = 30.0, similarity_weight: float = 0.6, recency_weight: float = 0.2, importance_weight: float = 0.2):
+        self.db = db
+        self.write_buffer = write_buffer
+        self.indexes = LRUCache(maxsize=max_users or int(os.environ.get("MEMORY_INDEX_USERS", "1000")))
+        self.recency_days = recency_days
+        self.similarity_weight = similarity_weight
+        self.recency_weight = recency_weight
+        self.importance_weight = importance_weight
+
+    async def index_for(self, user_id: str) -> UserMemoryIndex:
+        index = self.indexes.get(user_id)
+        if index is None:
+            memories = await self.db.ai_memories.find(
+                {"user_id": user_id},
+                {"_id": 0, "id": 1, "content": 1, "embedding": 1, "importance_score": 1, "created_at": 1}
+            ).to_list(None)
+            index = UserMemoryIndex(memories)
+            self.indexes.set(user_id, index)
+        return index
+
+    def add(self, memory: Dict[str, Any]):
+        """Index a newly stored memory if its user's index is loaded"""
+        index = self.indexes.get(memory["user_id"])
+        if index is not None:
+            index.add(memory, np.frombuffer(memory["embedding"], dtype=np.float32))
+
+    def invalidate(self, user_id: str):
+        self.indexes.pop(user_id)
+
+    def rank(self, index: UserMemoryIndex, query: str, k: int) -> List[Dict[str, Any]]:
+        if not index.ids or k <= 0:
+            return []
+
+        similarity = index.vectors @ memory_vectorizer.transform(query)
+        age_days = (time.time() - index.created) / 86400
+        scores = (
+            self.similarity_weight * similarity
+            + self.recency_weight * np.exp(-np.maximum(age_days, 0) / self.recency_days)
+            + self.importance_weight * index.importance
+        )
+
+        k = min(k, len(index.ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": index.ids[i], "content": index.contents[i], "score": float(scores[i]), "similarity": float(similarity[i])}
+            for i in top
+        ]
+
+    async def recall(self, user_id: str, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """The k memories most relevant to `query`"""
+        results = self.rank(await self.index_for(user_id), query, k)
+        if results:
+            await self.write_buffer.update_many(
+                "ai_memories",
+                {"id": {"$in": [result["id"] for result in results]}},
+                {"$inc": {"access_count": 1}, "$max": {"last_accessed": datetime.utcnow()}}
+            )
+        return results
+
+    def register_event_handlers(self, bus: EventBus):
+        async def on_memories_compacted(user_id: str, **_):
+            self.invalidate(user_id)
+
+        bus.subscribe("memories_compacted", on_memories_compacted)
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+class UsageMeter:
+    """Per-user, per-feature, per-day usage counters with atomic check-and-consume.
+
+    Each counter is one document keyed "<user_id>:<feature>:<YYYY-MM-DD>" (UTC
+    day), so a check is a single indexed lookup no matter how much history the
+    user has, and a TTL index removes counters once their day is over.
+    """
+
+    indexes = [
+        ("usage_counters", [("expires_at", 1)], {"expireAfterSeconds": 0})
+    ]
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+
+    @staticmethod
+    def day_key(day: datetime) -> str:
+        return f"{day:%Y-%m-%d}"
+
+    @staticmethod
+    def counter_id(user_id: str, feature: str, day_key: str) -> str:
+        return f"{user_id}:{feature}:{day_key}"
+
+    @staticmethod
+    def today() -> datetime:
+        return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    async def consume(self, user_id: str, feature: str, limit: Optional[int] = None, amount: int = 1) -> Tuple[bool, int, str]:
+        """Add `amount` to today's counter unless that would exceed `limit`.
+
+        Returns whether it was allowed, the usage afterwards and the day key of
+        the counter, which `release` needs. The limit check is part of the
+        update filter, so concurrent callers cannot overshoot it.
+        """
+        day = self.today()
+        if limit is not None and amount > limit:
+            return False, await self.get(user_id, feature), self.day_key(day)
+
+        counter_id = self.counter_id(user_id, feature, self.day_key(day))
+        query = {"_id": counter_id}
+        if limit is not None:
+            query["count"] = {"$lte": limit - amount}
+
+        # A DuplicateKeyError means the upsert collided with an existing counter: either
+        # another request created it concurrently (retrying matches it) or it is at the limit
+        for attempt in range(2):
+            try:
+                counter = await self.db.usage_counters.find_one_and_update(
+                    query,
+                    {
+                        "$inc": {"count": amount},
+                        "$setOnInsert": {
+                            "user_id": user_id,
+                            "feature": feature,
+                            "day": day,
+                            "expires_at": day + timedelta(days=2)
+                        }
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                return True, counter["count"], self.day_key(day)
+            except DuplicateKeyError:
+                pass
+
+        return False, await self.get(user_id, feature), self.day_key(day)
+
+    async def release(self, user_id: str, feature: str, day_key: str, amount: int = 1):
+        """Give back usage consumed for an action that did not happen, on the day it was charged"""
+        await self.db.usage_counters.update_one(
+            {"_id": self.counter_id(user_id, feature, day_key), "count": {"$gte": amount}},
+            {"$inc": {"count": -amount}}
+        )
+
+    async def get(self, user_id: str, feature: str) -> int:
+        return (await self.get_many(user_id, [feature]))[feature]
+
+    async def get_many(self, user_id: str, features: Iterable[str]) -> Dict[str, int]:
+        """Today's usage of several features in one query"""
+        day = self.today()
+        ids = {self.counter_id(user_id, feature, self.day_key(day)): feature for feature in features}
+        counters = await self.db.usage_counters.find({"_id": {"$in": list(ids)}}).to_list(len(ids))
+
+        usage = {feature: 0 for feature in ids.values()}
+        for counter in counters:
+            usage[ids[counter["_id"]]] = counter["count"]
+        return usage
@@ -0,0 +1,210 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestTrace:
+    """Mongo commands issued while serving one request"""
+
+    __slots__ = ("method", "path", "queries")
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.queries: List[Dict[str, Any]] = []
+
+# Set by MetricsMiddleware; Motor copies the context into its executor threads,
+# so the command listener sees the trace of the request that issued the command
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self.lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(**labels: str) -> str:
+    return ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+
+class MetricsRegistry:
+    """Request and Mongo command metrics, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self.request_latency: Dict[Tuple[str, str, str], Histogram] = {}
+        self.mongo_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.mongo_documents: Dict[Tuple[str, str], int] = {}
+        self.mongo_failures: Dict[Tuple[str, str], int] = {}
+        self.lock = threading.Lock()
+
+    def _histogram(self, table: Dict, key: Tuple) -> Histogram:
+        histogram = table.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = table.setdefault(key, Histogram())
+        return histogram
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        self._histogram(self.request_latency, (method, route, str(status))).observe(seconds)
+
+    def observe_command(self, command: str, collection: str, seconds: float, documents: int, failed: bool = False):
+        key = (command, collection)
+        self._histogram(self.mongo_latency, key).observe(seconds)
+        with self.lock:
+            self.mongo_documents[key] = self.mongo_documents.get(key, 0) + documents
+            if failed:
+                self.mongo_failures[key] = self.mongo_failures.get(key, 0) + 1
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP http_request_duration_seconds HTTP request latency by route",
+            "# TYPE http_request_duration_seconds histogram"
+        ]
+        for (method, route, status), histogram in list(self.request_latency.items()):
+            lines += histogram.render("http_request_duration_seconds", format_labels(method=method, route=route, status=status))
+
+        lines += [
+            "# HELP mongo_command_duration_seconds Mongo command latency by command and collection",
+            "# TYPE mongo_command_duration_seconds histogram"
+        ]
+        for (command, collection), histogram in list(self.mongo_latency.items()):
+            lines += histogram.render("mongo_command_duration_seconds", format_labels(command=command, collection=collection))
+
+        lines += [
+            "# HELP mongo_documents_returned_total Documents returned or affected by Mongo commands",
+            "# TYPE mongo_documents_returned_total counter"
+        ]
+        for (command, collection), total in list(self.mongo_documents.items()):
+            lines.append(f"mongo_documents_returned_total{{{format_labels(command=command, collection=collection)}}} {total}")
+
+        lines += [
+            "# HELP mongo_command_failures_total Failed Mongo commands",
+            "# TYPE mongo_command_failures_total counter"
+        ]
+        for (command, collection), total in list(self.mongo_failures.items()):
+            lines.append(f"mongo_command_failures_total{{{format_labels(command=command, collection=collection)}}} {total}")
+
+        return "\n".join(lines) + "\n"
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Attribute every Mongo command to the request that issued it"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        # (connection_id, request_id) -> (command, collection, trace)
+        self.in_flight: Dict[Tuple[Any, int], Tuple[str, str, Optional[RequestTrace]]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "")
+        self.in_flight[(event.connection_id, event.request_id)] = (event.command_name, collection, current_trace.get())
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, self._documents(event.reply), failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event, 0, failed=True)
+
+    def _finish(self, event, documents: int, failed: bool):
+        started = self.in_flight.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+
+        command, collection, trace = started
+        seconds = event.duration_micros / 1e6
+        self.registry.observe_command(command, collection, seconds, documents, failed)
+
+        if trace is not None:
+            trace.queries.append({
+                "command": command,
+                "collection": collection,
+                "duration_ms": round(seconds * 1000, 3),
+                "documents": documents,
+                "failed": failed
+            })
+
+    @staticmethod
+    def _documents(reply: Dict[str, Any]) -> int:
+        cursor = reply.get("cursor")
+        if isinstance(cursor, dict):
+            return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+        if "value" in reply:
+            return 1 if reply["value"] else 0
+        n = reply.get("n", 0)
+        return n if isinstance(n, int) else 0
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and the request's Mongo commands.
+
+    Set SLOW_REQUEST_MS to log requests slower than that, with their query list.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+        slow_ms = os.environ.get("SLOW_REQUEST_MS")
+        self.slow_threshold = float(slow_ms) / 1000 if slow_ms else None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = current_trace.set(trace)
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_trace.reset(token)
+
+            # Label by route template, not the raw path, to keep cardinality bounded
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            self.registry.observe_request(scope["method"], route_path, status["code"], elapsed)
+
+            if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+                logger.warning(
+                    f"Slow request {scope['method']} {scope['path']} took {elapsed * 1000:.1f}ms "
+                    f"with {len(trace.queries)} Mongo commands: {trace.queries}"
+                )
@@ -56,15 +56,35 @@ class User(BaseModel):
     subscription_expires: Optional[datetime] = None
     credits: int = 100
     
+    # AI memory budget override, defaults to MEMORY_BUDGET
+    memory_budget: Optional[int] = None
+    
     # Privacy settings
     profile_visibility: str = "public"  # public, friends, private
     journey_sharing: bool = True
     
+class UserSummary(BaseModel):
+    id: str
+    username: str
+    display_name: Optional[str] = None
+    avatar_url: Optional[str] = None
+    bio: Optional[str] = None
+    current_mode: PlatformMode = PlatformMode.ECHOVERSE
+    level: int = 1
+
 class UserCreate(BaseModel):
     username: str
     email: Optional[str] = None
     display_name: Optional[str] = None
 
+class AccessToken(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_at: datetime
+
+class CreatedUser(User):
+    access_token: Optional[AccessToken] = None
+
 class UserUpdate(BaseModel):
     display_name: Optional[str] = None
     bio: Optional[str] = None
@@ -94,8 +114,8 @@ class Post(BaseModel):
     content: str
     content_type: str = "text"  # text, journey, achievement, challenge
     metadata: Dict[str, Any] = Field(default_factory=dict)
-    likes: List[str] = Field(default_factory=list)
-    comments: List[str] = Field(default_factory=list)
+    like_count: int = 0
+    comment_count: int = 0
     shares: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     visibility: str = "public"
@@ -126,6 +146,14 @@ class Challenge(BaseModel):
     requirements: Dict[str, Any] = Field(default_factory=dict)
 
 # AI Models
+class MemoryFeatures(BaseModel):
+    has_user_text: bool = False
+    word_count: int = 0
+    is_question: bool = False
+    emotions: Dict[str, float] = Field(default_factory=dict)
+    emotion_peak: float = 0.0
+    topics: List[str] = Field(default_factory=list)
+
 class AIMemory(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
@@ -136,6 +164,8 @@ class AIMemory(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     last_accessed: datetime = Field(default_factory=datetime.utcnow)
     access_count: int = 0
+    features: Optional[MemoryFeatures] = None
+    embedding: Optional[bytes] = None
 
 class AIPersonality(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -147,6 +177,7 @@ class AIPersonality(BaseModel):
     trust_level: float = 0.5
     adaptation_rate: float = 0.1
     last_evolution: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 0
 
 # Analytics Models
 class UserSession(BaseModel):
@@ -240,7 +271,7 @@ class UserProfile(BaseModel):
 
 class SocialFeed(BaseModel):
     posts: List[Dict[str, Any]]
-    users: Dict[str, User]
+    users: Dict[str, UserSummary]
     has_more: bool
     next_cursor: Optional[str] = None
 
@@ -248,4 +279,5 @@ class Leaderboard(BaseModel):
     category: str
     period: str  # daily, weekly, monthly, all_time
     entries: List[Dict[str, Any]]
-    user_rank: Optional[int] = None
\ No newline at end of file
+    user_rank: Optional[int] = None
+    next_cursor: Optional[str] = None
\ No newline at end of file
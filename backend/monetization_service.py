@@ -4,15 +4,40 @@ from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from models import *
+from unit_of_work import load_user, apply_user_update
+from pagination import Page, paginate
+from cache import LRUCache
+from events import EventBus, event_bus
+from entitlements import EntitlementCache, parse_tier
+from metering import UsageMeter
 
 # Stripe configuration
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY', 'sk_test_demo_key')
 STRIPE_AVAILABLE = os.environ.get('STRIPE_SECRET_KEY') is not None
 
+# Features whose usage is counted per day by the usage meter
+METERED_FEATURES = ("daily_ai_interactions", "challenge_participation")
+
 class MonetizationService:
+    indexes = [
+        ("users", [("subscription_tier", 1)], {}),
+        ("subscriptions", [("id", 1)], {"unique": True}),
+        ("subscriptions", [("user_id", 1), ("is_active", 1)], {}),
+        ("transactions", [("id", 1)], {"unique": True}),
+        ("transactions", [("user_id", 1), ("created_at", -1), ("id", -1)], {}),
+        ("transactions", [("status", 1), ("created_at", -1)], {}),
+        ("promotional_codes", [("code", 1)], {"unique": True}),
+        ("promo_usage", [("user_id", 1), ("promo_code", 1)], {"unique": True})
+    ]
+    
     def __init__(self, db: AsyncIOMotorDatabase):
         self.db = db
         
+        self.meter = UsageMeter(db)
+        
+        # Per-user access results, dropped on usage-changing events
+        self.access_cache = LRUCache(maxsize=10000, ttl=float(os.environ.get("FEATURE_ACCESS_CACHE_TTL", "300")))
+        
         # Subscription pricing (in cents)
         self.pricing = {
             SubscriptionTier.FREE: 0,
@@ -59,6 +84,8 @@ class MonetizationService:
                 "white_label": True
             }
         }
+        
+        self.entitlements = EntitlementCache(db, self.feature_access)
     
     async def create_subscription(self, user_id: str, tier: SubscriptionTier, payment_method_id: str = None) -> Dict[str, Any]:
         """Create a new subscription for user"""
@@ -103,7 +130,7 @@ class MonetizationService:
         
         try:
             # Create Stripe customer
-            user = await self.db.users.find_one({"id": user_id})
+            user = await load_user(self.db, user_id)
             customer = stripe.Customer.create(
                 email=user.get("email"),
                 metadata={"user_id": user_id}
@@ -156,19 +183,37 @@ class MonetizationService:
             print(f"Stripe error: {e}")
             return {"error": str(e)}
     
+    def register_event_handlers(self, bus: EventBus):
+        """Drop cached entitlements and access results when they may have changed"""
+        self.entitlements.register_event_handlers(bus)
+        
+        async def on_entitlements_changed(user_id: str, **_):
+            self.access_cache.pop(user_id)
+        
+        async def on_connection_accepted(requester_id: str, target_id: str, **_):
+            self.access_cache.pop(requester_id)
+            self.access_cache.pop(target_id)
+        
+        async def on_journey_step_saved(user_id: str, **_):
+            self.access_cache.pop(user_id)
+        
+        bus.subscribe("entitlements_changed", on_entitlements_changed)
+        bus.subscribe("connection_accepted", on_connection_accepted)
+        bus.subscribe("journey_step_saved", on_journey_step_saved)
+    
     async def update_user_subscription(self, user_id: str, tier: SubscriptionTier):
         """Update user's subscription tier"""
         end_date = None if tier == SubscriptionTier.FREE else datetime.utcnow() + timedelta(days=30)
         
-        await self.db.users.update_one(
-            {"id": user_id},
-            {
-                "$set": {
-                    "subscription_tier": tier,
-                    "subscription_expires": end_date
-                }
+        await apply_user_update(self.db, user_id, {
+            "$set": {
+                "subscription_tier": tier,
+                "subscription_expires": end_date
             }
-        )
+        }, defer=False)
+        
+        # Covers create_subscription and cancel_subscription, which both end up here
+        await event_bus.publish("entitlements_changed", user_id=user_id)
     
     async def cancel_subscription(self, user_id: str) -> bool:
         """Cancel user's subscription"""
@@ -200,71 +245,109 @@ class MonetizationService:
     
     async def check_feature_access(self, user_id: str, feature: str) -> Dict[str, Any]:
         """Check if user has access to a specific feature"""
-        user = await self.db.users.find_one({"id": user_id})
-        if not user:
+        access = await self.check_feature_access_many(user_id)
+        if access is None:
             return {"access": False, "reason": "User not found"}
+        return access.get(feature, {"access": False, "reason": "Feature not defined"})
+    
+    async def check_feature_access_many(self, user_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Check access to every feature of the user's tier from one user read and one usage aggregation"""
+        cached = self.access_cache.get(user_id)
+        if cached is not None:
+            return cached
         
-        tier = SubscriptionTier(user.get("subscription_tier", "free"))
+        entitlements = await self.entitlements.get(user_id)
+        if entitlements is None:
+            return None
         
-        # Check if subscription is expired
-        expires = user.get("subscription_expires")
-        if expires and datetime.fromisoformat(expires) < datetime.utcnow():
+        if entitlements.expired and entitlements.tier != SubscriptionTier.FREE:
             # Expired subscription - downgrade to free
             await self.update_user_subscription(user_id, SubscriptionTier.FREE)
-            tier = SubscriptionTier.FREE
         
-        feature_limits = self.feature_access.get(tier, {})
-        feature_limit = feature_limits.get(feature)
+        feature_limits = entitlements.limits
+        metered = [feature for feature, limit in feature_limits.items() if isinstance(limit, int) and not isinstance(limit, bool)]
+        usage = await self.get_feature_usage_many(user_id, metered)
+        
+        access = {}
+        for feature, feature_limit in feature_limits.items():
+            if feature_limit is False:
+                access[feature] = {
+                    "access": False, 
+                    "reason": f"Feature requires {SubscriptionTier.PRO} or higher",
+                    "upgrade_required": True
+                }
+            elif feature_limit is True or feature_limit == "unlimited":
+                access[feature] = {"access": True, "limit": feature_limit}
+            else:
+                # Check usage for limited features
+                access[feature] = {
+                    "access": usage[feature] < feature_limit,
+                    "limit": feature_limit,
+                    "usage": usage[feature],
+                    "remaining": max(0, feature_limit - usage[feature])
+                }
         
-        if feature_limit is None:
-            return {"access": False, "reason": "Feature not defined"}
+        # Daily counters reset at midnight, so never cache across it
+        now = datetime.utcnow()
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self.access_cache.set(user_id, access, ttl=min(self.access_cache.ttl, (midnight - now).total_seconds()))
         
-        if feature_limit is False:
+        return access
+    
+    async def get_feature_usage(self, user_id: str, feature: str) -> int:
+        """Get current feature usage for user"""
+        usage = await self.get_feature_usage_many(user_id, [feature])
+        return usage.get(feature, 0)
+    
+    async def get_feature_usage_many(self, user_id: str, features: List[str]) -> Dict[str, int]:
+        """Usage of several limited features; metered ones come from today's counters in one query"""
+        usage = {feature: 0 for feature in features}
+        if "social_connections" in features or "journey_steps" in features:
+            user = await load_user(self.db, user_id) or {}
+            if "social_connections" in features:
+                usage["social_connections"] = len(user.get("connections", []))
+            # Journey steps are a lifetime allowance, not a daily one
+            if "journey_steps" in features:
+                usage["journey_steps"] = len(user.get("journey_progress") or {})
+        
+        metered = [feature for feature in features if feature in METERED_FEATURES]
+        if metered:
+            usage.update(await self.meter.get_many(user_id, metered))
+        
+        return usage
+    
+    async def consume_feature(self, user_id: str, feature: str, amount: int = 1) -> Dict[str, Any]:
+        """Use a metered feature if the user's tier allows it, atomically against the daily limit"""
+        entitlements = await self.entitlements.get(user_id)
+        if entitlements is None:
+            return {"access": False, "reason": "User not found"}
+        
+        limit = entitlements.limits.get(feature)
+        if limit is None:
+            return {"access": False, "reason": "Feature not defined"}
+        if limit is False:
             return {
-                "access": False, 
+                "access": False,
                 "reason": f"Feature requires {SubscriptionTier.PRO} or higher",
                 "upgrade_required": True
             }
         
-        if feature_limit is True or feature_limit == "unlimited":
-            return {"access": True, "limit": feature_limit}
-        
-        # Check usage for limited features
-        if isinstance(feature_limit, int):
-            usage = await self.get_feature_usage(user_id, feature)
-            return {
-                "access": usage < feature_limit,
-                "limit": feature_limit,
-                "usage": usage,
-                "remaining": max(0, feature_limit - usage)
-            }
-        
-        return {"access": True, "limit": feature_limit}
+        numeric = isinstance(limit, int) and not isinstance(limit, bool)
+        allowed, usage, day = await self.meter.consume(user_id, feature, limit if numeric else None, amount)
+        self.access_cache.pop(user_id)
+        
+        result = {"access": allowed, "limit": limit, "usage": usage, "day": day}
+        if numeric:
+            result["remaining"] = max(0, limit - usage)
+        if not allowed:
+            result["reason"] = f"Daily {feature} limit reached"
+            result["upgrade_required"] = True
+        return result
     
-    async def get_feature_usage(self, user_id: str, feature: str) -> int:
-        """Get current feature usage for user"""
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        if feature == "daily_ai_interactions":
-            count = await self.db.ai_memories.count_documents({
-                "user_id": user_id,
-                "memory_type": "conversation",
-                "created_at": {"$gte": today}
-            })
-            return count
-        
-        elif feature == "challenge_participation":
-            count = await self.db.challenges.count_documents({
-                "participants": user_id,
-                "start_date": {"$gte": today}
-            })
-            return count
-        
-        elif feature == "social_connections":
-            user = await self.db.users.find_one({"id": user_id})
-            return len(user.get("connections", []))
-        
-        return 0
+    async def release_feature(self, user_id: str, feature: str, day: str, amount: int = 1):
+        """Undo a consume_feature whose action did not go through, against the day it charged"""
+        await self.meter.release(user_id, feature, day, amount)
+        self.access_cache.pop(user_id)
     
     async def purchase_credits(self, user_id: str, amount: int, payment_method_id: str = None) -> Dict[str, Any]:
         """Purchase credits for user"""
@@ -274,10 +357,7 @@ class MonetizationService:
         
         if not STRIPE_AVAILABLE:
             # Demo mode - grant credits immediately
-            await self.db.users.update_one(
-                {"id": user_id},
-                {"$inc": {"credits": amount}}
-            )
+            await apply_user_update(self.db, user_id, {"$inc": {"credits": amount}}, defer=False)
             
             # Record transaction
             transaction = Transaction(
@@ -346,7 +426,7 @@ class MonetizationService:
             return {"error": "Feature not found or free"}
         
         if payment_method == "credits":
-            user = await self.db.users.find_one({"id": user_id})
+            user = await load_user(self.db, user_id)
             current_credits = user.get("credits", 0)
             
             if current_credits < cost:
@@ -356,11 +436,13 @@ class MonetizationService:
                     "available": current_credits
                 }
             
-            # Deduct credits
-            await self.db.users.update_one(
-                {"id": user_id},
-                {"$inc": {"credits": -cost}}
-            )
+            # Deduct credits and grant feature access (stored in user's unlocked features)
+            await apply_user_update(self.db, user_id, {
+                "$inc": {"credits": -cost},
+                "$addToSet": {"unlocked_features": feature_id}
+            }, defer=False)
+            
+            await event_bus.publish("entitlements_changed", user_id=user_id)
             
             # Record purchase
             transaction = Transaction(
@@ -375,12 +457,6 @@ class MonetizationService:
             )
             await self.db.transactions.insert_one(transaction.dict())
             
-            # Grant feature access (store in user's unlocked features)
-            await self.db.users.update_one(
-                {"id": user_id},
-                {"$addToSet": {"unlocked_features": feature_id}}
-            )
-            
             return {
                 "success": True,
                 "feature_unlocked": feature_id,
@@ -390,13 +466,17 @@ class MonetizationService:
         
         return {"error": "Invalid payment method"}
     
-    async def get_user_transaction_history(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+    async def get_user_transaction_history(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Page:
         """Get user's transaction history"""
-        transactions = await self.db.transactions.find({
-            "user_id": user_id
-        }).sort("created_at", -1).limit(limit).to_list(limit)
-        
-        return transactions
+        return await paginate(
+            self.db.transactions,
+            {"user_id": user_id},
+            [("created_at", -1), ("id", -1)],
+            (datetime, str),
+            limit,
+            cursor,
+            projection={"_id": 0}
+        )
     
     async def generate_revenue_analytics(self) -> Dict[str, Any]:
         """Generate revenue analytics for platform"""
@@ -507,11 +587,11 @@ class MonetizationService:
     async def get_subscription_analytics(self, user_id: str) -> Dict[str, Any]:
         """Get detailed subscription analytics for user"""
         
-        user = await self.db.users.find_one({"id": user_id})
+        user = await load_user(self.db, user_id)
         if not user:
             return {}
         
-        tier = SubscriptionTier(user.get("subscription_tier", "free"))
+        tier = parse_tier(user_id, user.get("subscription_tier", "free"))
         
         # Calculate subscription value
         days_since_signup = (datetime.utcnow() - datetime.fromisoformat(user["created_at"])).days
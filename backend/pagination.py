@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+# (field, direction) pairs; the last field must be unique, e.g. ("id", -1)
+SortSpec = Sequence[Tuple[str, int]]
+
+class Page:
+    """One page of a keyset-paginated listing"""
+
+    __slots__ = ("items", "next_cursor", "has_more")
+
+    def __init__(self, items: List[Dict[str, Any]], next_cursor: Optional[str], has_more: bool):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.has_more = has_more
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+def _decode_value(value: Any) -> Any:
+    # Only {"$date": ...} objects are ever encoded; anything else nested could
+    # smuggle query operators into a keyset filter
+    if isinstance(value, dict):
+        if set(value) != {"$date"} or not isinstance(value["$date"], str):
+            raise ValueError
+        return datetime.fromisoformat(value["$date"])
+    if isinstance(value, list):
+        raise ValueError
+    return value
+
+def encode_cursor(*values: Any) -> str:
+    """Serialize a sort key (plus any extra state) into an opaque URL-safe cursor"""
+    payload = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types: type) -> Tuple[Any, ...]:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors.
+
+    When `types` are given the cursor must hold exactly that many values, each
+    an instance of the matching type.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list):
+            raise ValueError
+        values = tuple(_decode_value(value) for value in values)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+    if types and (
+        len(values) != len(types)
+        or any(isinstance(value, bool) or not isinstance(value, expected) for value, expected in zip(values, types))
+    ):
+        raise ValueError("Invalid cursor")
+    return values
+
+def sort_key(document: Dict[str, Any], sort: SortSpec) -> Tuple[Any, ...]:
+    return tuple(document.get(field) for field, _ in sort)
+
+def keyset_filter(sort: SortSpec, after: Sequence[Any]) -> Dict[str, Any]:
+    """Match documents strictly after `after` in `sort` order.
+
+    For [("created_at", -1), ("id", -1)] this is
+    created_at < c OR (created_at == c AND id < i), which a compound index on
+    the same fields answers as a single range scan.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prefix: after[j] for j, (prefix, _) in enumerate(sort[:i])}
+        clause[field] = {"$lt" if direction < 0 else "$gt": after[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+async def paginate(
+    collection: AsyncIOMotorCollection,
+    query: Dict[str, Any],
+    sort: SortSpec,
+    types: Sequence[type],
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None
+) -> Page:
+    """Fetch one page of `query` in `sort` order, resuming after `cursor`.
+
+    `types` gives the expected type of each sort field's cursor value.
+    """
+    if cursor:
+        after = decode_cursor(cursor, *types)
+        query = {"$and": [query, keyset_filter(sort, after)]}
+
+    documents = await collection.find(query, projection).sort(list(sort)).limit(limit + 1).to_list(limit + 1)
+
+    has_more = len(documents) > limit
+    items = documents[:limit]
+    next_cursor = encode_cursor(*sort_key(items[-1], sort)) if items and has_more else None
+
+    return Page(items, next_cursor, has_more)
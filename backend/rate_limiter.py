@@ -0,0 +1,196 @@
+import os
+import math
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from cache import LRUCache
+from entitlements import EntitlementCache
+from models import *
+
+class RateLimitRule:
+    """A quota of `limit` requests per `window` seconds"""
+
+    __slots__ = ("name", "limit", "window")
+
+    def __init__(self, name: str, limit: int, window: float = 60.0):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    @property
+    def refill_rate(self) -> float:
+        return self.limit / self.window
+
+class RateLimitDecision:
+    __slots__ = ("allowed", "limit", "remaining", "retry_after")
+
+    def __init__(self, allowed: bool, limit: int, remaining: int, retry_after: float = 0.0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining)
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+class InMemoryRateLimitBackend:
+    """Per-process token buckets, two floats per key, idle keys evicted LRU-first"""
+
+    def __init__(self, max_keys: int = 100000):
+        # key -> [tokens, last_refill]
+        self.buckets = LRUCache(maxsize=max_keys)
+
+    async def hit(self, key: str, rule: RateLimitRule) -> RateLimitDecision:
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+
+        if bucket is None:
+            bucket = [float(rule.limit), now]
+            self.buckets.set(key, bucket)
+        else:
+            elapsed = now - bucket[1]
+            bucket[0] = min(float(rule.limit), bucket[0] + elapsed * rule.refill_rate)
+            bucket[1] = now
+
+        if bucket[0] < 1.0:
+            retry_after = (1.0 - bucket[0]) / rule.refill_rate
+            return RateLimitDecision(False, rule.limit, 0, retry_after)
+
+        bucket[0] -= 1.0
+        return RateLimitDecision(True, rule.limit, int(bucket[0]))
+
+class MongoRateLimitBackend:
+    """Sliding-window counters shared by every worker through a TTL collection"""
+
+    # Finished windows are expired by Mongo
+    indexes = [
+        ("rate_limits", [("expires_at", 1)], {"expireAfterSeconds": 0})
+    ]
+
+    def __init__(self, db: AsyncIOMotorDatabase, max_keys: int = 100000):
+        self.collection = db.rate_limits
+        # Closed windows no longer change, so their counts are cached locally
+        self.previous_counts = LRUCache(maxsize=max_keys)
+
+    async def hit(self, key: str, rule: RateLimitRule) -> RateLimitDecision:
+        now = time.time()
+        window_index = int(now // rule.window)
+        elapsed_fraction = (now % rule.window) / rule.window
+
+        current = await self.collection.find_one_and_update(
+            {"_id": f"{key}:{window_index}"},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {
+                    "expires_at": datetime.utcfromtimestamp((window_index + 2) * rule.window)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        previous_key = f"{key}:{window_index - 1}"
+        previous = self.previous_counts.get(previous_key)
+        if previous is None:
+            doc = await self.collection.find_one({"_id": previous_key}, {"count": 1})
+            previous = doc["count"] if doc else 0
+            self.previous_counts.set(previous_key, previous)
+
+        estimated = current["count"] + previous * (1.0 - elapsed_fraction)
+        remaining = max(0, int(rule.limit - estimated))
+
+        if estimated > rule.limit:
+            retry_after = rule.window * (1.0 - elapsed_fraction)
+            return RateLimitDecision(False, rule.limit, 0, retry_after)
+
+        return RateLimitDecision(True, rule.limit, remaining)
+
+class UserTierResolver:
+    """Resolve the subscription tier of an authenticated user from the entitlement cache.
+
+    Only pass ids that were verified (see auth.authenticated_user_id); anything
+    else gets the default tier.
+    """
+
+    def __init__(self, entitlements: EntitlementCache, default_tier: SubscriptionTier = SubscriptionTier.FREE):
+        self.entitlements = entitlements
+        self.default_tier = default_tier
+
+    async def resolve(self, user_id: Optional[str]) -> SubscriptionTier:
+        if not user_id:
+            return self.default_tier
+
+        entitlements = await self.entitlements.get(user_id)
+        return entitlements.effective_tier if entitlements else self.default_tier
+
+class RateLimiter:
+    """Route- and tier-aware rate limiter over a pluggable counter backend"""
+
+    # Requests per minute for any route without a dedicated quota
+    default_quotas = {
+        SubscriptionTier.FREE: 100,
+        SubscriptionTier.PRO: 300,
+        SubscriptionTier.ELITE: 1000
+    }
+
+    # Requests per minute for expensive routes, matched by path prefix
+    route_quotas = {
+        "/api/ai/chat": {
+            SubscriptionTier.FREE: 20,
+            SubscriptionTier.PRO: 120,
+            SubscriptionTier.ELITE: 600
+        },
+        "/api/analytics/platform": {
+            SubscriptionTier.FREE: 10,
+            SubscriptionTier.PRO: 30,
+            SubscriptionTier.ELITE: 60
+        },
+        "/api/analytics/funnel": {
+            SubscriptionTier.FREE: 10,
+            SubscriptionTier.PRO: 30,
+            SubscriptionTier.ELITE: 60
+        }
+    }
+
+    def __init__(self, backend, tier_resolver: Optional[UserTierResolver] = None, window: float = 60.0):
+        self.backend = backend
+        self.tier_resolver = tier_resolver
+        self.window = window
+        self.rules: Dict[Tuple[str, SubscriptionTier], RateLimitRule] = {}
+
+    @classmethod
+    def from_env(cls, db: AsyncIOMotorDatabase, entitlements: Optional[EntitlementCache] = None) -> "RateLimiter":
+        """Build the limiter selected by RATE_LIMIT_BACKEND (memory or mongo)"""
+        if os.environ.get("RATE_LIMIT_BACKEND", "memory") == "mongo":
+            backend = MongoRateLimitBackend(db)
+        else:
+            backend = InMemoryRateLimitBackend()
+        return cls(backend, UserTierResolver(entitlements or EntitlementCache(db)))
+
+    def resolve_rule(self, path: str, tier: SubscriptionTier) -> RateLimitRule:
+        route = next((prefix for prefix in self.route_quotas if path.startswith(prefix)), "*")
+
+        rule = self.rules.get((route, tier))
+        if rule is None:
+            quotas = self.route_quotas.get(route, self.default_quotas)
+            rule = RateLimitRule(route, quotas[tier], self.window)
+            self.rules[(route, tier)] = rule
+
+        return rule
+
+    async def check(self, client_key: str, path: str, user_id: Optional[str] = None) -> RateLimitDecision:
+        """Consume one request from the client's quota for this route; `user_id` must be authenticated"""
+        tier = SubscriptionTier.FREE
+        if self.tier_resolver:
+            tier = await self.tier_resolver.resolve(user_id)
+
+        rule = self.resolve_rule(path, tier)
+        return await self.backend.hit(f"{client_key}|{rule.name}", rule)
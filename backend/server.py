@@ -1,7 +1,7 @@
 from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
@@ -23,21 +23,42 @@ from ai_service import AdvancedAIService
 from monetization_service import MonetizationService
 from xr_service import XRService
 from analytics_service import AnalyticsService
+from rate_limiter import RateLimiter
+from auth import authenticated_user_id, issue_access_token
+from indexes import IndexRegistry
+from write_buffer import WriteBehindBuffer
+from events import event_bus
+from metrics import MetricsRegistry, MongoCommandListener, MetricsMiddleware
+from unit_of_work import UserUnitOfWork, current_unit_of_work, load_user, apply_user_update
+from user_summaries import invalidate_user_summary, load_user_summaries
+from identity_index import IdentityIndex
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Request and Mongo command instrumentation
+metrics = MetricsRegistry()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandListener(metrics)])
 db = client[os.environ['DB_NAME']]
 
+# Telemetry writes are batched into bulk writes
+write_buffer = WriteBehindBuffer(db)
+
+# Hashed journey vectors for similar-journey matching and discovery, persisted on disk
+identity_index = IdentityIndex(db)
+
 # Initialize services
-social_service = SocialService(db)
-ai_service = AdvancedAIService(db)
+social_service = SocialService(db, write_buffer, identity_index)
+ai_service = AdvancedAIService(db, write_buffer)
 monetization_service = MonetizationService(db)
-xr_service = XRService(db)
-analytics_service = AnalyticsService(db)
+xr_service = XRService(db, write_buffer)
+analytics_service = AnalyticsService(db, write_buffer, ai_service, social_service)
+analytics_service.register_event_handlers(event_bus)
+monetization_service.register_event_handlers(event_bus)
+ai_service.register_event_handlers(event_bus)
 
 # Create the main app
 app = FastAPI(
@@ -58,36 +79,47 @@ analytics_router = APIRouter(prefix="/analytics", tags=["Analytics"])
 security = HTTPBearer(auto_error=False)
 
 # Rate limiting middleware
-request_counts = {}
+rate_limiter = RateLimiter.from_env(db, monetization_service.entitlements)
+
+# Indexes declared by every service, applied at startup
+index_registry = IndexRegistry()
+for service in [social_service, social_service.timelines, social_service.leaderboards, ai_service, ai_service.compactor, monetization_service, monetization_service.meter, xr_service, analytics_service, identity_index, rate_limiter.backend]:
+    index_registry.register_service(service)
 
 async def rate_limit_middleware(request: Request, call_next):
-    client_ip = request.client.host
-    current_time = time.time()
-    
-    # Clean old entries
-    cutoff_time = current_time - 60  # 1 minute window
-    request_counts[client_ip] = [
-        timestamp for timestamp in request_counts.get(client_ip, [])
-        if timestamp > cutoff_time
-    ]
+    # The tier comes only from an access token issued by POST /users, never from request parameters
+    decision = await rate_limiter.check(
+        request.client.host if request.client else "unknown",
+        request.url.path,
+        authenticated_user_id(request.headers.get("authorization"))
+    )
     
-    # Check rate limit (100 requests per minute)
-    if len(request_counts.get(client_ip, [])) >= 100:
+    if not decision.allowed:
         return JSONResponse(
             status_code=429,
-            content={"error": "Rate limit exceeded. Try again later."}
+            content={"error": "Rate limit exceeded. Try again later."},
+            headers=decision.headers()
         )
     
-    # Add current request
-    if client_ip not in request_counts:
-        request_counts[client_ip] = []
-    request_counts[client_ip].append(current_time)
-    
     response = await call_next(request)
+    response.headers.update(decision.headers())
     return response
 
 app.middleware("http")(rate_limit_middleware)
 
+async def unit_of_work_middleware(request: Request, call_next):
+    """Share one user identity map per request and commit its coalesced writes"""
+    unit_of_work = UserUnitOfWork(db)
+    token = current_unit_of_work.set(unit_of_work)
+    try:
+        response = await call_next(request)
+        await unit_of_work.commit()
+    finally:
+        current_unit_of_work.reset(token)
+    return response
+
+app.middleware("http")(unit_of_work_middleware)
+
 # Core API Endpoints (Enhanced from Phase 1)
 @api_router.get("/", tags=["System"])
 async def root():
@@ -105,9 +137,24 @@ async def root():
         "status": "production_ready"
     }
 
-@api_router.post("/users", response_model=User, tags=["Users"])
+@api_router.get("/metrics", tags=["System"], response_class=PlainTextResponse)
+async def get_metrics():
+    """Request latency and Mongo command metrics in Prometheus text format"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@api_router.get("/system/indexes", tags=["System"])
+async def get_index_drift():
+    """Report differences between declared and live Mongo indexes"""
+    drift = await index_registry.drift(db)
+    return {"in_sync": not drift, "drift": drift}
+
+def access_token_for(user_id: str) -> Optional[AccessToken]:
+    issued = issue_access_token(user_id)
+    return AccessToken(access_token=issued[0], expires_at=issued[1]) if issued else None
+
+@api_router.post("/users", response_model=CreatedUser, tags=["Users"])
 async def create_user(user_data: UserCreate):
-    """Create a new user with enhanced profile"""
+    """Create a new user with enhanced profile and an access token for its requests"""
     user = User(**user_data.dict())
     try:
         await db.users.insert_one(user.dict())
@@ -122,14 +169,24 @@ async def create_user(user_data: UserCreate):
             "actions_taken": [{"action": "account_created", "timestamp": datetime.utcnow().isoformat()}]
         })
         
-        return user
+        return CreatedUser(**user.dict(), access_token=access_token_for(user.id))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error creating user: {str(e)}")
 
+@api_router.post("/users/{user_id}/token", response_model=AccessToken, tags=["Users"])
+async def refresh_access_token(user_id: str, credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+    """Exchange a still-valid access token for a fresh one"""
+    if not credentials or authenticated_user_id(f"Bearer {credentials.credentials}") != user_id:
+        raise HTTPException(status_code=401, detail="A valid access token for this user is required")
+    token = access_token_for(user_id)
+    if token is None:
+        raise HTTPException(status_code=503, detail="Access tokens are not enabled")
+    return token
+
 @api_router.get("/users/{user_id}", response_model=UserProfile, tags=["Users"])
 async def get_user_profile(user_id: str):
     """Get comprehensive user profile"""
-    user = await db.users.find_one({"id": user_id})
+    user = await load_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -158,16 +215,14 @@ async def update_user(user_id: str, user_update: UserUpdate):
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
-    result = await db.users.update_one(
-        {"id": user_id},
-        {"$set": update_data}
-    )
-    
-    if result.modified_count == 0:
+    user = await load_user(db, user_id)
+    if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    updated_user = await db.users.find_one({"id": user_id})
-    return User(**updated_user)
+    # The identity map holds the updated document, which the response is built from
+    await apply_user_update(db, user_id, {"$set": update_data})
+    invalidate_user_summary(user_id)
+    return User(**user)
 
 # Social & Community Endpoints
 @social_router.get("/discover", tags=["Social"])
@@ -207,7 +262,10 @@ async def create_post(request: dict):
 @social_router.get("/feed", response_model=SocialFeed, tags=["Social"])
 async def get_social_feed(user_id: str, limit: int = 20, cursor: Optional[str] = None):
     """Get personalized social feed"""
-    feed = await social_service.get_social_feed(user_id, limit, cursor)
+    try:
+        feed = await social_service.get_social_feed(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return feed
 
 @social_router.post("/posts/{post_id}/like", tags=["Social"])
@@ -225,6 +283,15 @@ async def add_comment(post_id: str, request: dict):
     comment = await social_service.create_comment(user_id, post_id, content)
     return comment
 
+@social_router.get("/posts/{post_id}/comments", tags=["Social"])
+async def get_post_comments(post_id: str, limit: int = 20, cursor: Optional[str] = None):
+    """Get comments on a post"""
+    try:
+        page = await social_service.get_post_comments(post_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"comments": page.items, "has_more": page.has_more, "next_cursor": page.next_cursor}
+
 @social_router.post("/challenges", response_model=Challenge, tags=["Social"])
 async def create_challenge(request: dict):
     """Create a new community challenge"""
@@ -241,13 +308,26 @@ async def create_challenge(request: dict):
 async def join_challenge(challenge_id: str, request: dict):
     """Join a challenge"""
     user_id = request.get("user_id")
+    
+    if not user_id or await monetization_service.entitlements.get(user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    quota = await monetization_service.consume_feature(user_id, "challenge_participation")
+    if not quota["access"]:
+        raise HTTPException(status_code=429, detail=quota)
+    
     success = await social_service.join_challenge(user_id, challenge_id)
+    if not success:
+        await monetization_service.release_feature(user_id, "challenge_participation", quota["day"])
     return {"success": success}
 
 @social_router.get("/leaderboard", response_model=Leaderboard, tags=["Social"])
-async def get_leaderboard(category: str = "xp", period: str = "all_time", limit: int = 50):
+async def get_leaderboard(category: str = "xp", period: str = "all_time", limit: int = 50, cursor: Optional[str] = None, user_id: Optional[str] = None):
     """Get leaderboard"""
-    leaderboard = await social_service.get_leaderboard(category, period, limit)
+    try:
+        leaderboard = await social_service.get_leaderboard(category, period, limit, cursor, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return leaderboard
 
 # AI Intelligence Endpoints
@@ -259,23 +339,38 @@ async def advanced_ai_chat(request: dict):
     mode = PlatformMode(request.get("mode", "echoverse"))
     context = request.get("context")
     
-    response = await ai_service.generate_advanced_response(user_id, message, mode, context)
+    if not user_id or await monetization_service.entitlements.get(user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    quota = await monetization_service.consume_feature(user_id, "daily_ai_interactions")
+    if not quota["access"]:
+        raise HTTPException(status_code=429, detail=quota)
+    
+    try:
+        response = await ai_service.generate_advanced_response(user_id, message, mode, context)
+    except Exception:
+        # A failed chat does not count towards the daily quota
+        await monetization_service.release_feature(user_id, "daily_ai_interactions", quota["day"])
+        raise
     return response
 
 @ai_router.get("/personality/{user_id}", tags=["AI"])
 async def get_ai_personality(user_id: str, mode: PlatformMode):
     """Get AI personality state for user and mode"""
-    personality = await db.ai_personalities.find_one({"user_id": user_id, "mode": mode})
-    if not personality:
-        personality_obj = await ai_service.initialize_ai_personality(user_id, mode)
-        return personality_obj.dict()
-    return AIPersonality(**personality).dict()
+    personality = await ai_service.get_personality(user_id, mode)
+    return personality.dict()
 
 @ai_router.get("/memories/{user_id}", tags=["AI"])
-async def get_ai_memories(user_id: str, limit: int = 20):
-    """Get AI memories for user"""
-    memories = await db.ai_memories.find({"user_id": user_id}).sort("created_at", -1).limit(limit).to_list(limit)
-    return {"memories": memories}
+async def get_ai_memories(user_id: str, limit: int = 20, cursor: Optional[str] = None, q: Optional[str] = None):
+    """Get AI memories for user, newest first or, given a query, most relevant first"""
+    if q:
+        memories = await ai_service.recall_memories(user_id, q, limit)
+        return {"memories": memories, "has_more": False, "next_cursor": None}
+    try:
+        page = await ai_service.get_memories(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"memories": page.items, "has_more": page.has_more, "next_cursor": page.next_cursor}
 
 @ai_router.get("/insights/{user_id}", tags=["AI"])
 async def get_behavioral_insights(user_id: str):
@@ -296,6 +391,21 @@ async def cancel_subscription(user_id: str):
     success = await monetization_service.cancel_subscription(user_id)
     return {"success": success}
 
+@monetization_router.get("/access/{user_id}", tags=["Monetization"])
+async def check_feature_access_many(user_id: str, features: Optional[str] = None):
+    """Check access to several features at once; `features` is a comma-separated filter"""
+    access = await monetization_service.check_feature_access_many(user_id)
+    if access is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    if features:
+        requested = [feature.strip() for feature in features.split(",") if feature.strip()]
+        access = {
+            feature: access.get(feature, {"access": False, "reason": "Feature not defined"})
+            for feature in requested
+        }
+    return {"features": access}
+
 @monetization_router.get("/access/{user_id}/{feature}", tags=["Monetization"])
 async def check_feature_access(user_id: str, feature: str):
     """Check feature access for user"""
@@ -314,6 +424,15 @@ async def unlock_premium_feature(user_id: str, feature_id: str, payment_method:
     result = await monetization_service.unlock_premium_feature(user_id, feature_id, payment_method)
     return result
 
+@monetization_router.get("/transactions/{user_id}", tags=["Monetization"])
+async def get_transaction_history(user_id: str, limit: int = 50, cursor: Optional[str] = None):
+    """Get user's transaction history"""
+    try:
+        page = await monetization_service.get_user_transaction_history(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"transactions": page.items, "has_more": page.has_more, "next_cursor": page.next_cursor}
+
 @monetization_router.get("/analytics/revenue", tags=["Monetization"])
 async def get_revenue_analytics():
     """Get revenue analytics (admin only)"""
@@ -369,7 +488,7 @@ async def record_vr_interaction(user_id: str, space_id: str, interaction_type: s
 @analytics_router.get("/user/{user_id}", tags=["Analytics"])
 async def get_user_analytics(user_id: str):
     """Get comprehensive user analytics"""
-    analytics = await analytics_service.calculate_user_analytics(user_id)
+    analytics = await analytics_service.get_user_analytics(user_id)
     return analytics.dict()
 
 @analytics_router.get("/platform", tags=["Analytics"])
@@ -396,6 +515,18 @@ async def get_conversion_funnel():
     funnel = await analytics_service.track_conversion_funnel()
     return funnel
 
+@analytics_router.get("/funnel/cohorts", tags=["Analytics"])
+async def get_cohort_funnels(weeks: int = 8, mode: Optional[PlatformMode] = None):
+    """Get conversion funnels by signup week and mode"""
+    cohorts = await analytics_service.get_cohort_funnels(weeks, mode)
+    return {"cohorts": cohorts}
+
+@analytics_router.get("/funnel/history", tags=["Analytics"])
+async def get_funnel_history(days: int = 30):
+    """Get daily conversion funnel snapshots"""
+    snapshots = await analytics_service.get_funnel_history(days)
+    return {"snapshots": snapshots}
+
 @analytics_router.post("/sessions/track", tags=["Analytics"])
 async def track_user_session(user_id: str, session_data: Dict[str, Any]):
     """Track user session"""
@@ -413,10 +544,10 @@ async def end_user_session(session_id: str):
 async def switch_mode(user_id: str, mode: PlatformMode):
     """Switch between EchoVerse and EgoCore modes"""
     try:
-        await db.users.update_one(
-            {"id": user_id},
-            {"$set": {"current_mode": mode, "updated_at": datetime.utcnow()}}
-        )
+        # Deferred to the end of the request with the user's other writes
+        await load_user(db, user_id)
+        await apply_user_update(db, user_id, {"$set": {"current_mode": mode, "updated_at": datetime.utcnow()}})
+        invalidate_user_summary(user_id)
         
         # Track mode switch
         await analytics_service.track_user_session(user_id, {
@@ -431,14 +562,22 @@ async def switch_mode(user_id: str, mode: PlatformMode):
 @api_router.post("/journey/{user_id}/step", tags=["Identity Journey"])
 async def save_journey_step(user_id: str, step_data: IdentityResponse):
     """Save progress in identity journey"""
+    # New steps count against the tier's journey_steps allowance
+    user = await load_user(db, user_id)
+    if user and step_data.step.value not in (user.get("journey_progress") or {}):
+        access = await monetization_service.check_feature_access(user_id, "journey_steps")
+        if not access.get("access"):
+            raise HTTPException(status_code=429, detail=access)
+    
     try:
-        await db.users.update_one(
-            {"id": user_id},
-            {"$set": {f"journey_progress.{step_data.step}": step_data.dict()}}
-        )
+        # Written now: the identity index writer may re-read the user before the request ends
+        if user:
+            await apply_user_update(db, user_id, {"$set": {f"journey_progress.{step_data.step}": step_data.dict()}}, defer=False)
+            await identity_index.upsert(user_id)
         
         # Award XP for journey progress
         await social_service.award_experience(user_id, 50, f"journey_step_{step_data.step}")
+        await event_bus.publish("journey_step_saved", user_id=user_id, step=step_data.step)
         
         # Store as AI memory for personalization
         await ai_service.store_memory(
@@ -451,9 +590,52 @@ async def save_journey_step(user_id: str, step_data: IdentityResponse):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error saving journey step: {str(e)}")
 
+SHARED_JOURNEY_FILTER = {"profile_visibility": "public", "journey_sharing": {"$ne": False}}
+
+@api_router.get("/journey/{user_id}/similar", tags=["Identity Journey"])
+async def get_similar_journeys(user_id: str, limit: int = 10, credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+    """Find public users who share their journey and whose answers are most similar"""
+    # Anyone may look up a public, shared journey; otherwise only its owner
+    caller = authenticated_user_id(f"Bearer {credentials.credentials}") if credentials else None
+    if caller != user_id and not await db.users.find_one({"id": user_id, **SHARED_JOURNEY_FILTER}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Over-fetch so private matches can be dropped without shrinking the page
+    k = limit * 2
+    while True:
+        candidates = identity_index.similar(user_id, k)
+        shared = await db.users.find(
+            {"id": {"$in": [match_id for match_id, _ in candidates]}, **SHARED_JOURNEY_FILTER},
+            {"_id": 0, "id": 1}
+        ).to_list(None)
+        shared_ids = {user["id"] for user in shared}
+        matches = [(match_id, similarity) for match_id, similarity in candidates if match_id in shared_ids]
+        # Fewer candidates than asked for means there are no more similar users
+        if len(matches) >= limit or len(candidates) < k:
+            break
+        k *= 4
+    
+    matches = matches[:limit]
+    users = await load_user_summaries(db, [match_id for match_id, _ in matches])
+    return {
+        "matches": [
+            {"user": users[match_id].dict(), "similarity": round(similarity, 4)}
+            for match_id, similarity in matches
+            if match_id in users
+        ]
+    }
+
 @api_router.get("/journey/{user_id}/prompts", tags=["Identity Journey"])
 async def get_personalized_prompts(user_id: str, mode: PlatformMode):
     """Get AI-generated personalized prompts"""
+    if await monetization_service.entitlements.get(user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Generated by the chat model, so it draws on the same daily AI quota
+    quota = await monetization_service.consume_feature(user_id, "daily_ai_interactions")
+    if not quota["access"]:
+        raise HTTPException(status_code=429, detail=quota)
+    
     try:
         # Use advanced AI to generate contextual prompts
         response = await ai_service.generate_advanced_response(
@@ -467,19 +649,21 @@ async def get_personalized_prompts(user_id: str, mode: PlatformMode):
         
         return {"prompt": prompt, "mode": mode}
     except Exception as e:
+        await monetization_service.release_feature(user_id, "daily_ai_interactions", quota["day"])
         raise HTTPException(status_code=400, detail=f"Error generating prompts: {str(e)}")
 
 @api_router.post("/behavior/track", tags=["Analytics"])
 async def track_behavior(behavior: BehaviorEvent):
     """Track user behavior for AI learning and analytics"""
     try:
-        await db.behaviors.insert_one(behavior.dict())
+        await write_buffer.insert("behaviors", behavior.dict())
         
         # Store as AI memory
         await ai_service.store_memory(
             behavior.user_id,
             "behavior",
-            f"{behavior.event_type}: {json.dumps(behavior.event_data)}"
+            f"{behavior.event_type}: {json.dumps(behavior.event_data)}",
+            buffered=True
         )
         
         return {"message": "Behavior tracked"}
@@ -507,6 +691,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost middleware, so timings cover everything else
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
 
 # Configure logging
 logging.basicConfig(
@@ -517,6 +704,7 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await write_buffer.stop()
     client.close()
 
 # Background tasks for continuous improvement
@@ -524,28 +712,14 @@ async def continuous_ai_learning_task():
     """Background task for continuous AI learning across all users"""
     while True:
         try:
-            # Analyze patterns across all users for collective intelligence
-            all_users = await db.users.find({}).to_list(1000)
-            
-            for user in all_users:
-                user_id = user["id"]
-                
-                # Update AI personalities based on recent interactions
-                recent_memories = await db.ai_memories.find({
-                    "user_id": user_id,
-                    "created_at": {"$gte": datetime.utcnow() - timedelta(hours=24)}
-                }).to_list(100)
-                
-                if recent_memories:
-                    # Evolve AI personality based on recent interactions
-                    for mode in [PlatformMode.ECHOVERSE, PlatformMode.EGOCORE]:
-                        await ai_service.evolve_personality(user_id, mode, {
-                            "quality_score": 0.7,  # Default quality
-                            "trust_factor": 0.6,
-                            "preferred_traits": {}
-                        })
+            # Evolve AI personalities of every user with interactions in the last 24h
+            processed = await ai_service.run_personality_evolution(feedback={
+                "quality_score": 0.7,  # Default quality
+                "trust_factor": 0.6,
+                "preferred_traits": {}
+            })
             
-            logger.info(f"Processed AI learning for {len(all_users)} users")
+            logger.info(f"Processed AI learning for {processed} users")
             await asyncio.sleep(3600)  # Run every hour
             
         except Exception as e:
@@ -553,28 +727,108 @@ async def continuous_ai_learning_task():
             await asyncio.sleep(3600)
 
 async def analytics_calculation_task():
-    """Background task for analytics calculation"""
+    """Background task reconciling incrementally maintained analytics"""
     while True:
         try:
-            # Update analytics for all active users
-            active_users = await db.users.find({
-                "last_active": {"$gte": datetime.utcnow() - timedelta(days=7)}
-            }).to_list(1000)
-            
-            for user in active_users:
-                await analytics_service.calculate_user_analytics(user["id"])
+            # Only users whose running aggregates changed since the last pass
+            reconciled = await analytics_service.reconcile_dirty_analytics()
             
-            logger.info(f"Updated analytics for {len(active_users)} active users")
+            logger.info(f"Reconciled analytics for {reconciled} users")
             await asyncio.sleep(1800)  # Run every 30 minutes
             
         except Exception as e:
             logger.error(f"Error in analytics calculation: {e}")
             await asyncio.sleep(1800)
 
+async def funnel_snapshot_task():
+    """Background task storing the daily conversion funnel snapshot"""
+    while True:
+        try:
+            snapshot = await analytics_service.snapshot_conversion_funnel()
+            
+            logger.info(f"Stored conversion funnel snapshot for {snapshot['date']}")
+            await asyncio.sleep(86400)  # Run daily
+            
+        except Exception as e:
+            logger.error(f"Error in funnel snapshot: {e}")
+            await asyncio.sleep(3600)
+
+async def leaderboard_refresh_task():
+    """Background task rebuilding the in-memory leaderboard snapshots"""
+    while True:
+        try:
+            await social_service.leaderboards.refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing leaderboards: {e}")
+        
+        await asyncio.sleep(social_service.leaderboards.refresh_interval)
+
+async def vr_rollup_task():
+    """Background task rolling raw VR interactions up into lifetime daily stats before they expire"""
+    while True:
+        try:
+            rolled = await xr_service.rollup_vr_interactions()
+            logger.info(f"Rolled up {rolled} user-days of VR interactions")
+        except Exception as e:
+            logger.error(f"Error rolling up VR interactions: {e}")
+        
+        await asyncio.sleep(3600)
+
+async def discovery_refresh_task():
+    """Background task rebuilding the friend-of-friend discovery graph"""
+    while True:
+        try:
+            await social_service.discovery.rebuild()
+        except Exception as e:
+            logger.error(f"Error rebuilding discovery graph: {e}")
+        
+        await asyncio.sleep(social_service.discovery.refresh_interval)
+
+async def memory_compaction_task():
+    """Background task rolling old, low-value AI memories into summaries"""
+    while True:
+        try:
+            await ai_service.compactor.run()
+        except Exception as e:
+            logger.error(f"Error compacting memories: {e}")
+        
+        await asyncio.sleep(ai_service.compactor.interval)
+
+async def post_engagement_migration_task():
+    """One-off background task moving legacy post likes/comments arrays to counters"""
+    try:
+        migrated = await social_service.migrate_post_engagement()
+        if migrated:
+            logger.info(f"Migrated engagement data of {migrated} posts")
+    except Exception as e:
+        logger.error(f"Error migrating post engagement: {e}")
+
+async def memory_features_backfill_task():
+    """One-off background task extracting features of memories stored without them"""
+    try:
+        backfilled = await ai_service.backfill_memory_features()
+        if backfilled:
+            logger.info(f"Backfilled features of {backfilled} memories")
+    except Exception as e:
+        logger.error(f"Error backfilling memory features: {e}")
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize background tasks"""
+    failures = await index_registry.apply(db)
+    drift = await index_registry.drift(db)
+    if failures or drift:
+        logger.warning(f"Index drift detected: {json.dumps(drift, default=str)}")
+    write_buffer.start()
     asyncio.create_task(continuous_ai_learning_task())
     asyncio.create_task(analytics_calculation_task())
+    asyncio.create_task(funnel_snapshot_task())
+    asyncio.create_task(leaderboard_refresh_task())
+    asyncio.create_task(discovery_refresh_task())
+    asyncio.create_task(vr_rollup_task())
+    asyncio.create_task(identity_index.run())
+    asyncio.create_task(post_engagement_migration_task())
+    asyncio.create_task(memory_features_backfill_task())
+    asyncio.create_task(memory_compaction_task())
     logger.info("🚀 EchoVerse & EgoCore Production Singularity Platform Started!")
     logger.info("✨ Features: Advanced AI, Social Community, Monetization, XR, Enterprise Analytics")
@@ -1,29 +1,62 @@
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import random
 from models import *
+from unit_of_work import load_user, load_users, apply_user_update, mirror_user_update
+from events import event_bus
+from timelines import TimelineStore
+from user_summaries import load_user_summaries, invalidate_user_summary
+from pagination import Page, paginate, encode_cursor, decode_cursor
+from leaderboard import LeaderboardService
+from discovery import DiscoveryEngine
+from identity_index import IdentityIndex
+from write_buffer import WriteBehindBuffer
+
+# Server-side equivalent of SocialService.calculate_level for pipeline updates
+LEVEL_EXPRESSION = {
+    "$add": [{"$toInt": {"$floor": {"$sqrt": {"$divide": ["$experience_points", 100]}}}}, 1]
+}
 
 class SocialService:
-    def __init__(self, db: AsyncIOMotorDatabase):
+    # (collection, keys, options) declarations applied at startup by the index registry
+    indexes = [
+        ("users", [("id", 1)], {"unique": True}),
+        ("users", [("profile_visibility", 1)], {}),
+        ("connections", [("id", 1)], {"unique": True}),
+        ("connections", [("requester_id", 1), ("target_id", 1)], {"unique": True}),
+        ("connections", [("target_id", 1), ("requester_id", 1)], {}),
+        ("posts", [("id", 1)], {"unique": True}),
+        ("posts", [("user_id", 1), ("created_at", -1), ("id", -1)], {}),
+        ("post_likes", [("post_id", 1), ("user_id", 1)], {"unique": True}),
+        ("comments", [("id", 1)], {"unique": True}),
+        ("comments", [("user_id", 1)], {}),
+        ("comments", [("post_id", 1), ("created_at", 1), ("id", 1)], {}),
+        ("challenges", [("id", 1)], {"unique": True}),
+        ("challenges", [("participants", 1), ("start_date", 1)], {}),
+        ("challenges", [("completed_by", 1)], {})
+    ]
+    
+    def __init__(self, db: AsyncIOMotorDatabase, write_buffer: Optional[WriteBehindBuffer] = None, identity_index: Optional[IdentityIndex] = None):
         self.db = db
+        self.write_buffer = write_buffer or WriteBehindBuffer(db)
+        self.timelines = TimelineStore(db)
+        self.leaderboards = LeaderboardService(db)
+        self.discovery = DiscoveryEngine(db, identity_index)
     
-    async def discover_users(self, user_id: str, limit: int = 20) -> List[User]:
+    async def discover_users(self, user_id: str, limit: int = 20) -> List[UserSummary]:
         """Discover new users to connect with"""
-        # Exclude current user and existing connections
-        user = await self.db.users.find_one({"id": user_id})
+        user = await load_user(self.db, user_id)
         if not user:
             return []
         
-        exclude_ids = [user_id] + user.get("connections", []) + user.get("following", [])
+        # Ranked by mutual connections, journey similarity and mode
+        suggested_ids = await self.discovery.suggest(user, limit)
+        users = await load_user_summaries(self.db, suggested_ids)
         
-        # Find users with similar interests or complementary journey progress
-        users = await self.db.users.find({
-            "id": {"$nin": exclude_ids},
-            "profile_visibility": "public"
-        }).limit(limit).to_list(limit)
-        
-        return [User(**user) for user in users]
+        return [users[suggested_id] for suggested_id in suggested_ids if suggested_id in users]
     
     async def send_connection_request(self, requester_id: str, target_id: str, message: Optional[str] = None) -> Connection:
         """Send a connection request"""
@@ -64,14 +97,19 @@ class SocialService:
             }
         )
         
-        # Add to both users' connection lists
-        await self.db.users.update_one(
-            {"id": connection["requester_id"]},
-            {"$addToSet": {"connections": connection["target_id"]}}
-        )
-        await self.db.users.update_one(
-            {"id": connection["target_id"]},
-            {"$addToSet": {"connections": connection["requester_id"]}}
+        # Add to both users' connection lists, coalesced with the request's other user writes
+        await load_users(self.db, [connection["requester_id"], connection["target_id"]])
+        await apply_user_update(self.db, connection["requester_id"], {"$addToSet": {"connections": connection["target_id"]}})
+        await apply_user_update(self.db, connection["target_id"], {"$addToSet": {"connections": connection["requester_id"]}})
+        
+        # Bring each side's recent posts into the other's timeline
+        await self.timelines.backfill(connection["requester_id"], [connection["target_id"]])
+        await self.timelines.backfill(connection["target_id"], [connection["requester_id"]])
+        
+        await event_bus.publish(
+            "connection_accepted",
+            requester_id=connection["requester_id"],
+            target_id=connection["target_id"]
         )
         
         return True
@@ -87,51 +125,52 @@ class SocialService:
         
         await self.db.posts.insert_one(post.dict())
         
+        author = await load_user(self.db, user_id)
+        if author:
+            await self.timelines.fan_out(author, post.dict())
+        
         # Award XP for posting
         await self.award_experience(user_id, 10, "post_created")
         
+        await event_bus.publish("post_created", user_id=user_id, post_id=post.id)
+        
         return post
     
     async def get_social_feed(self, user_id: str, limit: int = 20, cursor: Optional[str] = None) -> SocialFeed:
         """Get personalized social feed"""
-        user = await self.db.users.find_one({"id": user_id})
+        user = await load_user(self.db, user_id)
         if not user:
             return SocialFeed(posts=[], users={}, has_more=False)
         
-        # Get posts from connections and followed users
-        relevant_user_ids = user.get("connections", []) + user.get("following", []) + [user_id]
-        
-        query = {
-            "user_id": {"$in": relevant_user_ids},
-            "visibility": {"$in": ["public", "friends"]}
-        }
-        
-        if cursor:
-            query["created_at"] = {"$lt": datetime.fromisoformat(cursor)}
-        
-        posts = await self.db.posts.find(query).sort("created_at", -1).limit(limit + 1).to_list(limit + 1)
-        
-        has_more = len(posts) > limit
-        if has_more:
-            posts = posts[:limit]
+        # Single range read over the precomputed timeline
+        await self.timelines.ensure_built(user)
+        after = decode_cursor(cursor, datetime, str) if cursor else None
+        posts, has_more = await self.timelines.read(user, limit, after)
         
         # Get user data for posts
-        user_ids = list(set([post["user_id"] for post in posts]))
-        users_data = await self.db.users.find({"id": {"$in": user_ids}}).to_list(len(user_ids))
-        users = {user["id"]: User(**user) for user in users_data}
+        users = await load_user_summaries(self.db, [post["user_id"] for post in posts])
+        
+        # One batched lookup answers liked-by-me for the whole page
+        liked = set()
+        if posts:
+            likes = await self.db.post_likes.find(
+                {"post_id": {"$in": [post["id"] for post in posts]}, "user_id": user_id},
+                {"_id": 0, "post_id": 1}
+            ).to_list(len(posts))
+            liked = {like["post_id"] for like in likes}
         
         # Enhance posts with engagement data
         enhanced_posts = []
         for post in posts:
             post_data = {
                 **post,
-                "like_count": len(post.get("likes", [])),
-                "comment_count": len(post.get("comments", [])),
-                "user_liked": user_id in post.get("likes", [])
+                "like_count": post.get("like_count", 0),
+                "comment_count": post.get("comment_count", 0),
+                "user_liked": post["id"] in liked
             }
             enhanced_posts.append(post_data)
         
-        next_cursor = posts[-1]["created_at"].isoformat() if posts and has_more else None
+        next_cursor = encode_cursor(posts[-1]["created_at"], posts[-1]["id"]) if posts and has_more else None
         
         return SocialFeed(
             posts=enhanced_posts,
@@ -142,30 +181,33 @@ class SocialService:
     
     async def like_post(self, user_id: str, post_id: str) -> bool:
         """Like or unlike a post"""
-        post = await self.db.posts.find_one({"id": post_id})
+        try:
+            await self.db.post_likes.insert_one({
+                "post_id": post_id,
+                "user_id": user_id,
+                "created_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            # Already liked: unlike
+            result = await self.db.post_likes.delete_one({"post_id": post_id, "user_id": user_id})
+            if result.deleted_count:
+                await self.db.posts.update_one({"id": post_id}, {"$inc": {"like_count": -1}})
+            return False
+        
+        # Like
+        post = await self.db.posts.find_one_and_update(
+            {"id": post_id},
+            {"$inc": {"like_count": 1}},
+            projection={"_id": 0, "user_id": 1}
+        )
         if not post:
+            await self.db.post_likes.delete_one({"post_id": post_id, "user_id": user_id})
             return False
         
-        likes = post.get("likes", [])
+        # Award XP to post owner
+        await self.award_experience(post["user_id"], 5, "post_liked")
         
-        if user_id in likes:
-            # Unlike
-            await self.db.posts.update_one(
-                {"id": post_id},
-                {"$pull": {"likes": user_id}}
-            )
-            return False
-        else:
-            # Like
-            await self.db.posts.update_one(
-                {"id": post_id},
-                {"$addToSet": {"likes": user_id}}
-            )
-            
-            # Award XP to post owner
-            await self.award_experience(post["user_id"], 5, "post_liked")
-            
-            return True
+        return True
     
     async def create_comment(self, user_id: str, post_id: str, content: str) -> Comment:
         """Add a comment to a post"""
@@ -177,17 +219,68 @@ class SocialService:
         
         await self.db.comments.insert_one(comment.dict())
         
-        # Add comment ID to post
         await self.db.posts.update_one(
             {"id": post_id},
-            {"$addToSet": {"comments": comment.id}}
+            {"$inc": {"comment_count": 1}}
         )
         
         # Award XP
         await self.award_experience(user_id, 15, "comment_created")
         
+        await event_bus.publish("comment_created", user_id=user_id, post_id=post_id, comment_id=comment.id)
+        
         return comment
     
+    async def get_post_comments(self, post_id: str, limit: int = 20, cursor: Optional[str] = None) -> Page:
+        """Get a post's comments, oldest first"""
+        return await paginate(
+            self.db.comments,
+            {"post_id": post_id},
+            [("created_at", 1), ("id", 1)],
+            (datetime, str),
+            limit,
+            cursor,
+            projection={"_id": 0}
+        )
+    
+    async def migrate_post_engagement(self, batch_size: int = 500) -> int:
+        """Move legacy likes/comments id arrays on posts to post_likes and counters"""
+        migrated = 0
+        while True:
+            posts = await self.db.posts.find(
+                {"$or": [{"likes": {"$exists": True}}, {"comments": {"$exists": True}}]},
+                {"_id": 0, "id": 1, "likes": 1, "comments": 1}
+            ).limit(batch_size).to_list(batch_size)
+            if not posts:
+                return migrated
+            
+            likes = [
+                UpdateOne(
+                    {"post_id": post["id"], "user_id": liker_id},
+                    {"$setOnInsert": {"created_at": datetime.utcnow()}},
+                    upsert=True
+                )
+                for post in posts
+                for liker_id in post.get("likes", [])
+            ]
+            if likes:
+                await self.db.post_likes.bulk_write(likes, ordered=False)
+            
+            await self.db.posts.bulk_write([
+                UpdateOne(
+                    {"id": post["id"]},
+                    {
+                        "$set": {
+                            "like_count": len(set(post.get("likes", []))),
+                            "comment_count": len(set(post.get("comments", [])))
+                        },
+                        "$unset": {"likes": "", "comments": ""}
+                    }
+                )
+                for post in posts
+            ], ordered=False)
+            migrated += len(posts)
+    
     async def create_challenge(self, creator_id: str, title: str, description: str, category: str, difficulty: str) -> Challenge:
         """Create a new community challenge"""
         reward_multiplier = {"easy": 1, "medium": 2, "hard": 3, "extreme": 5}
@@ -217,6 +310,9 @@ class SocialService:
             {"$addToSet": {"participants": user_id}}
         )
         
+        if result.modified_count > 0:
+            await event_bus.publish("challenge_joined", user_id=user_id, challenge_id=challenge_id)
+        
         return result.modified_count > 0
     
     async def complete_challenge(self, user_id: str, challenge_id: str, evidence: Dict[str, Any] = None) -> bool:
@@ -237,81 +333,79 @@ class SocialService:
         
         return True
     
-    async def get_leaderboard(self, category: str = "xp", period: str = "all_time", limit: int = 50) -> Leaderboard:
-        """Get leaderboard for different categories"""
-        
-        if category == "xp":
-            sort_field = "experience_points"
-        elif category == "level":
-            sort_field = "level"
-        elif category == "streak":
-            sort_field = "streak_days"
-        else:
-            sort_field = "experience_points"
-        
-        # For time periods, we'd need to aggregate data from analytics
-        users = await self.db.users.find({
-            "profile_visibility": "public"
-        }).sort(sort_field, -1).limit(limit).to_list(limit)
-        
-        entries = []
-        for rank, user in enumerate(users, 1):
-            entries.append({
-                "rank": rank,
-                "user_id": user["id"],
-                "username": user["username"],
-                "display_name": user.get("display_name"),
-                "avatar_url": user.get("avatar_url"),
-                "score": user.get(sort_field, 0),
-                "level": user.get("level", 1)
-            })
-        
-        return Leaderboard(
-            category=category,
-            period=period,
-            entries=entries
-        )
+    async def get_leaderboard(self, category: str = "xp", period: str = "all_time", limit: int = 50, cursor: Optional[str] = None, user_id: Optional[str] = None) -> Leaderboard:
+        """Get leaderboard"""
+        return await self.leaderboards.get_leaderboard(category, period, limit, cursor, user_id)
     
     async def award_experience(self, user_id: str, amount: int, reason: str) -> bool:
-        """Award experience points to a user"""
-        user = await self.db.users.find_one({"id": user_id})
-        if not user:
+        """Award experience points to a user in one atomic round trip"""
+        before = await self.increment_experience(user_id, amount, reason)
+        if before is None:
             return False
         
-        new_xp = user.get("experience_points", 0) + amount
-        new_level = self.calculate_level(new_xp)
-        
-        await self.db.users.update_one(
-            {"id": user_id},
-            {"$set": {"experience_points": new_xp, "level": new_level}}
+        await self.check_level_up(user_id, before, amount)
+        return True
+    
+    async def increment_experience(self, user_id: str, amount: int, reason: str, achievement_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Add XP, and optionally a not-yet-unlocked achievement, recomputing the level server-side.
+        
+        Returns the pre-image, or None when the user does not exist or already has the achievement.
+        """
+        query = {"id": user_id}
+        changes = {"experience_points": {"$add": [{"$ifNull": ["$experience_points", 0]}, amount]}}
+        if achievement_id:
+            query["achievements"] = {"$ne": achievement_id}
+            changes["achievements"] = {"$concatArrays": [{"$ifNull": ["$achievements", []]}, [achievement_id]]}
+        
+        before = await self.db.users.find_one_and_update(
+            query,
+            [{"$set": changes}, {"$set": {"level": LEVEL_EXPRESSION}}],
+            projection={"_id": 0, "experience_points": 1, "level": 1},
+            return_document=ReturnDocument.BEFORE
         )
+        if before is None:
+            return None
         
-        # Check for level up achievements
-        if new_level > user.get("level", 1):
-            await self.unlock_achievement(user_id, f"level_{new_level}")
+        new_xp = before.get("experience_points", 0) + amount
+        new_level = self.calculate_level(new_xp)
+        if new_level != before.get("level", 1):
+            invalidate_user_summary(user_id)
+        
+        mirrored = {"$set": {"experience_points": new_xp, "level": new_level}}
+        if achievement_id:
+            mirrored["$addToSet"] = {"achievements": achievement_id}
+        mirror_user_update(user_id, mirrored)
+        
+        # XP log feeding the period leaderboards
+        await self.write_buffer.insert("xp_events", {
+            "user_id": user_id,
+            "amount": amount,
+            "reason": reason,
+            "created_at": datetime.utcnow()
+        })
         
-        return True
+        return before
+    
+    async def check_level_up(self, user_id: str, before: Dict[str, Any], amount: int):
+        """Unlock the achievement of every level an XP award crossed"""
+        new_level = self.calculate_level(before.get("experience_points", 0) + amount)
+        for level in range(before.get("level", 1) + 1, new_level + 1):
+            await self.unlock_achievement(user_id, f"level_{level}")
     
     async def award_credits(self, user_id: str, amount: int) -> bool:
         """Award credits to a user"""
-        await self.db.users.update_one(
-            {"id": user_id},
-            {"$inc": {"credits": amount}}
-        )
+        await apply_user_update(self.db, user_id, {"$inc": {"credits": amount}})
         return True
     
     async def unlock_achievement(self, user_id: str, achievement_id: str) -> bool:
         """Unlock an achievement for a user"""
-        result = await self.db.users.update_one(
-            {"id": user_id},
-            {"$addToSet": {"achievements": achievement_id}}
-        )
-        
-        # Award bonus XP for achievements
-        if result.modified_count > 0:
-            await self.award_experience(user_id, 100, f"achievement_{achievement_id}")
+        # Award bonus XP for achievements, atomically with the unlock
+        before = await self.increment_experience(user_id, 100, f"achievement_{achievement_id}", achievement_id)
+        if before is None:
+            return False
         
-        return result.modified_count > 0
+        await self.check_level_up(user_id, before, 100)
+        return True
     
     @staticmethod
     def calculate_level(xp: int) -> int:
@@ -320,7 +414,7 @@ class SocialService:
     
     async def get_user_stats(self, user_id: str) -> Dict[str, Any]:
         """Get comprehensive user statistics"""
-        user = await self.db.users.find_one({"id": user_id})
+        user = await load_user(self.db, user_id)
         if not user:
             return {}
         
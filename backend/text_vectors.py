@@ -0,0 +1,53 @@
+import re
+import zlib
+from typing import Any, Iterable, List
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def text_leaves(value: Any) -> Iterable[str]:
+    """Every string inside nested dicts and lists"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from text_leaves(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from text_leaves(item)
+
+class HashingVectorizer:
+    """Fixed-length bag-of-words vectors via the hashing trick; no vocabulary, no network.
+
+    Unigrams and bigrams are hashed with CRC32, which, unlike hash(), is stable
+    across processes, so persisted vectors stay comparable after a restart. A
+    second hash bit picks the sign to cancel collisions out on average. Term
+    frequencies are dampened with log(1 + tf) and vectors are L2-normalized, so
+    a dot product is a cosine similarity.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    def features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def transform(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self.features(text):
+            digest = zlib.crc32(feature.encode())
+            vector[digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+
+        # Sublinear tf, keeping each bucket's sign
+        vector = np.sign(vector) * np.log1p(np.abs(vector))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def transform_many(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.vstack([self.transform(text) for text in texts])
@@ -0,0 +1,174 @@
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError
+from cache import LRUCache
+from pagination import keyset_filter
+from unit_of_work import apply_user_update
+
+# Post visibilities that show up in other users' feeds
+FEED_VISIBILITIES = ["public", "friends"]
+
+# Newest first, ties broken by id so cursors never skip or repeat a post
+TIMELINE_SORT = [("created_at", -1), ("post_id", -1)]
+POST_SORT = [("created_at", -1), ("id", -1)]
+
+class TimelineStore:
+    """Hybrid fan-out timelines for the social feed.
+
+    New posts are pushed into one `timelines` entry per audience member, so a
+    feed page is a single indexed range read. Authors whose audience exceeds
+    `fanout_limit` are flagged fan-out-on-read instead, and their recent posts
+    are merged into readers' pages at read time.
+
+    Entries expire `retention` after they were pushed, so a timeline only
+    reaches back that far; once a page runs past its oldest entry, the feed
+    continues straight from the posts collection.
+    """
+
+    indexes = [
+        ("timelines", [("owner_id", 1), ("created_at", -1), ("post_id", -1)], {}),
+        ("timelines", [("owner_id", 1), ("post_id", 1)], {"unique": True}),
+        ("timelines", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+        ("users", [("timeline_fanout_on_read", 1)], {"partialFilterExpression": {"timeline_fanout_on_read": True}})
+    ]
+
+    def __init__(self, db: AsyncIOMotorDatabase, fanout_limit: Optional[int] = None, retention_days: Optional[int] = None, backfill_limit: int = 200):
+        self.db = db
+        self.fanout_limit = fanout_limit or int(os.environ.get("TIMELINE_FANOUT_LIMIT", "5000"))
+        self.retention = timedelta(days=retention_days or int(os.environ.get("TIMELINE_RETENTION_DAYS", "60")))
+        self.backfill_limit = backfill_limit
+        self.pull_authors_cache = LRUCache(maxsize=1, ttl=60)
+
+    @staticmethod
+    def audience(author: Dict[str, Any]) -> Set[str]:
+        """Users whose feed shows this author's posts"""
+        return set(author.get("connections", [])) | set(author.get("followers", []))
+
+    @staticmethod
+    def sources(reader: Dict[str, Any]) -> Set[str]:
+        """Authors whose posts show up in this reader's feed"""
+        return set(reader.get("connections", [])) | set(reader.get("following", []))
+
+    async def fan_out(self, author: Dict[str, Any], post: Dict[str, Any]):
+        """Push a new post into its author's timeline and, for regular authors, its audience's"""
+        if post.get("visibility") not in FEED_VISIBILITIES:
+            return
+
+        owner_ids = {author["id"]}
+        audience = self.audience(author)
+        if len(audience) > self.fanout_limit:
+            if not author.get("timeline_fanout_on_read"):
+                await self.mark_fanout_on_read(author["id"])
+        else:
+            owner_ids |= audience
+
+        await self.push(owner_ids, [post])
+
+    async def push(self, owner_ids: Iterable[str], posts: List[Dict[str, Any]]):
+        """Insert timeline entries, ignoring ones that already exist"""
+        expires_at = datetime.utcnow() + self.retention
+        entries = [
+            {
+                "owner_id": owner_id,
+                "post_id": post["id"],
+                "author_id": post["user_id"],
+                "created_at": post["created_at"],
+                "expires_at": expires_at
+            }
+            for owner_id in owner_ids
+            for post in posts
+        ]
+        if not entries:
+            return
+
+        try:
+            await self.db.timelines.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    async def mark_fanout_on_read(self, author_id: str):
+        await apply_user_update(self.db, author_id, {"$set": {"timeline_fanout_on_read": True}}, defer=False)
+        self.pull_authors_cache.clear()
+
+    async def pull_authors(self) -> Set[str]:
+        """Ids of all fan-out-on-read authors; a small set, cached briefly"""
+        authors = self.pull_authors_cache.get("authors")
+        if authors is None:
+            users = await self.db.users.find({"timeline_fanout_on_read": True}, {"_id": 0, "id": 1}).to_list(None)
+            authors = {user["id"] for user in users}
+            self.pull_authors_cache.set("authors", authors)
+        return authors
+
+    async def backfill(self, owner_id: str, author_ids: Iterable[str]):
+        """Copy recent posts of newly followed or connected authors into a timeline"""
+        author_ids = set(author_ids) - (await self.pull_authors() - {owner_id})
+        if not author_ids:
+            return
+
+        posts = await self.db.posts.find(
+            {
+                "user_id": {"$in": list(author_ids)},
+                "visibility": {"$in": FEED_VISIBILITIES},
+                "created_at": {"$gte": datetime.utcnow() - self.retention}
+            },
+            {"_id": 0, "id": 1, "user_id": 1, "created_at": 1}
+        ).sort("created_at", -1).limit(self.backfill_limit).to_list(self.backfill_limit)
+
+        await self.push([owner_id], posts)
+
+    async def ensure_built(self, reader: Dict[str, Any]):
+        """Build the timeline once for users whose history predates fan-out on write"""
+        if reader.get("timeline_built_at"):
+            return
+
+        await self.backfill(reader["id"], self.sources(reader) | {reader["id"]})
+        await apply_user_update(self.db, reader["id"], {"$set": {"timeline_built_at": datetime.utcnow()}}, defer=False)
+
+    async def read(self, reader: Dict[str, Any], limit: int, after: Optional[Tuple[datetime, str]] = None) -> Tuple[List[Dict[str, Any]], bool]:
+        """Return up to `limit` feed posts newest first, resuming after a (created_at, id) key"""
+        query = {"owner_id": reader["id"]}
+        if after:
+            query = {"$and": [query, keyset_filter(TIMELINE_SORT, after)]}
+
+        entries = await self.db.timelines.find(
+            query, {"_id": 0, "post_id": 1, "created_at": 1}
+        ).sort(TIMELINE_SORT).limit(limit + 1).to_list(limit + 1)
+        candidates = {(entry["created_at"], entry["post_id"]) for entry in entries}
+
+        # Merge in posts from followed fan-out-on-read authors
+        pull_sources = self.sources(reader) & (await self.pull_authors() - {reader["id"]})
+        if pull_sources:
+            candidates |= await self.read_posts({"user_id": {"$in": list(pull_sources)}}, limit, after)
+
+        # Past the oldest timeline entry, older posts come from the posts collection
+        if len(entries) <= limit:
+            candidates |= await self.read_posts({
+                "user_id": {"$in": list(self.sources(reader) | {reader["id"]})},
+                "created_at": {"$lt": datetime.utcnow() - self.retention}
+            }, limit, after)
+
+        ordered = [post_id for _, post_id in sorted(candidates, reverse=True)[:limit + 1]]
+        if not ordered:
+            return [], False
+
+        # Legacy posts may still carry likes/comments id arrays; never ship them
+        posts = await self.db.posts.find(
+            {"id": {"$in": ordered}}, {"_id": 0, "likes": 0, "comments": 0}
+        ).to_list(len(ordered))
+        by_id = {post["id"]: post for post in posts}
+        page = [by_id[post_id] for post_id in ordered if post_id in by_id]
+
+        return page[:limit], len(ordered) > limit
+
+    async def read_posts(self, query: Dict[str, Any], limit: int, after: Optional[Tuple[datetime, str]]) -> Set[Tuple[datetime, str]]:
+        """(created_at, id) keys of up to limit + 1 feed-visible posts matching `query`, resuming after a key"""
+        query = {**query, "visibility": {"$in": FEED_VISIBILITIES}}
+        if after:
+            query = {"$and": [query, keyset_filter(POST_SORT, after)]}
+        posts = await self.db.posts.find(
+            query, {"_id": 0, "id": 1, "created_at": 1}
+        ).sort(POST_SORT).limit(limit + 1).to_list(limit + 1)
+        return {(post["created_at"], post["id"]) for post in posts}
@@ -0,0 +1,168 @@
+import contextvars
+from copy import deepcopy
+from typing import Any, Dict, Iterable, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+class UserUnitOfWork:
+    """Request-scoped identity map and deferred writes for user documents.
+
+    Every user is read at most once per request. Deferred updates are applied to
+    the cached document immediately, so later reads in the same request see them,
+    and are sent to Mongo as one update per user when the request commits.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.users: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.pending: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    async def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        if user_id not in self.users:
+            self.users[user_id] = await self.db.users.find_one({"id": user_id})
+        return self.users[user_id]
+
+    async def get_many(self, user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        missing = [user_id for user_id in set(user_ids) if user_id not in self.users]
+        if missing:
+            found = await self.db.users.find({"id": {"$in": missing}}).to_list(len(missing))
+            for user in found:
+                self.users[user["id"]] = user
+            for user_id in missing:
+                self.users.setdefault(user_id, None)
+
+        return {user_id: self.users[user_id] for user_id in user_ids if self.users.get(user_id)}
+
+    def is_loaded(self, user_id: str) -> bool:
+        return self.users.get(user_id) is not None
+
+    def apply(self, user_id: str, update: Dict[str, Dict[str, Any]]) -> bool:
+        """Apply an update to the cached document; returns whether it changed anything"""
+        user = self.users.get(user_id)
+        if user is None:
+            return False
+        return apply_update(user, update)
+
+    def defer(self, user_id: str, update: Dict[str, Dict[str, Any]]) -> bool:
+        """Queue an update for a loaded user for commit and apply it locally"""
+        changed = self.apply(user_id, update)
+
+        pending = self.pending.setdefault(user_id, {})
+        for operator, fields in update.items():
+            for field, value in fields.items():
+                self._merge(user_id, pending, operator, field, value)
+
+        return changed
+
+    def _merge(self, user_id: str, pending: Dict[str, Dict[str, Any]], operator: str, field: str, value: Any):
+        other_operators = [op for op, fields in pending.items() if op != operator and field in fields]
+        user = self.users.get(user_id)
+
+        if other_operators and user is not None:
+            # Mongo rejects two operators on one path; fall back to the merged local value
+            for op in other_operators:
+                del pending[op][field]
+            pending.setdefault("$set", {})[field] = deepcopy(get_path(user, field))
+            return
+
+        target = pending.setdefault(operator, {})
+        if operator == "$inc":
+            target[field] = target.get(field, 0) + value
+        elif operator == "$addToSet":
+            values = target.setdefault(field, {"$each": []})["$each"]
+            for item in value["$each"] if isinstance(value, dict) and "$each" in value else [value]:
+                if item not in values:
+                    values.append(item)
+        else:
+            target[field] = value
+
+    async def commit(self):
+        operations = []
+        for user_id, update in self.pending.items():
+            update = {operator: fields for operator, fields in update.items() if fields}
+            if update:
+                operations.append(UpdateOne({"id": user_id}, update))
+
+        self.pending.clear()
+        if operations:
+            await self.db.users.bulk_write(operations, ordered=False)
+
+def get_path(document: Dict[str, Any], path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+def apply_update(document: Dict[str, Any], update: Dict[str, Dict[str, Any]]) -> bool:
+    """Apply the subset of Mongo update operators the services use to a local document"""
+    changed = False
+
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            *parents, leaf = path.split(".")
+            target = document
+            for part in parents:
+                target = target.setdefault(part, {})
+
+            if operator == "$set":
+                changed = changed or target.get(leaf) != value
+                target[leaf] = value
+            elif operator == "$unset":
+                changed = changed or leaf in target
+                target.pop(leaf, None)
+            elif operator == "$inc":
+                changed = changed or value != 0
+                target[leaf] = target.get(leaf, 0) + value
+            elif operator == "$addToSet":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                current = target.setdefault(leaf, [])
+                for item in items:
+                    if item not in current:
+                        current.append(item)
+                        changed = True
+            elif operator == "$pull":
+                current = target.get(leaf, [])
+                if value in current:
+                    target[leaf] = [item for item in current if item != value]
+                    changed = True
+
+    return changed
+
+current_unit_of_work: contextvars.ContextVar[Optional[UserUnitOfWork]] = contextvars.ContextVar("current_unit_of_work", default=None)
+
+async def load_user(db: AsyncIOMotorDatabase, user_id: str) -> Optional[Dict[str, Any]]:
+    """Read a user document, through the request's identity map when there is one"""
+    unit_of_work = current_unit_of_work.get()
+    if unit_of_work is not None:
+        return await unit_of_work.get(user_id)
+    return await db.users.find_one({"id": user_id})
+
+async def load_users(db: AsyncIOMotorDatabase, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Read several user documents keyed by id, in at most one query"""
+    unit_of_work = current_unit_of_work.get()
+    if unit_of_work is not None:
+        return await unit_of_work.get_many(user_ids)
+    users = await db.users.find({"id": {"$in": list(set(user_ids))}}).to_list(len(user_ids))
+    return {user["id"]: user for user in users}
+
+async def apply_user_update(db: AsyncIOMotorDatabase, user_id: str, update: Dict[str, Dict[str, Any]], defer: bool = True) -> bool:
+    """Update a user document; returns whether anything changed.
+
+    Within a request, deferred updates to users already in the identity map are
+    coalesced and written at commit; everything else is written now and mirrored
+    into the identity map.
+    """
+    unit_of_work = current_unit_of_work.get()
+    if unit_of_work is not None and defer and unit_of_work.is_loaded(user_id):
+        return unit_of_work.defer(user_id, update)
+
+    result = await db.users.update_one({"id": user_id}, update)
+    mirror_user_update(user_id, update)
+    return result.modified_count > 0
+
+def mirror_user_update(user_id: str, update: Dict[str, Dict[str, Any]]):
+    """Reflect a write made elsewhere into the request's identity map"""
+    unit_of_work = current_unit_of_work.get()
+    if unit_of_work is not None:
+        unit_of_work.apply(user_id, update)
@@ -0,0 +1,45 @@
+import os
+from typing import Any, Dict, Iterable, List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from cache import LRUCache
+from models import UserSummary
+
+# Mongo projection fetching exactly the UserSummary fields
+USER_SUMMARY_PROJECTION = {"_id": 0, **{field: 1 for field in UserSummary.model_fields}}
+
+# Shared across services; entries are dropped on profile, mode and level changes
+_summaries = LRUCache(
+    maxsize=int(os.environ.get("USER_SUMMARY_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("USER_SUMMARY_TTL", "300"))
+)
+
+def remember_user_summaries(documents: Iterable[Dict[str, Any]]) -> List[UserSummary]:
+    """Build summaries from documents read with (at least) USER_SUMMARY_PROJECTION and cache them"""
+    summaries = []
+    for document in documents:
+        summary = UserSummary(**{field: document[field] for field in UserSummary.model_fields if field in document})
+        _summaries.set(summary.id, summary)
+        summaries.append(summary)
+    return summaries
+
+async def load_user_summaries(db: AsyncIOMotorDatabase, user_ids: Iterable[str]) -> Dict[str, UserSummary]:
+    """Display fields for several users keyed by id; cache misses cost one projected query"""
+    user_ids = list(dict.fromkeys(user_ids))
+    summaries = {}
+    missing = []
+    for user_id in user_ids:
+        summary = _summaries.get(user_id)
+        if summary is None:
+            missing.append(user_id)
+        else:
+            summaries[user_id] = summary
+
+    if missing:
+        documents = await db.users.find({"id": {"$in": missing}}, USER_SUMMARY_PROJECTION).to_list(len(missing))
+        for summary in remember_user_summaries(documents):
+            summaries[summary.id] = summary
+
+    return {user_id: summaries[user_id] for user_id in user_ids if user_id in summaries}
+
+def invalidate_user_summary(user_id: str):
+    _summaries.pop(user_id)
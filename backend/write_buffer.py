@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import InsertOne, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+class WriteBehindBuffer:
+    """Coalesce fire-and-forget writes into unordered bulk_write batches per collection.
+
+    Writes that fail are retried on later flushes, up to `max_attempts` times,
+    and then stored in the `dead_letters` collection instead of being dropped.
+    Duplicate-key failures are not retried: the document is already there.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, max_batch: int = 500, flush_interval: float = 0.25, max_pending: int = 10000, max_attempts: int = 5, dead_letters: str = "write_buffer_dead_letters"):
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.dead_letters = dead_letters
+
+        # (collection, operation, description, failed attempts so far); the
+        # description holds the operation's arguments for the dead-letter store
+        self.pending: List[Tuple[str, Any, Dict[str, Any], int]] = []
+        self.batch_ready = asyncio.Event()
+        self.space_available = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.running = False
+
+    def start(self):
+        """Start the background flusher; until then writes go straight to Mongo"""
+        if not self.running:
+            self.running = True
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and drain everything still buffered, retries included"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.batch_ready.set()
+        await self.task
+        while self.pending:
+            await self.flush()
+            if self.pending:
+                await asyncio.sleep(self.flush_interval)
+
+    async def insert(self, collection: str, document: Dict[str, Any]):
+        await self.write(collection, InsertOne(document), {"operation": "InsertOne", "doc": document})
+
+    async def update_one(self, collection: str, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False):
+        await self.write(
+            collection,
+            UpdateOne(filter, update, upsert=upsert),
+            {"operation": "UpdateOne", "filter": filter, "update": update, "upsert": upsert}
+        )
+
+    async def update_many(self, collection: str, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False):
+        await self.write(
+            collection,
+            UpdateMany(filter, update, upsert=upsert),
+            {"operation": "UpdateMany", "filter": filter, "update": update, "upsert": upsert}
+        )
+
+    async def write(self, collection: str, operation: Any, description: Dict[str, Any]):
+        """Queue a pymongo write operation along with a BSON-storable description of its arguments"""
+        if not self.running:
+            await self.db[collection].bulk_write([operation])
+            return
+
+        # Backpressure: callers wait while the buffer is full
+        while len(self.pending) >= self.max_pending:
+            self.space_available.clear()
+            self.batch_ready.set()
+            await self.space_available.wait()
+
+        self.pending.append((collection, operation, description, 0))
+        if len(self.pending) >= self.max_batch:
+            self.batch_ready.set()
+
+    async def flush(self):
+        """Write out everything buffered so far; failed writes wait for the next flush"""
+        async with self.flush_lock:
+            retry = []
+            while self.pending:
+                batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+                self.space_available.set()
+                retry += await self._write_batch(batch)
+            self.pending[:0] = retry
+
+    async def _run(self):
+        while self.running:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing write buffer: {e}")
+
+    async def _write_batch(self, batch: List[Tuple[str, Any, Dict[str, Any], int]]) -> List[Tuple[str, Any, Dict[str, Any], int]]:
+        """Write one batch, returning the entries to retry"""
+        by_collection: Dict[str, List[Tuple[str, Any, Dict[str, Any], int]]] = {}
+        for entry in batch:
+            by_collection.setdefault(entry[0], []).append(entry)
+
+        failed: List[Tuple[Tuple[str, Any, Dict[str, Any], int], str]] = []
+        for collection, entries in by_collection.items():
+            try:
+                await self.db[collection].bulk_write([entry[1] for entry in entries], ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") != DUPLICATE_KEY:
+                        failed.append((entries[error["index"]], error.get("errmsg", "")))
+            except PyMongoError as e:
+                logger.warning(f"Buffered bulk write to {collection} failed, will retry: {e}")
+                failed += [(entry, str(e)) for entry in entries]
+
+        retry, dead = [], []
+        for (collection, operation, description, attempts), error in failed:
+            if attempts + 1 < self.max_attempts:
+                retry.append((collection, operation, description, attempts + 1))
+            else:
+                dead.append({"collection": collection, **description, "error": error, "attempts": attempts + 1, "failed_at": datetime.utcnow()})
+
+        if dead:
+            await self._dead_letter(dead)
+        return retry
+
+    async def _dead_letter(self, records: List[Dict[str, Any]]):
+        try:
+            await self.db[self.dead_letters].insert_many(records, ordered=False)
+            logger.error(f"Moved {len(records)} buffered writes to {self.dead_letters} after {self.max_attempts} attempts")
+        except PyMongoError as e:
+            logger.error(f"Could not dead-letter {len(records)} buffered writes ({e}): {records}")
@@ -4,11 +4,60 @@ import random
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReplaceOne
 from models import *
+from unit_of_work import load_user
+from write_buffer import WriteBehindBuffer
+from user_summaries import load_user_summaries
+
+VR_ROLLUP_CHECKPOINT = "vr_interaction_days"
+
+def add_to_day(days: Dict[str, Dict[str, Any]], interaction: Dict[str, Any]):
+    """Fold one raw interaction into its user's rollup for that UTC day"""
+    timestamp = interaction["timestamp"]
+    day_start = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_id = f"{interaction['user_id']}:{day_start:%Y-%m-%d}"
+    day = days.get(day_id)
+    if day is None:
+        day = days[day_id] = {
+            "user_id": interaction["user_id"],
+            "day": day_start,
+            "count": 0,
+            "first": timestamp,
+            "last": timestamp,
+            "spaces": [],
+            "interaction_types": {}
+        }
+    
+    day["count"] += 1
+    day["first"] = min(day["first"], timestamp)
+    day["last"] = max(day["last"], timestamp)
+    if interaction["space_id"] not in day["spaces"]:
+        day["spaces"].append(interaction["space_id"])
+    itype = interaction["interaction_type"]
+    day["interaction_types"][itype] = day["interaction_types"].get(itype, 0) + 1
 
 class XRService:
-    def __init__(self, db: AsyncIOMotorDatabase):
+    indexes = [
+        ("virtual_spaces", [("id", 1)], {"unique": True}),
+        ("avatars", [("id", 1)], {"unique": True}),
+        ("avatars", [("user_id", 1), ("is_default", 1)], {}),
+        ("shared_experiences", [("id", 1)], {"unique": True}),
+        ("vr_interactions", [("user_id", 1), ("timestamp", -1)], {}),
+        # Raw VR telemetry is only kept for 180 days; lifetime stats come from the daily rollups
+        ("vr_interactions", [("timestamp", 1)], {"expireAfterSeconds": 180 * 24 * 3600}),
+        ("vr_interaction_days", [("user_id", 1), ("day", 1)], {}),
+        ("notifications", [("user_id", 1), ("created_at", -1)], {}),
+        # Read notifications expire after 30 days, unread ones are kept
+        ("notifications", [("created_at", 1)], {
+            "expireAfterSeconds": 30 * 24 * 3600,
+            "partialFilterExpression": {"is_read": True}
+        })
+    ]
+    
+    def __init__(self, db: AsyncIOMotorDatabase, write_buffer: Optional[WriteBehindBuffer] = None):
         self.db = db
+        self.write_buffer = write_buffer or WriteBehindBuffer(db)
         
         # VR Environment templates
         self.environment_templates = {
@@ -180,7 +229,7 @@ class XRService:
             return Avatar(**avatar_data)
         
         # Create default avatar if none exists
-        user = await self.db.users.find_one({"id": user_id})
+        user = await load_user(self.db, user_id)
         if not user:
             return None
         
@@ -414,17 +463,18 @@ class XRService:
         participant_ids = space.get("current_participants", [])
         participants = []
         
+        users = await load_user_summaries(self.db, participant_ids)
         for user_id in participant_ids:
-            user = await self.db.users.find_one({"id": user_id})
+            user = users.get(user_id)
             avatar = await self.get_user_avatar(user_id)
             
             if user and avatar:
                 participants.append({
                     "user_id": user_id,
-                    "username": user.get("username"),
-                    "display_name": user.get("display_name"),
+                    "username": user.username,
+                    "display_name": user.display_name,
                     "avatar": avatar.dict(),
-                    "current_mode": user.get("current_mode", "echoverse")
+                    "current_mode": user.current_mode
                 })
         
         return participants
@@ -441,75 +491,108 @@ class XRService:
             "timestamp": datetime.utcnow()
         }
         
-        await self.db.vr_interactions.insert_one(interaction)
+        await self.write_buffer.insert("vr_interactions", interaction)
         
         # Update user's VR engagement metrics
-        await self.db.users.update_one(
+        await self.write_buffer.update_one(
+            "users",
             {"id": user_id},
             {
                 "$inc": {"vr_interaction_count": 1},
-                "$set": {"last_vr_session": datetime.utcnow()}
+                "$set": {"last_vr_session": interaction["timestamp"]}
             }
         )
     
+    async def rollup_vr_interactions(self) -> int:
+        """Roll raw VR interactions of closed days up into per-user, per-day documents.
+
+        Days are rebuilt from the raw interactions and replaced, so a rerun is
+        harmless, and the first run covers every day still retained. The last
+        hour stays raw in case buffered writes for the previous day are late.
+        """
+        checkpoint = await self.db.job_checkpoints.find_one({"_id": VR_ROLLUP_CHECKPOINT}) or {}
+        day_start = checkpoint.get("rolled_until")
+        until = (datetime.utcnow() - timedelta(hours=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        if day_start is None:
+            oldest = await self.db.vr_interactions.find_one({}, {"_id": 0, "timestamp": 1}, sort=[("timestamp", 1)])
+            day_start = oldest["timestamp"].replace(hour=0, minute=0, second=0, microsecond=0) if oldest else until
+        
+        # One day at a time, checkpointed, so a first run over the whole retention stays small
+        rolled = 0
+        while day_start < until:
+            day_end = day_start + timedelta(days=1)
+            days = {}
+            async for interaction in self.db.vr_interactions.find(
+                {"timestamp": {"$gte": day_start, "$lt": day_end}},
+                {"_id": 0, "user_id": 1, "space_id": 1, "interaction_type": 1, "timestamp": 1}
+            ):
+                add_to_day(days, interaction)
+            
+            operations = [ReplaceOne({"_id": day_id}, day, upsert=True) for day_id, day in days.items()]
+            for start in range(0, len(operations), 1000):
+                await self.db.vr_interaction_days.bulk_write(operations[start:start + 1000], ordered=False)
+            rolled += len(operations)
+            
+            await self.db.job_checkpoints.update_one(
+                {"_id": VR_ROLLUP_CHECKPOINT},
+                {"$set": {"rolled_until": day_end, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+            day_start = day_end
+        
+        return rolled
+    
     async def get_vr_analytics(self, user_id: str) -> Dict[str, Any]:
-        """Get VR usage analytics for user"""
+        """Get lifetime VR usage analytics for user, from daily rollups plus the days not yet rolled up"""
+        checkpoint = await self.db.job_checkpoints.find_one({"_id": VR_ROLLUP_CHECKPOINT}) or {}
+        rolled_until = checkpoint.get("rolled_until")
         
-        # Get VR interactions
-        interactions = await self.db.vr_interactions.find({
-            "user_id": user_id
-        }).to_list(1000)
+        days = {}
+        if rolled_until is not None:
+            for day in await self.db.vr_interaction_days.find({"user_id": user_id, "day": {"$lt": rolled_until}}).to_list(None):
+                days[day["_id"]] = day
+        
+        recent = {"user_id": user_id}
+        if rolled_until is not None:
+            recent["timestamp"] = {"$gte": rolled_until}
+        async for interaction in self.db.vr_interactions.find(recent, {"_id": 0, "user_id": 1, "space_id": 1, "interaction_type": 1, "timestamp": 1}):
+            add_to_day(days, interaction)
         
         # Calculate metrics
-        total_interactions = len(interactions)
-        spaces_visited = len(set(i["space_id"] for i in interactions))
+        total_interactions = sum(day["count"] for day in days.values())
+        spaces_visited = len(set().union(*(day["spaces"] for day in days.values())))
         
         interaction_types = {}
-        for interaction in interactions:
-            itype = interaction["interaction_type"]
-            interaction_types[itype] = interaction_types.get(itype, 0) + 1
-        
-        # Get time spent in VR (estimated)
-        session_duration = 0
-        if interactions:
-            sessions = {}
-            for interaction in interactions:
-                date = interaction["timestamp"].date()
-                if date not in sessions:
-                    sessions[date] = []
-                sessions[date].append(interaction["timestamp"])
-            
-            for date, timestamps in sessions.items():
-                if len(timestamps) > 1:
-                    session_duration += (max(timestamps) - min(timestamps)).total_seconds() / 60
+        for day in days.values():
+            for itype, count in day["interaction_types"].items():
+                interaction_types[itype] = interaction_types.get(itype, 0) + count
+        
+        # Get time spent in VR (estimated): first to last interaction of each day
+        session_duration = sum(
+            (day["last"] - day["first"]).total_seconds() / 60
+            for day in days.values()
+            if day["count"] > 1
+        )
         
         return {
             "total_interactions": total_interactions,
             "spaces_visited": spaces_visited,
             "interaction_types": interaction_types,
             "estimated_time_minutes": session_duration,
-            "average_session_interactions": total_interactions / max(len(set(i["timestamp"].date() for i in interactions)), 1),
-            "favorite_environment": self.get_most_used_environment(interactions),
+            "average_session_interactions": total_interactions / max(len(days), 1),
+            "favorite_environment": self.get_most_used_environment(interaction_types),
             "vr_engagement_score": min(100, total_interactions * 2 + spaces_visited * 5)
         }
     
-    def get_most_used_environment(self, interactions: List[Dict[str, Any]]) -> str:
+    def get_most_used_environment(self, interaction_types: Dict[str, int]) -> str:
         """Get the most frequently used VR environment type"""
         
-        if not interactions:
+        if not interaction_types:
             return "none"
         
         # This would require joining with virtual_spaces collection
         # For simplicity, return the most common interaction type
-        interaction_types = {}
-        for interaction in interactions:
-            itype = interaction["interaction_type"]
-            interaction_types[itype] = interaction_types.get(itype, 0) + 1
-        
-        if interaction_types:
-            return max(interaction_types, key=interaction_types.get)
-        
-        return "cosmic"
+        return max(interaction_types, key=interaction_types.get)
 
 # Import math for calculations
 import math
@@ -19,6 +19,32 @@ import NavigationMenu from './components/NavigationMenu';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Access tokens from POST /users identify the user to the backend (e.g. for their rate-limit tier)
+const TOKEN_KEY = 'echoverse_access_token';
+
+const setAccessToken = (token) => {
+  if (token) {
+    localStorage.setItem(TOKEN_KEY, token);
+    axios.defaults.headers.common['Authorization'] = `Bearer ${token}`;
+  } else {
+    localStorage.removeItem(TOKEN_KEY);
+    delete axios.defaults.headers.common['Authorization'];
+  }
+};
+
+const refreshAccessToken = async (userId) => {
+  const savedToken = localStorage.getItem(TOKEN_KEY);
+  if (!savedToken) return;
+  setAccessToken(savedToken);
+  try {
+    const response = await axios.post(`${API}/users/${userId}/token`);
+    setAccessToken(response.data.access_token);
+  } catch (error) {
+    // Expired or revoked: carry on without one
+    setAccessToken(null);
+  }
+};
+
 // Global Context
 const AppContext = createContext();
 
@@ -40,6 +66,7 @@ const AppProvider = ({ children }) => {
       // Check for existing user in localStorage
       const savedUserId = localStorage.getItem('echoverse_user_id');
       if (savedUserId) {
+        await refreshAccessToken(savedUserId);
         const response = await axios.get(`${API}/users/${savedUserId}`);
         setUser(response.data);
         setCurrentMode(response.data.current_mode);
@@ -62,8 +89,10 @@ const AppProvider = ({ children }) => {
         email: `demo@echoverse.ai`
       };
       const response = await axios.post(`${API}/users`, demoUser);
-      setUser(response.data);
-      localStorage.setItem('echoverse_user_id', response.data.id);
+      const { access_token, ...createdUser } = response.data;
+      setAccessToken(access_token ? access_token.access_token : null);
+      setUser(createdUser);
+      localStorage.setItem('echoverse_user_id', createdUser.id);
     } catch (error) {
       console.error('Error creating demo user:', error);
     }
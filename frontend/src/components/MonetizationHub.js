@@ -120,14 +120,11 @@ const MonetizationHub = () => {
 
     try {
       const features = ['daily_ai_interactions', 'journey_steps', 'challenge_participation', 'social_connections'];
-      const accessData = {};
-
-      for (const feature of features) {
-        const response = await axios.get(`${API}/monetization/access/${user.id}/${feature}`);
-        accessData[feature] = response.data;
-      }
+      const response = await axios.get(`${API}/monetization/access/${user.id}`, {
+        params: { features: features.join(',') }
+      });
 
-      setFeatureAccess(accessData);
+      setFeatureAccess(response.data.features);
     } catch (error) {
       console.error('Error loading feature access:', error);
     }
@@ -137,8 +134,10 @@ const MonetizationHub = () => {
     if (!user) return;
 
     try {
-      const response = await axios.get(`${API}/monetization/transactions/${user.id}`);
-      setTransactions(response.data.slice(0, 10)); // Show last 10 transactions
+      const response = await axios.get(`${API}/monetization/transactions/${user.id}`, {
+        params: { limit: 10 } // Show last 10 transactions
+      });
+      setTransactions(response.data.transactions);
     } catch (error) {
       console.error('Error loading transactions:', error);
     }